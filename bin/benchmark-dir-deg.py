@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+#
+#
+# Description: Benchmarks the per-element cost of util.calc_dir_deg and winddata.calcDirDeg, comparing a Python loop
+# over scalars with a single call on the whole array. No database connection is required.
+#
+import os
+import sys
+import time
+
+dir = os.path.dirname(__file__)
+sys.path.append(os.path.join(dir, '../'))
+
+import argparse
+import numpy
+from windb2 import util
+from windb2.struct import winddata
+
+# Get the command line opts
+parser = argparse.ArgumentParser(description='Benchmarks the wind direction calculations for a synthetic wind field')
+parser.add_argument('-n', '--npoints', type=int, default=200000, help='Number of U,V pairs')
+parser.add_argument('-s', '--seed', type=int, default=0, help='Seed for the random wind field')
+args = parser.parse_args()
+
+# Create a synthetic wind field
+rng = numpy.random.RandomState(args.seed)
+u = rng.standard_normal(args.npoints) * 8
+v = rng.standard_normal(args.npoints) * 8
+u_list = u.tolist()
+v_list = v.tolist()
+out = numpy.empty(args.npoints)
+out_int = numpy.empty(args.npoints, numpy.int64)
+
+methods = (('calc_dir_deg', lambda: [util.calc_dir_deg(ui, vi) for ui, vi in zip(u_list, v_list)],
+            lambda: util.calc_dir_deg(u, v, out=out)),
+           ('calcDirDeg', lambda: [winddata.calcDirDeg(ui, vi) for ui, vi in zip(u_list, v_list)],
+            lambda: winddata.calcDirDeg(u, v, out=out_int)))
+
+print('Calculated directions for {} U,V pairs'.format(args.npoints))
+for name, scalar, array in methods:
+    start = time.perf_counter()
+    expected = scalar()
+    scalar_s = time.perf_counter() - start
+    start = time.perf_counter()
+    result = array()
+    array_s = time.perf_counter() - start
+
+    # Make sure the directions are the same
+    if not numpy.allclose(result, expected, rtol=1e-14, atol=0):
+        print('ERROR: the scalar and array {} directions differ'.format(name), file=sys.stderr)
+        sys.exit(-1)
+
+    print('{:>12}: {:.1f} ns/point scalar, {:.1f} ns/point array, {:.0f}x speedup'.format(
+        name, scalar_s / args.npoints * 1e9, array_s / args.npoints * 1e9, scalar_s / array_s))
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+#
+#
+# Description: Benchmarks the generation of the COPY rows for a WRF wind field, comparing the original per-(x,y) Python
+# loop with the vectorized text and binary blocks used by InsertWRF.insert_variable. No database connection is required.
+#
+import os
+import sys
+import time
+from datetime import datetime
+
+dir = os.path.dirname(__file__)
+sys.path.append(os.path.join(dir, '../'))
+
+import argparse
+import numpy
+import pytz
+from windb2 import util
+from windb2 import insert as windb2_insert
+from windb2.model.wrf import insert
+
+# Get the command line opts
+parser = argparse.ArgumentParser(description='Benchmarks the WRF insert row generation for a synthetic wind field')
+parser.add_argument('-x', '--nx', type=int, default=200, help='Number of grid points in the x direction')
+parser.add_argument('-y', '--ny', type=int, default=200, help='Number of grid points in the y direction')
+parser.add_argument('-n', '--heights', type=int, default=2, help='Number of heights to generate rows for')
+parser.add_argument('-s', '--seed', type=int, default=0, help='Seed for the random wind field')
+args = parser.parse_args()
+
+# Create a synthetic wind field with a few NaNs and a few masked out geomkeys
+rng = numpy.random.RandomState(args.seed)
+u = (rng.standard_normal((args.heights, args.ny, args.nx)) * 8).astype(numpy.float32)
+v = (rng.standard_normal((args.heights, args.ny, args.nx)) * 8).astype(numpy.float32)
+u[rng.random_sample(u.shape) < 0.01] = numpy.nan
+u = numpy.ma.array(u)  # netCDF4 returns masked arrays
+v = numpy.ma.array(v)
+horizGeomKey = numpy.arange(1, args.nx * args.ny + 1).reshape((args.nx, args.ny))
+horizGeomKey[rng.random_sample(horizGeomKey.shape) < 0.1] = 0
+domain_key = '1'
+t = datetime(2016, 2, 14, tzinfo=pytz.utc)
+t_str = t.strftime('%Y-%m-%d %H:%M:%S %Z')
+init_str = t_str
+
+
+def per_cell(z, height):
+    """The original per-(x,y) loop that InsertWRF.insert_variable used before vectorizing."""
+    rows = []
+    for x in range(horizGeomKey.shape[0]):
+        for y in range(horizGeomKey.shape[1]):
+            if horizGeomKey[x, y] == 0:
+                continue
+            if not (numpy.isnan(u[z, y, x]) or numpy.isnan(v[z, y, x])):
+                rows.append('{}, {}, {}, {}, {}, {}, {}\n'.format(domain_key, horizGeomKey[x, y], t_str,
+                                                                  util.speed(u[z, y, x], v[z, y, x]),
+                                                                  int(util.calc_dir_deg(-u[z, y, x], -v[z, y, x])),
+                                                                  height, init_str))
+    return ''.join(rows)
+
+
+def vectorized(z, height):
+    """The vectorized block used by InsertWRF.insert_variable."""
+    u_block = numpy.ma.filled(u[z], numpy.nan).T
+    v_block = numpy.ma.filled(v[z], numpy.nan).T
+    mask = windb2_insert.insert_mask(horizGeomKey, u_block, v_block)
+    return windb2_insert.format_rows(domain_key, horizGeomKey[mask], t_str,
+                                     *insert.wind_speed_direction(u_block[mask], v_block[mask]), height, init_str)
+
+
+def same_rows(per_cell_rows, vectorized_rows):
+    """Whether the rows are identical. NumPy 2 keeps the per-cell speeds in float32, so there the speeds are only
+    compared to float32 precision."""
+    if numpy.lib.NumpyVersion(numpy.__version__) < '2.0.0':
+        return per_cell_rows == vectorized_rows
+    a = [row.split(', ') for block in per_cell_rows for row in block.splitlines()]
+    b = [row.split(', ') for block in vectorized_rows for row in block.splitlines()]
+    if len(a) != len(b) or [row[:3] + row[4:] for row in a] != [row[:3] + row[4:] for row in b]:
+        return False
+    return numpy.allclose([float(row[3]) for row in a], [float(row[3]) for row in b], rtol=1e-6, atol=0)
+
+
+def binary(z, height):
+    """The vectorized block used by InsertWRF.insert_variable with copy_format='binary'."""
+    u_block = numpy.ma.filled(u[z], numpy.nan).T
+    v_block = numpy.ma.filled(v[z], numpy.nan).T
+    mask = windb2_insert.insert_mask(horizGeomKey, u_block, v_block)
+    speed, direction = insert.wind_speed_direction(u_block[mask], v_block[mask])
+    return windb2_insert.pgcopy_binary((int(domain_key), horizGeomKey[mask], t, speed, direction, height, t),
+                                       ('int', 'int', 'timestamptz', 'real', 'smallint', 'real', 'timestamptz'))
+
+
+# Time each method for every height
+results = {}
+for method in (per_cell, vectorized, binary):
+    start = time.perf_counter()
+    results[method.__name__] = [method(z, float(z * 10)) for z in range(args.heights)]
+    results[method.__name__ + '_s'] = time.perf_counter() - start
+
+# Make sure the rows are identical
+if not same_rows(results['per_cell'], results['vectorized']):
+    print('ERROR: the per-cell and vectorized rows differ', file=sys.stderr)
+    sys.exit(-1)
+
+npoints = args.nx * args.ny * args.heights
+print('Generated rows for {} x,y,height points'.format(npoints))
+for method in ('per_cell', 'vectorized', 'binary'):
+    print('{:>10}: {:.3f} s ({:.0f} points/s, {} bytes)'.format(method, results[method + '_s'],
+                                                                npoints / results[method + '_s'],
+                                                                sum(len(block) for block in results[method])))
+print('   speedup: {:.1f}x text, {:.1f}x binary'.format(results['per_cell_s'] / results['vectorized_s'],
+                                                        results['per_cell_s'] / results['binary_s']))
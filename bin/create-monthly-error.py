@@ -27,7 +27,7 @@ import numpy
 import datetime
 import argparse
 import logging
-from windb2 import windb2
+from windb2 import timerange, windb2
 
 # Logging
 logging.basicConfig(level=logging.DEBUG)
@@ -134,14 +134,16 @@ for domain in wrfDomains:
 
 
 
+            # Half-open range over the month so that the t index can be used
+            monthRange, monthParams = timerange.time_range('t', *timerange.month_bounds(args.year, month))
+
             # Create the histogram of the buoy
             sql = " SELECT speed FROM wind_" + str(buoyDomain) \
-                  + " WHERE date_part('month',t)=" + str(month) + \
-                  " AND date_part('year',t)=" + str(args.year) + " AND height>=" + str(args.buoyRangeLowHeight) + \
+                  + " WHERE " + monthRange + " AND height>=" + str(args.buoyRangeLowHeight) + \
                   " AND height<=" + str(args.buoyRangeHighHeight)
 
             # Execute the query
-            windb2.curs.execute(sql)
+            windb2.curs.execute(sql, monthParams)
 
             # Get the results, continuing on if there is an IndexError (means no results)
             try:
@@ -159,12 +161,11 @@ for domain in wrfDomains:
             sql = " SELECT m.speed \
                  FROM wind_" + str(domain[0]) + " m \
                  WHERE m.geomkey=" + str(wrfKey) + " AND \
-                 m.height=" + str(args.wrfHeight) + " AND \
-                 date_part('month',m.t)=" + str(month) + " AND \
-                 date_part('year',m.t)=" + str(args.year)
+                 m.height=" + str(args.wrfHeight) + " AND " + \
+                  timerange.time_range('m.t', *timerange.month_bounds(args.year, month))[0]
 
             # Execute the query
-            windb2.curs.execute(sql)
+            windb2.curs.execute(sql, monthParams)
 
             # Get the results
             timeSeriesToPlot = numpy.array(windb2.curs.fetchall())[:, 0]
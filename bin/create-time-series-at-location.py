@@ -16,11 +16,10 @@ import sys
 dir = os.path.dirname(__file__)
 sys.path.append(os.path.join(dir, '../'))
 import argparse
-from windb2.model.wrf import error
-from windb2 import windb2
+import contextlib
+from windb2 import export, nearest, windb2
 import pytz
 import datetime
-import numpy
 import csv
 
 # Set all the relevant args
@@ -31,46 +30,59 @@ parser.add_argument('dbName', help='WinDB name')
 parser.add_argument('domain', help='WRF domain')
 parser.add_argument('longitude', help='longitude is in degrees E (W is negative) and latitude is in degrees N (S is negative)')
 parser.add_argument('latitude', help='latitude in degrees')
-parser.add_argument('height', help='height in meters')
+parser.add_argument('height', help='height in meters, or a comma separated list of heights')
 parser.add_argument('startDateIncl', help='start date inclusive in ISO form e.g. 2015-10-19')
 parser.add_argument('startTimeIncl', help='start hour inclusive and minute in UTC e.g. 00:00')
 parser.add_argument('endDateExcl', help='end date exclusive includes in ISO form e.g. 2015-10-19')
 parser.add_argument('endTimeExcl', help='end hour and minute exclusive in UTC e.g. 00:00')
 parser.add_argument('-p', '--port', type=int, default='5432', help='Port for WinDB2 connection')
+parser.add_argument('-l', '--locations', help='CSV file of more longitude,latitude pairs to export, one per line')
+parser.add_argument('-o', '--output', help='Output file name, \'-\' for stdout, or a template containing {geomkey} and '
+                                           '{height} to write each location and height to its own file')
+parser.add_argument('-b', '--binary', action='store_true', help='Write the PostgreSQL binary COPY format instead of CSV')
+parser.add_argument('-g', '--gzip', action='store_true', help='Compress the output with gzip')
 args = parser.parse_args()
 
 # Extract the time stamps
 startTimeStampIncl = (datetime.datetime.strptime(args.startDateIncl + ' ' + args.startTimeIncl, "%Y-%m-%d %H:%M")).replace(tzinfo=pytz.utc)
 endTimeStampExcl = (datetime.datetime.strptime(args.endDateExcl + ' ' + args.endTimeExcl, "%Y-%m-%d %H:%M")).replace(tzinfo=pytz.utc)
 
+# Get all of the locations and heights
+locations = [(args.longitude, args.latitude)]
+if args.locations:
+    with open(args.locations) as csvfile:
+        locations += [(row[0].strip(), row[1].strip()) for row in csv.reader(csvfile) if row]
+heights = [float(height) for height in args.height.split(',')]
 
-# Open the database
+# Open the database, keeping stdout clear for the data
 windb2 = windb2.WinDB2(args.dbHost, args.dbName, args.dbUser, port=args.port)
-windb2.connect()
+with contextlib.redirect_stdout(sys.stderr):
+    windb2.connect()
 
-# Find the closest WRF point to the data
-geomKey,distanceM = error.findWRFPointNearLongLat(args.domain, args.longitude, args.latitude, windb2.curs)
+# Find the closest WRF point to all of the locations in one query
+longitudes, latitudes = zip(*[(float(longitude), float(latitude)) for longitude, latitude in locations])
+geomKeys, distancesM = nearest.nearest_geomkeys(windb2.curs, args.domain, longitudes, latitudes)
+for geomKey, distanceM, (longitude, latitude) in zip(geomKeys, distancesM, locations):
+    if not geomKey:
+        sys.exit("ERROR: No WRF points returned near the long,lat=" + longitude + "," + latitude)
 
-# Info
-print("Found a data point geomkey=", geomKey, " in domain=", args.domain, " ", distanceM, "-meters from the long,lat=", args.longitude, ",", args.latitude)
+    # Info
+    print("Found a data point geomkey=", geomKey, " in domain=", args.domain, " ", distanceM, "-meters from the long,lat=", longitude, ",", latitude, file=sys.stderr)
+geomKeys = geomKeys.tolist()
 
-# Get the buoy stats
-sql = "SELECT t as t_utc, speed as speed_mps, direction " + \
-             "FROM wind_" + str(args.domain) + " " + \
-             "WHERE geomkey=" + str(geomKey) + " AND height=" + str(args.height) + \
-                  " AND t>='" + str(startTimeStampIncl) + "' AND t<timestamp'" + str(endTimeStampExcl) + "' " + \
-             "ORDER BY t_utc"
-print("Executing: ", sql)
-windb2.curs.execute(sql)
-windSpeeds = numpy.array(windb2.curs.fetchall())
+# Label the rows with the location and height if there is more than one
+columns = ['t as t_utc', 'speed as speed_mps', 'direction']
+if len(geomKeys) > 1 or len(heights) > 1:
+    columns = ['geomkey', 'height'] + columns
 
-# Create the CSV file
-outputName = 'wind-time-series-' + args.dbHost + '-' + args.dbName + '-domain-' + args.domain + '-height-' + \
-             args.height + 'm-' + args.longitude + ','  + args.latitude + \
-              str(startTimeStampIncl).replace(' ','_') + '-to-' + str(endTimeStampExcl).replace(' ','_') + '.csv'
-with open(outputName, 'w') as csvfile:
-    fieldNames = ['t_utc', 'speed_mps', 'direction']
-    csvWriter = csv.DictWriter(csvfile, quotechar="'", quoting=csv.QUOTE_MINIMAL, fieldnames=fieldNames)
-    csvWriter.writeheader()
-    for row in windSpeeds:
-        csvWriter.writerow({'t_utc': row[0], 'speed_mps': row[1], 'direction': row[2]})
\ No newline at end of file
+# Create the output file
+outputName = args.output
+if outputName is None:
+    outputName = 'wind-time-series-' + args.dbHost + '-' + args.dbName + '-domain-' + args.domain + '-height-' + \
+                 args.height + 'm-' + args.longitude + ','  + args.latitude + \
+                  str(startTimeStampIncl).replace(' ','_') + '-to-' + str(endTimeStampExcl).replace(' ','_') + \
+                 ('.bin' if args.binary else '.csv') + ('.gz' if args.gzip else '')
+elif outputName == '-':
+    outputName = sys.stdout.buffer
+export.export_timeseries(windb2.curs, args.domain, geomKeys, heights, startTimeStampIncl, endTimeStampExcl, outputName,
+                         columns=columns, export_format='binary' if args.binary else 'csv', compress=args.gzip)
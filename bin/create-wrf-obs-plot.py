@@ -39,7 +39,8 @@ import pytz
 import numpy.ma as ma
 import numpy.fft
 import re
-from windb2 import windb2
+from windb2 import timerange, windb2
+from windb2.windb2 import EPOCH_US_SQL, fetch_array
 from windb2.model.wrf import error, plot
 import matplotlib.dates as mdates
 import matplotlib.dates as mdates
@@ -116,33 +117,37 @@ sql = """CREATE TEMP TABLE times AS SELECT generate_series(timestamp'""" + start
 print(sql)
 windb2.curs.execute(sql)
                                                            
+# Filter on the half-open time range up to just after the inclusive end time so that the t index can be used
+timeRange, timeParams = timerange.time_range('t', startDateTime, endDateTime + timedelta(microseconds=1))
+
+# Columns of the obs and WRF data, where missing speeds are NaNs and missing directions are blank
+dataType = [('t_plot_tz', 'datetime64[us]'), ('t', 'datetime64[us]'), ('speed', numpy.float64), ('direction', 'U3')]
+
 # Get the obs data at the frequency of the obs data, rounding to the nearest observation period
-sql = """SELECT times.t at time zone 'UTC' at time zone '""" + args.plotTimeZone + """' as t_plot_tz, times.t as t,
-                speed*""" + str(knotConversion) + """, winddir(direction)
+sql = """SELECT """ + EPOCH_US_SQL.format("""times.t at time zone 'UTC' at time zone '""" + args.plotTimeZone + """'""") + """ as t_plot_tz,
+                """ + EPOCH_US_SQL.format('times.t') + """ as t,
+                speed*""" + str(knotConversion) + """, coalesce(winddir(direction), '')
          FROM times LEFT JOIN 
              (SELECT date_round(t at time zone 'UTC','""" + str(args.obsPeriodSec) + """ second') as t_round, * 
               FROM wind_""" + str(obsDomainKey) + """
-              WHERE t at time zone 'UTC'>=timestamp'""" + startDateInclStr + """' AND
-                    t at time zone 'UTC'<=timestamp'""" + endDateInclStr + """' AND
+              WHERE """ + timeRange + """ AND
                     height=""" + str(args.obsHeight) + """) as obs ON times.t=obs.t_round"""
 print(sql)
-windb2.curs.execute(sql)
-obsData = numpy.array(windb2.curs.fetchall())
+obsData = fetch_array(windb2.conn, sql, dataType, timeParams)
 
 # Get the WRF data at the frequency of the obs data
 # Convert the UTC TIME ZONE to the desired TIME ZONE
-sql = """SELECT times.t at time zone 'UTC' at time zone '""" + args.plotTimeZone + """' as t_plot_tz, times.t as t,
-                speed*""" + str(knotConversion) + """, winddir(direction)
+sql = """SELECT """ + EPOCH_US_SQL.format("""times.t at time zone 'UTC' at time zone '""" + args.plotTimeZone + """'""") + """ as t_plot_tz,
+                """ + EPOCH_US_SQL.format('times.t') + """ as t,
+                speed*""" + str(knotConversion) + """, coalesce(winddir(direction), '')
          FROM times LEFT JOIN
              (SELECT *
               FROM wind_""" + str(args.wrfDomainKey) + """
-              WHERE t at time zone 'UTC'>=timestamp'""" + startDateInclStr + """' AND 
-                    t at time zone 'UTC'<=timestamp'""" + endDateInclStr + """' AND 
+              WHERE """ + timeRange + """ AND 
                     height=""" + args.wrfHeight + wrfKeyNearObsSql + """) as w
               ON times.t=w.t"""
 print(sql)
-windb2.curs.execute(sql)
-wrfData = numpy.array(windb2.curs.fetchall())
+wrfData = fetch_array(windb2.conn, sql, dataType, timeParams)
 
 # Make sure there were some results to plot
 if obsData.size == 0 or wrfData.size == 0:
@@ -166,46 +171,46 @@ heightCount = 1
         
 # Create the moving average
 if int(args.obsPeriodSec) < 360:
-  movingAvg = movingAverageFromMovingWindow(numpy.array(windb2.util.none2NaN(obsData[:, 2]), dtype=numpy.float), 360, 0.05)
+  movingAvg = movingAverageFromMovingWindow(obsData['speed'], 360, 0.05)
 else:
   # No moving average required if the obsPeriodSec is >= 360 s
-  movingAvg = numpy.array(windb2.util.none2NaN(obsData[:, 2]))
+  movingAvg = numpy.array(obsData['speed'])
   movingAvg = ma.masked_where(numpy.isnan(movingAvg), movingAvg)
 
 # Masks for the directions annotations, where the data are above 2.5 knots (above "calm and variable")
-wrfMask = numpy.array(wrfData[:,2], dtype=numpy.float)>=2.5/1.94384
-obsMask = numpy.logical_and(wrfMask, numpy.array(obsData[:,2], dtype=numpy.float)>=2.5/1.94384)
+wrfMask = wrfData['speed']>=2.5/1.94384
+obsMask = numpy.logical_and(wrfMask, obsData['speed']>=2.5/1.94384)
 
 # Plot the obs data and moving average
 if int(args.obsPeriodSec) < 360:
-    ax1.plot_date(obsData[:,0],[obsMask],
-                  obsData[:,2][obsMask],'-',alpha=0.2)
-    ax1.plot_date(obsData[:,0],movingAvg,'-', color='green')
+    ax1.plot_date(obsData['t_plot_tz'],[obsMask],
+                  obsData['speed'][obsMask],'-',alpha=0.2)
+    ax1.plot_date(obsData['t_plot_tz'],movingAvg,'-', color='green')
 else:
-    ax1.plot_date(obsData[:,0][obsMask],obsData[:,2][obsMask],'-', color='green')
+    ax1.plot_date(obsData['t_plot_tz'][obsMask],obsData['speed'][obsMask],'-', color='green')
 
 # Plot the WRF data
-ax1.plot_date(wrfData[:,0][wrfMask],
-              wrfData[:,2][wrfMask],
+ax1.plot_date(wrfData['t_plot_tz'][wrfMask],
+              wrfData['speed'][wrfMask],
               '-.', linewidth=3.0, color='red')
 
 # Annotate the WRF and obs time series if a outputLong-term average
 if int(args.obsPeriodSec) >= 360:
   
   # Get rid of the first directions because the obscure the y-axis text
-  wrfData[0,3] = ''
-  obsData[0,3] = ''
+  wrfData['direction'][0] = ''
+  obsData['direction'][0] = ''
 
   # Label WRF data
-  for x, y, label in zip(mdates.date2num(wrfData[:,0][wrfMask]),
-                       wrfData[:,2][wrfMask],
-                       wrfData[:,3][wrfMask]):
+  for x, y, label in zip(mdates.date2num(wrfData['t_plot_tz'][wrfMask]),
+                       wrfData['speed'][wrfMask],
+                       wrfData['direction'][wrfMask]):
       ax1.annotate(label, xy=(x,y), color='red', ha='center')
   
   # Label obs data
-  for x, y, label in zip(mdates.date2num(obsData[:,0][obsMask]),
-                       obsData[:,2][obsMask],
-                       obsData[:,3][obsMask]):
+  for x, y, label in zip(mdates.date2num(obsData['t_plot_tz'][obsMask]),
+                       obsData['speed'][obsMask],
+                       obsData['direction'][obsMask]):
       ax1.annotate(label, xy=(x,y), color='black', ha='center')
 
 # Show only hour and minute on the x-axis
@@ -219,18 +224,19 @@ plt.savefig(outputName + '.svg',dpi=150,bbox_inches='tight')
 
 # Calculate error statistic and write out to file
 statsFile = open(outputName + '.tex','w')
-commonDataPoints = numpy.logical_and(numpy.array(wrfData[:,2],dtype=numpy.bool),movingAvg>=0)
-wrfMinusMovingAvg = numpy.array(wrfData[:,2][commonDataPoints] - movingAvg[commonDataPoints],dtype=numpy.double)
+wrfHasSpeed = numpy.nan_to_num(wrfData['speed']) != 0
+commonDataPoints = numpy.logical_and(wrfHasSpeed,movingAvg>=0)
+wrfMinusMovingAvg = numpy.array(wrfData['speed'][commonDataPoints] - movingAvg[commonDataPoints],dtype=numpy.double)
 rmse = numpy.sqrt(numpy.sum(numpy.power(wrfMinusMovingAvg,2)/wrfMinusMovingAvg.shape[-1]))
 print('Start time: ', startDateInclStr, '\\newline', file=statsFile)
 print('End time: ', endDateInclStr, '\\newline', file=statsFile)
-print('RMSE computed with ', wrfData[:,2][commonDataPoints].shape[-1], ' points.\\newline', file=statsFile)
+print('RMSE computed with ', wrfData['speed'][commonDataPoints].shape[-1], ' points.\\newline', file=statsFile)
 print('RMSE=', format(rmse, '.2f'), '$ms^{-1}$', '\\newline', file=statsFile)
-print('STDDEV\_OBS HIGH FREQ=', format(numpy.std(numpy.array(obsData[:,2],dtype=numpy.float)), '.2f'), '$ms^{-1}$\\newline', file=statsFile)
+print('STDDEV\_OBS HIGH FREQ=', format(numpy.std(obsData['speed']), '.2f'), '$ms^{-1}$\\newline', file=statsFile)
 if float(args.obsPeriodSec) < 360:
   print('STDDEV\_OBS MOV AVG=', format(numpy.std(movingAvg[movingAvg>=0]), '.2f'), '$ms^{-1}$\\newline', file=statsFile)
-print('STDDEV\_WRF=', format(numpy.std(wrfData[:,2][numpy.array(wrfData[:,2],dtype=numpy.bool)]), '.2f'), '$ms^{-1}$\\newline', file=statsFile)
-print('STDDEV COMMON POINTS=', format(numpy.std(wrfData[:,2][commonDataPoints]), '.2f'), '$ms^{-1}$\\newline', file=statsFile)
-print('MEAN\_OBS HIGH FREQ=', format(numpy.mean(numpy.array(obsData[:,2],dtype=float)), '.2f'), '$ms^{-1}$\\newline', file=statsFile)
-print('MEAN\_WRF=', format(numpy.mean(wrfData[:,2][numpy.array(wrfData[:,2],dtype=numpy.bool)]), '.2f'), '$ms^{-1}$', file=statsFile)
+print('STDDEV\_WRF=', format(numpy.std(wrfData['speed'][wrfHasSpeed]), '.2f'), '$ms^{-1}$\\newline', file=statsFile)
+print('STDDEV COMMON POINTS=', format(numpy.std(wrfData['speed'][commonDataPoints]), '.2f'), '$ms^{-1}$\\newline', file=statsFile)
+print('MEAN\_OBS HIGH FREQ=', format(numpy.mean(obsData['speed']), '.2f'), '$ms^{-1}$\\newline', file=statsFile)
+print('MEAN\_WRF=', format(numpy.mean(wrfData['speed'][wrfHasSpeed]), '.2f'), '$ms^{-1}$', file=statsFile)
 statsFile.close()
@@ -6,20 +6,14 @@
 #
 import os
 import sys
-import re
-import configparser
 
 dir = os.path.dirname(__file__)
 sys.path.append(os.path.join(dir, '../'))
 
-from netCDF4 import Dataset
 import argparse
 from windb2 import windb2
 from windb2.model.gfs import insert, config
 import logging
-import cfgrib
-from cfgrib import xarray_store
-import xarray
 
 # Get the command line opts
 parser = argparse.ArgumentParser()
@@ -33,6 +27,8 @@ parser.add_argument("-m", "--mask", help="Name of a 2D PostGIS polygon table in
 parser.add_argument('-p', '--port', type=int, default='5432', help='Port for WinDB2 connection')
 parser.add_argument('-z', '--zero_seconds', action='store_true',
                     help='Always set WRF time seconds to zero (stops WRF time creep)')
+parser.add_argument('-b', '--binary', action='store_true',
+                    help='Send the rows to PostgreSQL in the binary COPY format instead of text')
 group = parser.add_mutually_exclusive_group(required=True)
 group.add_argument("-d", "--domain_key", type=str, help="Existing domain key in the WinDB2")
 group.add_argument("-n", "--new", action="store_false", help="Create a new WinDB2 domain")
@@ -60,27 +56,8 @@ logging.basicConfig()
 # Create the inserter from this config
 inserter = insert.InsertGFS(windb2, windb2_config)
 
-# Insert the file, domainKey should be None if it wasn't set, which will create a new domain
-for var in windb2_config.config['vars']:
-    var_config = windb2_config.config['vars'][var]
-    if isinstance(var_config['insert'], list):  # will fail if insert does not exist
-
-        # Debug
-        logger.debug(cfgrib.open_datasets(args.gribfile))
-
-        # Calculate the level required
-        backend_kwargs = {'filter_by_keys': {'typeOfLevel': var_config['cfgribTypeOfLevel']}}
-        # if var_config['insert'][0] != 0:
-        backend_kwargs['filter_by_keys']['level'] = var_config['insert'][0]
-
-        # Open the GRIB2 file using cfgrib
-        logger.debug('Trying to open variable: {}'.format(var))
-        with xarray.open_dataset(args.gribfile, engine='cfgrib', backend_kwargs=backend_kwargs) as gribfile:
-            (times_inserted, domain_key_returned) = inserter.insert_variable(gribfile, var, windb2_config.config['vars'][var]['cfVarName'],
-                                                                             domain_key=args.domain_key,
-                                                                             replace_data=args.overwrite,
-                                                                             mask=args.mask)
-
-    # Set the domain key so that we don't create the same domain twice
-    if not args.domain_key:
-        args.domain_key = domain_key_returned
+# Insert every variable in the config from the file, which is only opened and decoded once. domain_key should be None
+# if it wasn't set, which will create a new domain.
+times_inserted, domain_key_returned = inserter.insert_file(args.gribfile, domain_key=args.domain_key,
+                                                           replace_data=args.overwrite, mask=args.mask,
+                                                           copy_format='binary' if args.binary else 'text')
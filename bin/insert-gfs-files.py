@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+#
+#
+# Description: Inserts the GRIB files of a GFS cycle into a WinDB2 in parallel. Each forecast hour's file is opened once
+# and every variable in windb2-gfs.json is inserted from it. The files are spread over a pool of worker processes, each
+# with its own WinDB2 connection. The first file is inserted before the workers start, creating the domain if needed, so
+# all of the files have to be on the same grid.
+#
+# Returns -1 if any variable in any file failed to insert.
+#
+import os
+import sys
+
+dir = os.path.dirname(__file__)
+sys.path.append(os.path.join(dir, '../'))
+
+import argparse
+from windb2.model.gfs import batchinsert
+from windb2.model.wrf.batchinsert import expand_inputs, summarize
+import logging
+
+# Get the command line opts
+parser = argparse.ArgumentParser()
+parser.add_argument("db_host", type=str, help="Database hostname")
+parser.add_argument("db_user", type=str, help="Database username")
+parser.add_argument("db_name", type=str, help="Database name")
+parser.add_argument("gribfiles", type=str, nargs='*', help="GFS GRIB files or quoted glob patterns")
+parser.add_argument("-f", "--manifest", type=str, help="File listing one GRIB file or glob pattern per line")
+parser.add_argument("-w", "--workers", type=int, help="Number of worker processes (default is the number of CPUs)")
+parser.add_argument("-o", "--overwrite", help="Replace data if the data for the time exists in the WinDB2",
+                    action="store_true")
+parser.add_argument("-m", "--mask", help="Name of a 2D PostGIS polygon table in the WinDB2 to be use for a mask.")
+parser.add_argument('-p', '--port', type=int, default='5432', help='Port for WinDB2 connection')
+parser.add_argument('-b', '--binary', action='store_true',
+                    help='Send the rows to PostgreSQL in the binary COPY format instead of text')
+group = parser.add_mutually_exclusive_group(required=True)
+group.add_argument("-d", "--domain_key", type=str, help="Existing domain key in the WinDB2")
+group.add_argument("-n", "--new", action="store_false", help="Create a new WinDB2 domain")
+args = parser.parse_args()
+
+# Set up logging
+logger = logging.getLogger('windb2')
+logger.setLevel(logging.INFO)
+logging.basicConfig()
+
+# Get the files to insert
+gribfiles = expand_inputs(args.gribfiles, args.manifest)
+if not gribfiles:
+    parser.error('No GRIB files or manifest given')
+
+# Insert all of the files
+domain_key, results = batchinsert.insert_files(gribfiles, args.db_host, args.db_name, db_user=args.db_user,
+                                               port=args.port, domain_key=args.domain_key, mask=args.mask,
+                                               workers=args.workers, replace_data=args.overwrite,
+                                               copy_format='binary' if args.binary else 'text')
+
+# Report the throughput of each file in the order the files were given
+print('Inserted into domain {}'.format(domain_key))
+for filename, rows, seconds, failed in summarize(results):
+    rate = rows / seconds if seconds > 0 else float('nan')
+    print('{}: {} rows in {:.1f} s ({:.0f} rows/s){}'.format(filename, rows, seconds, rate,
+                                                             ', FAILED: ' + ', '.join(failed) if failed else ''))
+
+# Report the failures in the same order
+failures = [result for result in results if result.error is not None]
+for result in failures:
+    print('\nERROR inserting {} from {}:\n{}'.format(result.var_name, result.filename, result.error), file=sys.stderr)
+if failures:
+    print('{} of {} inserts failed'.format(len(failures), len(results)), file=sys.stderr)
+    sys.exit(-1)
@@ -39,6 +39,7 @@ parser.add_argument("db_name", type=str, help="Database name")
 parser.add_argument("ncfile", type=str, help="SUNTANS netCDF file")
 parser.add_argument("-r","--replace", help="Replace data if the data for the time exists in the WinDB2", action="store_true")
 parser.add_argument("-w", "--where",  type=str, default="true", help="SQL where statement to exclude times")
+parser.add_argument("-b", "--binary", help="Send the rows to PostgreSQL in the binary COPY format instead of text", action="store_true")
 group = parser.add_mutually_exclusive_group()
 group.add_argument("-d", "--domainKey", help="Existing domain key in the WinDB")
 group.add_argument("-n", "--new", action="store_true")
@@ -52,5 +53,6 @@ windb2.connect()
 ncFile = nc.netcdf_file(args.ncfile, 'r')
 
 # Insert the file, domainKey should be None if it wasn't set, which will create a new domain
-suntans.insertNcFile(windb2, ncFile, domainKey=args.domainKey, replaceData=args.replace, sqlWhere=args.where)
+suntans.insertNcFile(windb2, ncFile, domainKey=args.domainKey, replaceData=args.replace, sqlWhere=args.where,
+                     copyFormat='binary' if args.binary else 'text')
 
@@ -39,6 +39,8 @@ parser.add_argument("-m", "--mask", help="Name of a 2D PostGIS polygon table in
 parser.add_argument('-p', '--port', type=int, default='5432', help='Port for WinDB2 connection')
 parser.add_argument('-z', '--zero_seconds', action='store_true',
                     help='Always set WRF time seconds to zero (stops WRF time creep)')
+parser.add_argument('-b', '--binary', action='store_true',
+                    help='Send the rows to PostgreSQL in the binary COPY format instead of text')
 group = parser.add_mutually_exclusive_group(required=True)
 group.add_argument("-d", "--domain_key", type=str, help="Existing domain key in the WinDB2")
 group.add_argument("-n", "--new", action="store_false", help="Create a new WinDB2 domain")
@@ -84,7 +86,8 @@ for var in windb2_config.config['vars'].keys():
     try:
         if isinstance(windb2_config.config['vars'][var]['insert'], list): # will fail if insert does not exist
             (times_inserted, domain_key_returned) = inserter.insert_variable(ncfile, var, domain_key=args.domain_key, replace_data=args.overwrite,
-                                                                             mask=args.mask, zero_seconds=args.zero_seconds, file_type=file_type)
+                                                                             mask=args.mask, zero_seconds=args.zero_seconds, file_type=file_type,
+                                                                             copy_format='binary' if args.binary else 'text')
     except KeyError:
         continue
 
@@ -35,6 +35,8 @@ parser.add_argument("-c", "--copy", help="Copy WRF variables to the interp file"
                     action="store_true")
 parser.add_argument("-o", "--overwrite", help="Overwrite an existing interp file",
                     action="store_true")
+parser.add_argument("-w", "--workers", type=int,
+                    help="Number of processes to spread the time steps over (default is this process only)")
 args = parser.parse_args()
 windb2_config = config.Windb2WrfConfigParser('windb2-wrf.json').config
 
@@ -61,7 +63,8 @@ elif args.overwrite and os.path.exists(ncfile_cleansed + interp_extension):
 
 # Interpolate this file and leave the file open if we're copying WRF vars
 close_file = True if args.copy else False
-heightinterpfile.HeightInterpFile(windb2_config).interp_file(ncfile_cleansed, close_file=close_file)
+heightinterpfile.HeightInterpFile(windb2_config).interp_file(ncfile_cleansed, close_file=close_file,
+                                                            workers=args.workers)
 
 # Copy of WRF vars
 if args.copy:
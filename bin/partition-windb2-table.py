@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+#
+#
+# Description: Converts an existing <var>_<domainkey> table, e.g. wind_1, into a table that is partitioned on time with
+# a partition per month or year, so that time-bounded queries only scan the partitions they need. The rows, indexes and
+# triggers are copied over in a single transaction, during which the table is locked. Old data in a partitioned table
+# can then be dropped a partition at a time with -r.
+#
+import os
+import sys
+
+dir = os.path.dirname(__file__)
+sys.path.append(os.path.join(dir, '../'))
+
+import argparse
+from datetime import datetime
+from windb2 import windb2, insert
+import logging
+import pytz
+
+# Get the command line opts
+parser = argparse.ArgumentParser()
+parser.add_argument("db_host", type=str, help="Database hostname")
+parser.add_argument("db_user", type=str, help="Database username")
+parser.add_argument("db_name", type=str, help="Database name")
+parser.add_argument("tables", type=str, nargs='+', help="Tables to partition e.g. wind_1")
+parser.add_argument('-p', '--port', type=int, default='5432', help='Port for WinDB2 connection')
+parser.add_argument('-t', '--period', choices=insert.PARTITION_PERIODS, default='month',
+                    help='Make a partition per month or per year')
+parser.add_argument('-k', '--keep_old', action='store_true',
+                    help='Keep each original table as <table>_unpartitioned instead of dropping it')
+parser.add_argument('-r', '--drop_before', type=str,
+                    help='Instead of partitioning, drop the partitions of already partitioned tables that end on or '
+                         'before this UTC date, e.g. 2010-01-01')
+args = parser.parse_args()
+
+# Set up logging
+logger = logging.getLogger('windb2')
+logger.setLevel(logging.INFO)
+logging.basicConfig()
+
+# Connect to the WinDB
+windb2 = windb2.WinDB2(args.db_host, args.db_name, dbUser=args.db_user, port=args.port)
+windb2.connect()
+inserter = insert.Insert(windb2)
+
+for table in args.tables:
+    if args.drop_before:
+        before = datetime.strptime(args.drop_before, '%Y-%m-%d').replace(tzinfo=pytz.utc)
+        dropped = inserter.drop_partitions(table, before)
+        print('Dropped {} partitions of {}: {}'.format(len(dropped), table, ', '.join(dropped)))
+    else:
+        count = inserter.partition_table(table, args.period, keep_old=args.keep_old)
+        print('Partitioned {} by {}, copying {} rows'.format(table, args.period, count))
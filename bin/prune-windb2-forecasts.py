@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+#
+#
+# Description: Deletes the forecasts in GFS or WRF tables with an init column that have been superseded by newer
+# initializations, keeping the latest -k initializations of every valid time, and optionally every valid time older
+# than -d days. Meant to be run after each cycle is inserted so that the tables stop growing. With -v a materialized
+# <table>_latest view of the best available forecast is created if needed and refreshed.
+#
+import os
+import sys
+
+dir = os.path.dirname(__file__)
+sys.path.append(os.path.join(dir, '../'))
+
+import argparse
+from datetime import datetime, timedelta
+from windb2 import windb2, insert
+import logging
+import pytz
+
+# Get the command line opts
+parser = argparse.ArgumentParser()
+parser.add_argument("db_host", type=str, help="Database hostname")
+parser.add_argument("db_user", type=str, help="Database username")
+parser.add_argument("db_name", type=str, help="Database name")
+parser.add_argument("tables", type=str, nargs='+', help="Forecast tables to prune e.g. eastward_wind_1")
+parser.add_argument('-p', '--port', type=int, default='5432', help='Port for WinDB2 connection')
+parser.add_argument('-k', '--keep', type=int, default=1,
+                    help='Number of initializations to keep for each valid time, 1 keeps only the latest forecast')
+parser.add_argument('-d', '--days', type=float,
+                    help='Also delete every valid time more than this many days ago, dropping whole partitions if the '
+                         'table is partitioned')
+parser.add_argument('-b', '--batch_size', type=int, default=insert.FORECAST_DELETE_BATCH,
+                    help='Number of forecasts deleted per transaction')
+parser.add_argument('-v', '--latest_view', action='store_true',
+                    help='Create and refresh a <table>_latest view of the latest forecast')
+args = parser.parse_args()
+
+# Set up logging
+logger = logging.getLogger('windb2')
+logger.setLevel(logging.INFO)
+logging.basicConfig()
+
+# Connect to the WinDB
+windb2 = windb2.WinDB2(args.db_host, args.db_name, dbUser=args.db_user, port=args.port)
+windb2.connect()
+inserter = insert.Insert(windb2)
+
+before = None
+if args.days is not None:
+    before = datetime.now(pytz.utc) - timedelta(days=args.days)
+
+for table in args.tables:
+    deleted = inserter.prune_forecasts(table, args.keep, before, args.batch_size)
+    print('Deleted {} rows from {}'.format(deleted, table))
+    if args.latest_view:
+        view = inserter.create_latest_forecast_view(table)
+        inserter.refresh_latest_forecast_view(table)
+        print('Refreshed {}'.format(view))
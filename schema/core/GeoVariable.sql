@@ -13,3 +13,10 @@ CREATE INDEX timestamp_index ON GeoVariable(t);
 
 CREATE INDEX geomkey_t_height_index ON GeoVariable(geomkey, t, height);
 
+
+-- Variable tables that are partitioned on t instead of inheriting GeoVariable, with a partition per month or year
+CREATE TABLE GeoVariablePartition (
+
+  tablename text PRIMARY KEY,
+  period text CHECK (period IN ('month', 'year'))
+);
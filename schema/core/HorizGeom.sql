@@ -10,5 +10,24 @@ CREATE TABLE HorizGeom (
 --Add the geometry column, setting the SRID to zero to allow for mixed SRIDs
 SELECT AddGeometryColumn('', 'horizgeom', 'geom', 0, 'POINT', 2);
 
-CREATE INDEX horizgeom_index on horizgeom(x,y);
+--Add a copy of geom in long,lat so that lookups by long,lat don't have to transform every row
+SELECT AddGeometryColumn('', 'horizgeom', 'geom4326', 4326, 'POINT', 2);
 
+CREATE FUNCTION horizgeom_set_geom4326() RETURNS trigger AS $horizgeom_set_geom4326$
+    BEGIN
+        -- Points without an SRID can't be transformed
+        IF NEW.geom IS NULL OR ST_SRID(NEW.geom)=0 THEN
+            NEW.geom4326 := NULL;
+        ELSE
+            NEW.geom4326 := ST_Transform(NEW.geom, 4326);
+        END IF;
+        RETURN NEW;
+    END;
+$horizgeom_set_geom4326$ LANGUAGE plpgsql;
+
+CREATE TRIGGER horizgeom_geom4326 BEFORE INSERT OR UPDATE OF geom ON horizgeom
+    FOR EACH ROW EXECUTE PROCEDURE horizgeom_set_geom4326();
+
+CREATE INDEX horizgeom_index on horizgeom(domainkey,x,y);
+CREATE INDEX horizgeom_geom_gist_index on horizgeom USING GIST(geom);
+CREATE INDEX horizgeom_geom4326_gist_index on horizgeom USING GIST(geom4326);
@@ -0,0 +1,32 @@
+-- Used to go from <=v3.4.0 to 3.5.0+ schemas
+-- Adds the geom4326 column and the spatial and (domainkey, x, y) indexes to HorizGeom
+
+-- Add a copy of geom in long,lat so that lookups by long,lat don't have to transform every row
+ALTER TABLE HorizGeom ADD COLUMN IF NOT EXISTS geom4326 geometry(POINT, 4326);
+
+CREATE OR REPLACE FUNCTION horizgeom_set_geom4326() RETURNS trigger AS $horizgeom_set_geom4326$
+    BEGIN
+        -- Points without an SRID can't be transformed
+        IF NEW.geom IS NULL OR ST_SRID(NEW.geom)=0 THEN
+            NEW.geom4326 := NULL;
+        ELSE
+            NEW.geom4326 := ST_Transform(NEW.geom, 4326);
+        END IF;
+        RETURN NEW;
+    END;
+$horizgeom_set_geom4326$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS horizgeom_geom4326 ON HorizGeom;
+CREATE TRIGGER horizgeom_geom4326 BEFORE INSERT OR UPDATE OF geom ON horizgeom
+    FOR EACH ROW EXECUTE PROCEDURE horizgeom_set_geom4326();
+
+-- Populate geom4326 for the existing points
+UPDATE HorizGeom SET geom4326=ST_Transform(geom, 4326) WHERE ST_SRID(geom)<>0 AND geom4326 IS NULL;
+
+-- Replace the (x, y) index with one that starts with the domain, which every grid lookup filters on
+DROP INDEX IF EXISTS horizgeom_index;
+CREATE INDEX horizgeom_index ON HorizGeom(domainkey, x, y);
+CREATE INDEX IF NOT EXISTS horizgeom_geom_gist_index ON HorizGeom USING GIST(geom);
+CREATE INDEX IF NOT EXISTS horizgeom_geom4326_gist_index ON HorizGeom USING GIST(geom4326);
+
+ANALYZE HorizGeom;
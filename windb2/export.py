@@ -0,0 +1,95 @@
+"""Exports WinDB2 data with COPY ... TO STDOUT, which streams the rows from PostgreSQL straight into a file or a pipe
+without turning them into Python objects first."""
+
+import gzip
+import logging
+
+from windb2.insert import COPY_CHUNK_SIZE
+
+logger = logging.getLogger('windb2')
+
+# Formats that copy_to can write
+EXPORT_FORMATS = ('csv', 'binary')
+
+
+def timeseries_sql(curs, domain, geomkeys, heights, t0, t1, columns=('t', 'speed', 'direction'), table='wind'):
+    """Returns a SELECT of the time series at one or more points and heights in a domain, ordered by geomkey, height and
+    time. The values are inlined so that the query can be used in a COPY.
+
+    curs - psycopg2 cursor used to quote the values
+    domain - Domain key
+    geomkeys - Geomkeys of the points
+    heights - Heights of the data, as numbers
+    t0 - Start time inclusive, a datetime with a time zone
+    t1 - End time exclusive, a datetime with a time zone
+    columns - SQL expressions for the columns to select e.g. 'geomkey', 't AS t_utc', 'speed'
+    table - Name of the variable table without the domain key e.g. 'wind'
+    """
+
+    sql = "SELECT {} FROM {}_{} WHERE geomkey=ANY(%s) AND height=ANY(%s) AND t>=%s AND t<%s " \
+          "ORDER BY geomkey, height, t".format(', '.join(columns), table, domain)
+    query = curs.mogrify(sql, (list(geomkeys), list(heights), t0, t1))
+    return query.decode(curs.connection.encoding) if isinstance(query, bytes) else query
+
+
+def copy_to(curs, query, out, export_format='csv', compress=False, header=True, size=COPY_CHUNK_SIZE):
+    """Streams the rows of a query into a file with COPY ... TO STDOUT.
+
+    curs - psycopg2 cursor
+    query - SELECT to export, with any values inlined (see timeseries_sql)
+    out - File name to write, or a binary file object such as a pipe or sys.stdout.buffer
+    export_format - 'csv' or 'binary' (the PostgreSQL binary COPY format)
+    compress - Compresses the output with gzip
+    header - Starts a CSV with a header line of the column names
+    size - Number of bytes to read from PostgreSQL at a time
+    """
+
+    if export_format == 'csv':
+        sql = 'COPY ({}) TO STDOUT WITH (FORMAT csv{})'.format(query, ', HEADER' if header else '')
+    elif export_format == 'binary':
+        sql = 'COPY ({}) TO STDOUT WITH (FORMAT binary)'.format(query)
+    else:
+        raise TypeError('Unsupported export_format: {}'.format(export_format))
+    logger.debug(sql)
+
+    fileobj = open(out, 'wb') if isinstance(out, str) else out
+    try:
+        if compress:
+            with gzip.GzipFile(fileobj=fileobj, mode='wb') as gzfile:
+                curs.copy_expert(sql, gzfile, size=size)
+        else:
+            curs.copy_expert(sql, fileobj, size=size)
+    finally:
+        if fileobj is not out:
+            fileobj.close()
+
+
+def export_timeseries(curs, domain, geomkeys, heights, t0, t1, out, columns=('geomkey', 'height', 't', 'speed',
+                                                                             'direction'),
+                      table='wind', export_format='csv', compress=False):
+    """Exports the time series at many points and heights in a domain with COPY.
+
+    If out is a file name containing {geomkey} and {height}, every point and height goes to its own file named by
+    out.format(geomkey=..., height=...). Otherwise all of the points and heights are streamed into out in a single
+    COPY, ordered by geomkey, height and time.
+
+    curs - psycopg2 cursor
+    domain, geomkeys, heights, t0, t1, columns, table - Time series to export, see timeseries_sql
+    out - File name or template to write, or a binary file object
+    export_format, compress - See copy_to
+
+    returns The names of the files written, or [out] for a file object
+    """
+
+    if isinstance(out, str) and '{geomkey}' in out and '{height}' in out:
+        filenames = []
+        for geomkey in geomkeys:
+            for height in heights:
+                filenames.append(out.format(geomkey=geomkey, height=height))
+                logger.info('Exporting geomkey={} height={} to {}'.format(geomkey, height, filenames[-1]))
+                copy_to(curs, timeseries_sql(curs, domain, (geomkey,), (height,), t0, t1, columns, table),
+                        filenames[-1], export_format, compress)
+        return filenames
+
+    copy_to(curs, timeseries_sql(curs, domain, geomkeys, heights, t0, t1, columns, table), out, export_format, compress)
+    return [out]
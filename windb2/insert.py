@@ -1,10 +1,247 @@
 from __future__ import print_function
 import psycopg2
+import psycopg2.errorcodes
 import sys
 import numpy
-import tempfile
+import itertools
 import logging
+import os
 import re
+import struct
+from collections import namedtuple, OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import pytz
+from windb2 import statements
+
+# Default number of characters handed to the COPY command at a time
+COPY_CHUNK_SIZE = 65536
+
+# Signature, flags and header extension length that start a binary COPY, and the field count that ends it
+PGCOPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+PGCOPY_TRAILER = struct.pack('>h', -1)
+
+# Big-endian NumPy types for the PostgreSQL types that can be written with pgcopy_binary
+PGCOPY_TYPES = {'smallint': '>i2',
+                'int': '>i4',
+                'integer': '>i4',
+                'bigint': '>i8',
+                'real': '>f4',
+                'double precision': '>f8',
+                'timestamptz': '>i8'}
+
+# Binary timestamps are microseconds since the PostgreSQL epoch
+PG_EPOCH = datetime(2000, 1, 1, tzinfo=pytz.utc)
+
+# Columns that are unique in every <var>_<domainkey> table, see Insert.create_new_table
+GEOVARIABLE_UNIQUE_COLUMNS = ('domainkey', 'geomkey', 't', 'height')
+
+# Index on a table, see Insert.table_indexes. unique_constraint is True for the index behind a UNIQUE constraint such as
+# the one create_new_table adds, and columns are the indexed columns in order.
+TableIndex = namedtuple('TableIndex', ['name', 'definition', 'unique_constraint', 'columns'])
+
+# Periods that the variable tables can be partitioned by on t, see Insert.create_new_table
+PARTITION_PERIODS = ('month', 'year')
+
+# Number of valid times or (t, init) forecasts deleted per transaction by Insert.prune_forecasts
+FORECAST_DELETE_BATCH = 100
+
+# Number of geomkey grids kept in memory by Insert.calculateHorizWindGeomKeys, most recently used last
+GEOMKEY_CACHE_SIZE = 16
+_geomkey_cache = OrderedDict()
+
+
+def clear_geomkey_cache():
+    """Empties the in-memory geomkey grid cache, e.g. after the horizgeom of a domain has been changed."""
+    _geomkey_cache.clear()
+
+
+def partition_bounds(period, t_min, t_max):
+    """Returns the (start inclusive, end exclusive) UTC datetimes of every month or year partition that holds times
+    from t_min to t_max inclusive. Naive times are assumed to be UTC.
+
+    period - 'month' or 'year'
+    t_min, t_max - datetimes
+    """
+
+    if period not in PARTITION_PERIODS:
+        raise TypeError('Unsupported partition period: {}'.format(period))
+    t_min, t_max = [(t if t.tzinfo else t.replace(tzinfo=pytz.utc)).astimezone(pytz.utc) for t in (t_min, t_max)]
+
+    bounds = []
+    start = t_min.replace(month=1 if period == 'year' else t_min.month, day=1, hour=0, minute=0, second=0,
+                          microsecond=0)
+    while start <= t_max:
+        if period == 'year':
+            end = start.replace(year=start.year + 1)
+        else:
+            end = start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+        bounds.append((start, end))
+        start = end
+    return bounds
+
+
+def partition_name(table_name, period, start):
+    """Returns the name of the partition of a table starting at start e.g. wind_1_2016 or wind_1_2016_02."""
+
+    if period == 'year':
+        return '{}_{:04d}'.format(table_name, start.year)
+    return '{}_{:04d}_{:02d}'.format(table_name, start.year, start.month)
+
+
+def _pgcopy_timestamps(t):
+    """Converts a datetime or numpy.datetime64 array to microseconds since the PostgreSQL epoch. Naive times are
+    assumed to be UTC."""
+
+    if isinstance(t, datetime):
+        if t.tzinfo is None:
+            t = t.replace(tzinfo=pytz.utc)
+        return (t - PG_EPOCH) // timedelta(microseconds=1)
+
+    return (numpy.asarray(t, 'datetime64[us]') - numpy.datetime64('2000-01-01T00:00:00', 'us')).astype(numpy.int64)
+
+
+def pgcopy_binary(columns, pg_types, header=True, trailer=True):
+    """Encodes columns as rows in the PostgreSQL binary COPY format, which saves formatting every value as text and
+    having PostgreSQL parse it again. The rows are built as a NumPy structured array with the field count and the
+    length of each field in between the values, so the whole block is encoded at once. NULLs are not supported.
+
+    columns - 1D numpy.arrays or scalars that are repeated on every row, in the same order as the COPY columns
+    pg_types - PostgreSQL type of each column, one of PGCOPY_TYPES
+    header - Starts the data with the binary COPY header
+    trailer - Ends the data with the binary COPY trailer. Blocks encoded without the header and trailer can be streamed
+              one after the other into a single COPY.
+
+    returns bytes to be passed to Insert.copy_rows with binary=True
+    """
+
+    if len(columns) != len(pg_types):
+        raise ValueError('Got {} columns but {} types'.format(len(columns), len(pg_types)))
+
+    # Columns that are arrays set the number of rows
+    nrows = 1
+    for col in columns:
+        if numpy.ndim(col) > 0:
+            nrows = numpy.shape(col)[0]
+            break
+
+    # Each row is the field count followed by the length and value of each field
+    fields = [('nfields', '>i2')]
+    for i, pg_type in enumerate(pg_types):
+        try:
+            fields += [('len{}'.format(i), '>i4'), ('col{}'.format(i), PGCOPY_TYPES[pg_type])]
+        except KeyError:
+            raise TypeError('Unsupported binary COPY type: {}'.format(pg_type))
+    block = numpy.empty(nrows, dtype=numpy.dtype(fields))
+
+    block['nfields'] = len(columns)
+    for i, (col, pg_type) in enumerate(zip(columns, pg_types)):
+        if pg_type == 'timestamptz':
+            col = _pgcopy_timestamps(col)
+        block['len{}'.format(i)] = block.dtype['col{}'.format(i)].itemsize
+        block['col{}'.format(i)] = col
+
+    return (PGCOPY_HEADER if header else b'') + block.tobytes() + (PGCOPY_TRAILER if trailer else b'')
+
+
+def insert_mask(horiz_geom_key, *blocks):
+    """Returns a boolean [x, y] mask of the points to insert. A horizGeomKey of zero means we don't want to insert
+    the point and a NaN in any of the blocks means there is no data for the point."""
+
+    mask = horiz_geom_key != 0
+    for block in blocks:
+        mask &= ~numpy.isnan(block)
+
+    return mask
+
+
+def format_rows(*columns):
+    """Formats the columns as comma separated rows for the COPY command. Columns can either be 1D numpy.arrays or
+    scalars that are repeated on every row. Floats are formatted the same way str.format does for a single value."""
+
+    nrows = None
+    str_columns = []
+    for col in columns:
+        if isinstance(col, numpy.ndarray):
+            if col.dtype.kind == 'f':
+                col = col.astype(numpy.float64)
+
+            # Formatting the Python scalars is quicker than NumPy's astype(str) and gives the same strings
+            str_columns.append(list(map(str, col.tolist())))
+            nrows = col.shape[0]
+        else:
+            str_columns.append(None)
+
+    # Nothing to insert
+    if nrows == 0:
+        return ''
+
+    # Repeat the scalar columns for each row
+    for i, col in enumerate(columns):
+        if str_columns[i] is None:
+            str_columns[i] = itertools.repeat('{}'.format(col), nrows)
+
+    return '\n'.join(map(', '.join, zip(*str_columns))) + '\n'
+
+
+class CopyStream(object):
+    """File-like object that streams rows straight into psycopg2's copy_expert, so nothing has to be written out to a
+    temporary file first. Rows are pulled lazily, so at most one row (or block of rows) plus chunk_size characters are
+    held in memory at once.
+
+    rows - A string or bytes buffer, or an iterable (e.g. a generator) of strings or bytes. Text rows should end in a
+           newline. The first item decides whether the stream returns strings or bytes (e.g. from pgcopy_binary).
+    chunk_size - Number of characters to return per read when no size is given
+    """
+
+    def __init__(self, rows, chunk_size=COPY_CHUNK_SIZE):
+        if isinstance(rows, (str, bytes)):
+            rows = (rows,)
+        self._rows = iter(rows)
+        self._buffer = ''
+        self.chunk_size = chunk_size
+
+        # Number of items that have been pulled from the rows
+        self.count = 0
+
+    def _fill(self, size):
+        """Pulls rows into the buffer until it has at least size characters or the rows run out."""
+        chunks = [self._buffer]
+        buffered = len(self._buffer)
+        for row in self._rows:
+            # The first row decides whether this is a text or a binary stream
+            if self.count == 0:
+                chunks[0] = row[:0]
+            chunks.append(row)
+            buffered += len(row)
+            self.count += 1
+            if buffered >= size:
+                break
+        self._buffer = chunks[0][:0].join(chunks)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.chunk_size
+        if len(self._buffer) < size:
+            self._fill(size)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def _newline(self):
+        return '\n' if isinstance(self._buffer, str) else b'\n'
+
+    def readline(self, size=-1):
+        while self._newline() not in self._buffer:
+            buffered = len(self._buffer)
+            self._fill(buffered + 1)
+            if len(self._buffer) == buffered:
+                break
+        end = self._buffer.find(self._newline()) + 1 or len(self._buffer)
+        if size is not None and 0 <= size < end:
+            end = size
+        data, self._buffer = self._buffer[:end], self._buffer[end:]
+        return data
+
 
 class Insert(object):
     """General functionality to be inherited by all WinDB for specific models and observations."""
@@ -13,10 +250,40 @@ class Insert(object):
         
         self.windb2 = windb2
         self.srid = "unset"
+        self.copy_chunk_size = COPY_CHUNK_SIZE
+
+        # Directory to keep geomkey grids in between runs, see calculateHorizWindGeomKeys
+        self.geomkey_cache_dir = None
+
+        # Period to partition new variable tables by, see create_new_table
+        self.partition = None
+        self._partition_periods = {}
 
         # Logging
         self.logger = logging.getLogger('windb2')
     
+    def copy_rows(self, table_name, columns, rows, sep=',', binary=False):
+        """Streams rows into a table with the COPY command without using a temporary file.
+
+        table_name Name of the table to COPY into
+        columns Names of the columns in each row
+        rows A string, bytes, or an iterable of rows (see CopyStream). Pass a new iterable if the COPY is retried.
+        sep Column separator used in the rows
+        binary The rows are in the binary COPY format (see pgcopy_binary) instead of text
+
+        returns The number of items pulled from rows
+        """
+
+        if binary:
+            sql = "COPY {} ({}) FROM STDIN WITH (FORMAT binary)".format(table_name, ', '.join(columns))
+        else:
+            sql = "COPY {} ({}) FROM STDIN WITH DELIMITER '{}'".format(table_name, ', '.join(columns), sep)
+        self.logger.debug(sql)
+        stream = CopyStream(rows, self.copy_chunk_size)
+        self.windb2.curs.copy_expert(sql, stream, size=self.copy_chunk_size)
+
+        return stream.count
+
     def create_new_domain(self, domain_name, data_source, resolution, units, mask=None):
         """Creates a new empty domain with an associated unique domain ID.
         
@@ -174,13 +441,15 @@ class Insert(object):
         # Turn autocommit back off
         self.windb2.conn.autocommit = False
 
-    def insert_horiz_geom(self, domainKey, xCoordArray, yCoordArr, srid, mask=None):
+    def insert_horiz_geom(self, domainKey, xCoordArray, yCoordArr, srid, mask=None, keep=None):
         """Inserts horizontal geometries into HorizGeom table. Assumes that the grid is not changing over time.
         
         domainKey The key of the domain you want to get the HorizWindGeom keys for
         xCoordArray 2D Numpy array of projected longitude values at a given position
         yCoordArr 2D Numpy array projected latitude values at a given position
         srid Corresponds to a Spatial Reference System Identifier (SRID)
+        keep 2D boolean Numpy array [y, x] of the points to insert, all of them by default. The points keep their x,y
+             in the whole grid.
      
         returns The key of the domain to use in future domain
         """
@@ -196,50 +465,53 @@ class Insert(object):
             self.logger.debug(sql)
             self.windb2.curs.execute(sql)
 
-        # Create new grid points, using a temp file for the SQL copy command
-        tempFile = tempfile.NamedTemporaryFile(mode='w')
-        count_masked_skip = 0
-        for y in range(xCoordArray.shape[1]):
-
-            # Info that continually updates
-            status_msg = "\rInserting new points: {:000.1%} done (skipped {:000.1%})"
-            skipped_fraction = float(count_masked_skip) / (xCoordArray.shape[1] * xCoordArray.shape[2])
-            sys.stdout.write(status_msg.format(float(y) / xCoordArray.shape[1],
-                             skipped_fraction))
-            sys.stdout.flush()
-
-            for x in range(xCoordArray.shape[2]):
-    
-                # Create the grid point
-                # You have to do it with this following syntax (ST_GeomFromText doesn't work with the COPY_FROM function)
-                # See http://postgis.17.x6.nabble.com/Adding-postgis-column-in-COPY-command-td3520584.html
-                geom = 'SRID={};POINT({} {})'.format(srid, xCoordArray[0, y, x], yCoordArr[0, y, x])
-
-                # Make sure this point is within the geometry index, which saves processing later
-                if mask is not None:
+        # Make sure each point is within the geometry index, which saves processing later. This has to be done before
+        # the COPY starts because the connection is busy until the COPY finishes.
+        keep = numpy.ones(xCoordArray.shape[1:], dtype=bool) if keep is None else numpy.array(keep, dtype=bool)
+        if mask is not None:
+            for y in range(xCoordArray.shape[1]):
+                for x in range(xCoordArray.shape[2]):
+                    if not keep[y, x]:
+                        continue
                     sql = """SELECT NOT(geom && ST_GeomFromText('POINT({} {})', {})) 
                              FROM {}""".format(xCoordArray[0, y, x], yCoordArr[0, y, x], srid, mask)
                     self.windb2.curs.execute(sql)
                     if self.windb2.curs.fetchone()[0]:
-                        count_masked_skip += 1
-                        continue
+                        keep[y, x] = False
+        skipped_fraction = float(numpy.count_nonzero(~keep)) / keep.size
+        status_msg = "\rInserting new points: {:000.1%} done (skipped {:000.1%})"
 
-                print('{}, {}, {}, {}'.format(geom, domainKey, x, y), file=tempFile)
+        def rows():
+            """Creates the new grid points for the SQL copy command"""
+            for y in range(xCoordArray.shape[1]):
 
-        # Print the last update message
-        sys.stdout.write((status_msg + '\n').format(1., skipped_fraction))
+                # Info that continually updates
+                sys.stdout.write(status_msg.format(float(y) / xCoordArray.shape[1], skipped_fraction))
+                sys.stdout.flush()
+
+                for x in range(xCoordArray.shape[2]):
+                    if not keep[y, x]:
+                        continue
+
+                    # Create the grid point
+                    # You have to do it with this following syntax (ST_GeomFromText doesn't work with the COPY_FROM function)
+                    # See http://postgis.17.x6.nabble.com/Adding-postgis-column-in-COPY-command-td3520584.html
+                    geom = 'SRID={};POINT({} {})'.format(srid, xCoordArray[0, y, x], yCoordArr[0, y, x])
+                    yield '{}, {}, {}, {}\n'.format(geom, domainKey, x, y)
 
         # Create a temporary table to import the native coordinate into
         self.windb2.curs.execute('CREATE TEMP TABLE horizgeom_import () INHERITS (horizgeom) ON COMMIT DROP')
 
-        # Insert all of the grid points into the temp table
-        tempFile.flush()
+        # Stream all of the grid points into the temp table
         try:
-            self.windb2.curs.copy_from(open(tempFile.name, 'r'), "horizgeom_import", sep=',', columns=('geom', 'domainKey', 'x', 'y'))
+            self.copy_rows('horizgeom_import', ('geom', 'domainKey', 'x', 'y'), rows())
         except psycopg2.IntegrityError as e:
             print("ERROR ON INSERT: ", e.message, file=sys.stderr)
             raise e
 
+        # Print the last update message
+        sys.stdout.write((status_msg + '\n').format(1., skipped_fraction))
+
         # Insert all of the points in the native WRF SRID
         try:
             count = self.windb2.curs.execute('INSERT INTO horizgeom SELECT key, domainkey, x, y, ST_Transform(geom, {}) FROM horizgeom_import WHERE domainkey={}'.format(self.srid, domainKey))
@@ -253,7 +525,7 @@ class Insert(object):
         
         return
 
-    def create_new_table(self, domainKey, tableName, varList, varType, constraint=None, check=None):
+    def create_new_table(self, domainKey, tableName, varList, varType, constraint=None, check=None, partition=None):
         """Creates a new table for an already existing domain to store a geo variable.
         
         domainKey Domain key that the table is associated with
@@ -262,6 +534,9 @@ class Insert(object):
         varType PostgreSQL data types
         constraint PostgreSQL constraint name e.g. "speed_positive"
         check PostgreSQL constraint check e.g. "speed >= 0"
+        partition Creates a table partitioned on t with a partition per 'month' or 'year' instead of a child of
+                  GeoVariable, defaulting to self.partition. The partitions are made by create_partitions as data are
+                  inserted, and old data can be dropped a partition at a time with drop_partitions.
         """
         
         # Make sure all of the extra columns to add match up in number
@@ -273,7 +548,15 @@ class Insert(object):
             assert(len(check) == len(constraint))
         
         # Create a check on the table (for some reason we have to do almost the same thing twice
-        self.windb2.curs.execute("CREATE TABLE " + tableName + "_" + str(domainKey) + " (CHECK (domainkey=" + str(domainKey) + ")) INHERITS (GeoVariable)")
+        if partition is None:
+            partition = self.partition
+        if partition is None:
+            self.windb2.curs.execute("CREATE TABLE " + tableName + "_" + str(domainKey) + " (CHECK (domainkey=" + str(domainKey) + ")) INHERITS (GeoVariable)")
+        else:
+            # A partitioned table can't inherit, so it copies the GeoVariable columns instead
+            self.windb2.curs.execute("CREATE TABLE {}_{} (LIKE GeoVariable INCLUDING DEFAULTS, CHECK (domainkey={})) "
+                                     "PARTITION BY RANGE (t)".format(tableName, domainKey, domainKey))
+            self._register_partitioned_table('{}_{}'.format(tableName, domainKey), partition)
 
         # Add a unique constraint to the table, so we don't get duplicates (this in theory
         # should be copied over from the inherited windspeed table, but it isn't in the
@@ -297,59 +580,536 @@ class Insert(object):
             self.logger.info("Running: " + sql)
             self.windb2.curs.execute(sql)
 
-        # Add a trigger that just ignores any wind speed insert where the geomkey isn't in the mask
-        # try:
-        self.windb2.curs.execute('SELECT mask FROM domain WHERE key={}'.format(domainKey))
-        mask = self.windb2.curs.fetchone()[0]
-        if mask is not None:
-            sql = 'CREATE TRIGGER {}_geomkey_mask_domain_{} ' \
-                  'BEFORE INSERT ' \
-                  'ON {}_{} ' \
-                  'FOR EACH ROW ' \
-                  'EXECUTE PROCEDURE geomkey_in_{}_domain_{}()' \
-                  ''.format(tableName, domainKey, tableName, domainKey, mask, domainKey)
-            self.logger.debug(sql)
-            self.windb2.curs.execute(sql)
+        # Add a trigger that just ignores any wind speed insert where the geomkey isn't in the mask. A partitioned table
+        # gets it on each partition instead, see create_partitions.
+        if partition is None:
+            self._create_mask_trigger('{}_{}'.format(tableName, domainKey))
 
         # Commit the changes
         self.windb2.conn.commit()
 
         return
 
+    def _create_mask_trigger(self, table_name, target=None):
+        """Adds the trigger that ignores inserts of geomkeys outside of the domain's mask to a <var>_<domainkey> table,
+        if the domain has a mask. PostgreSQL 11 doesn't allow BEFORE row triggers on partitioned tables, so a table
+        partitioned on t gets the trigger on each of its partitions instead.
+
+        table_name Name of the table e.g. wind_1
+        target Partition of the table to add the trigger to, defaults to the table itself
+
+        returns True if a trigger was added
+        """
+
+        var_name, domain_key = table_name.rsplit('_', 1)
+        if not domain_key.isdigit():
+            return False
+        self.windb2.curs.execute('SELECT mask FROM domain WHERE key=%s', (int(domain_key),))
+        row = self.windb2.curs.fetchone()
+        if row is None or row[0] is None:
+            return False
+
+        sql = 'CREATE TRIGGER {}_geomkey_mask_domain_{} ' \
+              'BEFORE INSERT ' \
+              'ON {} ' \
+              'FOR EACH ROW ' \
+              'EXECUTE PROCEDURE geomkey_in_{}_domain_{}()' \
+              ''.format(var_name, domain_key, target or table_name, row[0], domain_key)
+        self.logger.debug(sql)
+        self.windb2.curs.execute(sql)
+
+        return True
+
+    def _register_partitioned_table(self, table_name, period):
+        """Records the partition period of a table in GeoVariablePartition, which is created if this WinDB2 predates it."""
+
+        if period not in PARTITION_PERIODS:
+            raise TypeError('Unsupported partition period: {}'.format(period))
+        self.windb2.curs.execute("CREATE TABLE IF NOT EXISTS GeoVariablePartition (tablename text PRIMARY KEY, "
+                                 "period text CHECK (period IN ('month', 'year')))")
+        self.windb2.curs.execute("INSERT INTO GeoVariablePartition (tablename, period) VALUES (%s, %s)",
+                                 (table_name.lower(), period))
+        self._partition_periods[table_name.lower()] = period
+
+    def partition_period(self, table_name):
+        """Returns 'month' or 'year' if a table is partitioned on t, otherwise None."""
+
+        table_name = table_name.lower()
+        if table_name not in self._partition_periods:
+            self.windb2.curs.execute("SELECT to_regclass('geovariablepartition') IS NOT NULL")
+            period = None
+            if self.windb2.curs.fetchone()[0]:
+                self.windb2.curs.execute("SELECT period FROM GeoVariablePartition WHERE tablename=%s", (table_name,))
+                row = self.windb2.curs.fetchone()
+                period = row[0] if row else None
+            self._partition_periods[table_name] = period
+
+        return self._partition_periods[table_name]
+
+    def create_partitions(self, table_name, t_min, t_max=None):
+        """Creates any missing partitions of a table partitioned on t for the times from t_min to t_max, and commits
+        them so that they outlive a rollback of the insert that follows. Does nothing for tables that aren't
+        partitioned. A partition created by another connection at the same time, e.g. another batch insert worker, is
+        left to that connection instead of failing the insert.
+
+        table_name Name of the table e.g. wind_1
+        t_min, t_max Range of the times to be inserted, inclusive. t_max defaults to t_min.
+
+        returns The names of the partitions created
+        """
+
+        period = self.partition_period(table_name)
+        if period is None:
+            return []
+
+        created = []
+        for start, end in partition_bounds(period, t_min, t_min if t_max is None else t_max):
+            name = partition_name(table_name.lower(), period, start)
+            statements.execute(self.windb2.curs, 'table_exists', (name,))
+            if not self.windb2.curs.fetchone()[0]:
+                sql = "CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES FROM ('{}') TO ('{}')"\
+                    .format(name, table_name, start.isoformat(), end.isoformat())
+                self.logger.info(sql)
+                self.windb2.curs.execute('SAVEPOINT create_partition')
+                try:
+                    self.windb2.curs.execute(sql)
+                except psycopg2.Error as e:
+                    if e.pgcode not in (psycopg2.errorcodes.DUPLICATE_TABLE, psycopg2.errorcodes.UNIQUE_VIOLATION,
+                                        psycopg2.errorcodes.INVALID_OBJECT_DEFINITION):
+                        raise
+                    self.windb2.curs.execute('ROLLBACK TO SAVEPOINT create_partition')
+
+                    # Only a partition that's there now was lost to a race, anything else is a real overlap
+                    statements.execute(self.windb2.curs, 'table_exists', (name,))
+                    if not self.windb2.curs.fetchone()[0]:
+                        raise
+                    self.logger.info('{} was created by another connection'.format(name))
+                    continue
+                self._create_mask_trigger(table_name, name)
+                self.windb2.curs.execute('RELEASE SAVEPOINT create_partition')
+                created.append(name)
+        if created:
+            self.windb2.conn.commit()
+
+        return created
+
+    def drop_partitions(self, table_name, before):
+        """Drops the partitions of a table partitioned on t that only hold times before a time, which is much cheaper
+        than deleting the rows.
+
+        table_name Name of the table e.g. wind_1
+        before datetime, partitions that end on or before this are dropped
+
+        returns The names of the partitions dropped
+        """
+
+        period = self.partition_period(table_name)
+        if period is None:
+            raise ValueError('{} is not partitioned'.format(table_name))
+        if before.tzinfo is None:
+            before = before.replace(tzinfo=pytz.utc)
+
+        self.windb2.curs.execute("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid=i.inhrelid "
+                                 "WHERE i.inhparent=%s::regclass ORDER BY c.relname", (table_name,))
+        dropped = []
+        for name, in self.windb2.curs.fetchall():
+            match = re.match(r'{}_(\d{{4}})(?:_(\d{{2}}))?$'.format(re.escape(table_name.lower())), name)
+            if match is None:
+                continue
+            start = datetime(int(match.group(1)), int(match.group(2) or 1), 1, tzinfo=pytz.utc)
+            if partition_bounds(period, start, start)[0][1] <= before:
+                dropped.append(name)
+        for name in dropped:
+            self.logger.info('Dropping partition {}'.format(name))
+            self.windb2.curs.execute('DROP TABLE {}'.format(name))
+        self.windb2.conn.commit()
+
+        return dropped
+
+    def partition_table(self, table_name, period, keep_old=False):
+        """Converts an existing <var>_<domainkey> table into one partitioned on t, copying the rows, indexes and
+        triggers over in a single transaction. The table is locked for the whole copy.
+
+        table_name Name of the table e.g. wind_1
+        period 'month' or 'year'
+        keep_old Keeps the original table renamed to <table_name>_unpartitioned instead of dropping it
+
+        returns The number of rows copied
+        """
+
+        if self.partition_period(table_name) is not None:
+            raise ValueError('{} is already partitioned'.format(table_name))
+        old_name = '{}_unpartitioned'.format(table_name)
+
+        # Get the indexes and triggers before they are renamed along with the table
+        indexes = self.table_indexes(table_name)
+        triggers = self._partitioned_table_triggers(table_name)
+
+        # Drop the indexes, whose names are needed for the new table, and move the old table out of the way
+        for index in indexes:
+            if index.unique_constraint:
+                self.windb2.curs.execute('ALTER TABLE {} DROP CONSTRAINT {}'.format(table_name, index.name))
+            else:
+                self.windb2.curs.execute('DROP INDEX {}'.format(index.name))
+        self.windb2.curs.execute('ALTER TABLE {} RENAME TO {}'.format(table_name, old_name))
+
+        # Create the partitioned table with all of the columns and checks of the old one
+        self.windb2.curs.execute('CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+                                 'PARTITION BY RANGE (t)'.format(table_name, old_name))
+        self._register_partitioned_table(table_name, period)
+
+        # Copy the rows into partitions covering all of their times
+        self.windb2.curs.execute('SELECT min(t), max(t) FROM {}'.format(old_name))
+        t_min, t_max = self.windb2.curs.fetchone()
+        partitions = []
+        for start, end in partition_bounds(period, t_min, t_max) if t_min is not None else []:
+            partitions.append(partition_name(table_name.lower(), period, start))
+            self.windb2.curs.execute("CREATE TABLE {} PARTITION OF {} FOR VALUES FROM ('{}') TO ('{}')"
+                                     .format(partitions[-1], table_name, start.isoformat(), end.isoformat()))
+        self.logger.info('Copying {} into {} partitioned by {}'.format(old_name, table_name, period))
+        self.windb2.curs.execute('INSERT INTO {} SELECT * FROM {}'.format(table_name, old_name))
+        count = self.windb2.curs.rowcount
+
+        # Put the indexes and triggers back on the new table
+        for index in indexes:
+            if index.unique_constraint:
+                self.windb2.curs.execute('ALTER TABLE {} ADD CONSTRAINT {} UNIQUE ({})'
+                                         .format(table_name, index.name, ', '.join(index.columns)))
+            else:
+                self.windb2.curs.execute(index.definition)
+        for trigger in triggers:
+            self.windb2.curs.execute(trigger)
+        for partition in partitions:
+            self._create_mask_trigger(table_name, partition)
+
+        if not keep_old:
+            self.windb2.curs.execute('DROP TABLE {}'.format(old_name))
+        self.windb2.conn.commit()
+        self.windb2.curs.execute('ANALYZE {}'.format(table_name))
+        self.windb2.conn.commit()
+
+        return count
+
+    def _partitioned_table_triggers(self, table_name):
+        """Returns the definitions of the triggers on a table that can be put back on it once it's partitioned.
+        PostgreSQL 11 doesn't allow BEFORE row triggers (tgtype bits 1 and 2) on a partitioned table, so they're left
+        out and the mask trigger is made on each partition instead.
+        """
+
+        self.windb2.curs.execute('SELECT pg_get_triggerdef(oid), tgtype & 3 = 3 FROM pg_trigger '
+                                 'WHERE tgrelid=%s::regclass AND NOT tgisinternal', (table_name,))
+        triggers = []
+        for definition, before_row in self.windb2.curs.fetchall():
+            if not before_row:
+                triggers.append(definition)
+            elif '_geomkey_mask_domain_' not in definition:
+                self.logger.warning('Not copying BEFORE row trigger to the partitions: {}'.format(definition))
+
+        return triggers
+
+    def table_indexes(self, table_name):
+        """Returns a TableIndex for every index on a table other than a primary key.
+
+        table_name Name of the table e.g. wind_1
+        """
+
+        sql = "SELECT i.relname, pg_get_indexdef(x.indexrelid), c.conname IS NOT NULL, " \
+              "       array(SELECT a.attname " \
+              "             FROM unnest(x.indkey) WITH ORDINALITY AS k(attnum, n) " \
+              "             JOIN pg_attribute a ON a.attrelid=x.indrelid AND a.attnum=k.attnum ORDER BY k.n) " \
+              "FROM pg_index x JOIN pg_class i ON i.oid=x.indexrelid " \
+              "LEFT JOIN pg_constraint c ON c.conindid=x.indexrelid AND c.conrelid=x.indrelid AND c.contype='u' " \
+              "WHERE x.indrelid=%s::regclass AND NOT x.indisprimary ORDER BY i.relname"
+        self.windb2.curs.execute(sql, (table_name,))
+        return [TableIndex(name, definition, unique_constraint, tuple(columns))
+                for name, definition, unique_constraint, columns in self.windb2.curs.fetchall()]
+
+    def drop_indexes(self, table_name):
+        """Drops the unique constraint and the other indexes of a <var>_<domainkey> table so that a bulk load doesn't
+        maintain the btrees row by row. The definitions are logged in case the indexes need to be recreated by hand.
+
+        table_name Name of the table e.g. wind_1
+
+        returns The dropped indexes to pass to rebuild_indexes, see table_indexes
+        """
+
+        indexes = self.table_indexes(table_name)
+        for index in indexes:
+            self.logger.info('Dropping {}'.format(index.definition))
+            if index.unique_constraint:
+                sql = 'ALTER TABLE {} DROP CONSTRAINT {}'.format(table_name, index.name)
+            else:
+                sql = 'DROP INDEX {}'.format(index.name)
+            self.logger.debug(sql)
+            self.windb2.curs.execute(sql)
+        self.windb2.conn.commit()
+
+        return indexes
+
+    def remove_duplicates(self, table_name, columns=GEOVARIABLE_UNIQUE_COLUMNS):
+        """Deletes all but one of each set of rows with the same values in columns, keeping the one written by the
+        latest transaction (the highest xmin). Rows written by the same transaction are told apart by where they are
+        stored, which doesn't have to be the order they were written in if the table has free space from deletes.
+        Transaction IDs wrap around, so on a database that has been through that many transactions since the load the
+        wrong row can be kept.
+
+        table_name Name of the table e.g. wind_1
+        columns Columns that should be unique
+
+        returns The number of rows deleted
+        """
+
+        # A ctid is only unique within a partition, so rows are matched on the table they're stored in too
+        sql = 'DELETE FROM {0} WHERE (tableoid, ctid) IN ' \
+              '(SELECT tableoid, ctid ' \
+              ' FROM (SELECT tableoid, ctid, row_number() OVER (PARTITION BY {1} ' \
+              '                                                 ORDER BY xmin::text::bigint DESC, ctid DESC) AS n ' \
+              '       FROM {0}) d ' \
+              ' WHERE n>1)'.format(table_name, ', '.join(columns))
+        self.logger.debug(sql)
+        self.windb2.curs.execute(sql)
+        removed = self.windb2.curs.rowcount
+        if removed:
+            self.logger.warning('Removed {} duplicate rows from {}'.format(removed, table_name))
+
+        return removed
+
+    def rebuild_indexes(self, table_name, indexes, concurrently=True):
+        """Removes any duplicates loaded while the indexes were gone, then recreates the indexes dropped by drop_indexes
+        and analyzes the table.
+
+        table_name Name of the table e.g. wind_1
+        indexes Indexes returned by drop_indexes
+        concurrently Builds the indexes with CREATE INDEX CONCURRENTLY so that the table can be read and written while
+                     they build. This has to run outside of a transaction, so anything uncommitted is committed first.
+                     Tables partitioned on t can't be indexed concurrently, so theirs are always built in a transaction.
+
+        returns The number of duplicate rows removed
+        """
+
+        partitioned = self.partition_period(table_name) is not None
+        concurrently = concurrently and not partitioned
+        removed = 0
+        for index in indexes:
+            if index.unique_constraint:
+                removed += self.remove_duplicates(table_name, index.columns)
+        self.windb2.conn.commit()
+
+        autocommit = self.windb2.conn.autocommit
+        self.windb2.conn.autocommit = concurrently
+        try:
+            for index in indexes:
+                self.logger.info('Rebuilding {}'.format(index.definition))
+
+                # A partitioned table can't adopt an existing index as a constraint
+                if index.unique_constraint and partitioned:
+                    sql = 'ALTER TABLE {} ADD CONSTRAINT {} UNIQUE ({})'.format(table_name, index.name,
+                                                                              ', '.join(index.columns))
+                    self.logger.debug(sql)
+                    self.windb2.curs.execute(sql)
+                    continue
+
+                definition = index.definition
+                if concurrently:
+                    definition = definition.replace(' INDEX ', ' INDEX CONCURRENTLY ', 1)
+                self.windb2.curs.execute(definition)
+                if index.unique_constraint:
+                    sql = 'ALTER TABLE {} ADD CONSTRAINT {} UNIQUE USING INDEX {}'.format(table_name, index.name,
+                                                                                          index.name)
+                    self.logger.debug(sql)
+                    self.windb2.curs.execute(sql)
+            self.windb2.curs.execute('ANALYZE {}'.format(table_name))
+        finally:
+            self.windb2.conn.autocommit = autocommit
+        self.windb2.conn.commit()
+
+        return removed
+
+    @contextmanager
+    def bulk_load(self, table_names, concurrently=True):
+        """Drops the indexes of one or more <var>_<domainkey> tables for the duration of a with block and rebuilds
+        them at the end, even if the block fails, e.g. to backfill years of data with COPY:
+
+            with inserter.bulk_load(['wind_1', 'tmp_1']):
+                for ncfile in ncfiles:
+                    inserter.insert_variable(ncfile, 'WIND', domain_key='1')
+
+        Duplicate rows aren't rejected during the load, so replacing data keeps the rows from the latest transaction
+        instead of raising, see remove_duplicates. Anything left uncommitted in the block is committed if it finishes
+        and rolled back if it raises.
+
+        table_names Names of the tables e.g. wind_1
+        concurrently See rebuild_indexes
+        """
+
+        dropped = OrderedDict((table_name, self.drop_indexes(table_name)) for table_name in table_names)
+        try:
+            yield dropped
+        except BaseException:
+            self.windb2.conn.rollback()
+
+            # Put the indexes back without hiding why the load failed
+            try:
+                for table_name, indexes in dropped.items():
+                    self.rebuild_indexes(table_name, indexes, concurrently)
+            except Exception:
+                self.logger.exception('Unable to rebuild the indexes after the load failed')
+            raise
+
+        for table_name, indexes in dropped.items():
+            self.rebuild_indexes(table_name, indexes, concurrently)
+
+    def prune_forecasts(self, table_name, keep=1, before=None, batch_size=FORECAST_DELETE_BATCH):
+        """Deletes the forecasts superseded by newer initializations from a table with an init column, so that a table
+        that gets a new forecast every cycle doesn't grow forever. Rows are deleted a batch of (t, init) forecasts per
+        transaction so that the table is never locked for long, and rows without an init are left alone.
+
+        table_name Name of the table e.g. eastward_wind_1
+        keep Number of initializations to keep for each valid time, 1 keeps only the best available forecast
+        before datetime, valid times before this are deleted no matter how many initializations they have. Whole
+               partitions are dropped first if the table is partitioned on t.
+        batch_size Number of valid times or (t, init) forecasts deleted per transaction
+
+        returns The number of rows deleted
+        """
+
+        if keep < 1:
+            raise ValueError('Must keep at least one initialization, got {}'.format(keep))
+
+        # Expire the old valid times
+        deleted = 0
+        if before is not None:
+            if before.tzinfo is None:
+                before = before.replace(tzinfo=pytz.utc)
+            if self.partition_period(table_name) is not None:
+                self.drop_partitions(table_name, before)
+            self.windb2.curs.execute('SELECT DISTINCT t FROM {} WHERE t<%s ORDER BY t'.format(table_name), (before,))
+            times = [t for t, in self.windb2.curs.fetchall()]
+            for i in range(0, len(times), batch_size):
+                self.windb2.curs.execute('DELETE FROM {} WHERE t=ANY(%s)'.format(table_name),
+                                         (times[i:i + batch_size],))
+                deleted += self.windb2.curs.rowcount
+                self.windb2.conn.commit()
+
+        # Rank the initializations of each valid time from the newest
+        sql = 'SELECT t, init FROM ' \
+              '(SELECT t, init, row_number() OVER (PARTITION BY t ORDER BY init DESC) AS n ' \
+              ' FROM (SELECT DISTINCT t, init FROM {} WHERE init IS NOT NULL) f) r ' \
+              'WHERE n>%s ORDER BY t, init'.format(table_name)
+        self.logger.debug(sql)
+        self.windb2.curs.execute(sql, (keep,))
+        superseded = self.windb2.curs.fetchall()
+        for i in range(0, len(superseded), batch_size):
+            batch = superseded[i:i + batch_size]
+            self.windb2.curs.execute('DELETE FROM {} WHERE (t, init) IN '
+                                     '(SELECT * FROM unnest(%s::timestamptz[], %s::timestamptz[]))'.format(table_name),
+                                     ([t for t, _ in batch], [init for _, init in batch]))
+            deleted += self.windb2.curs.rowcount
+            self.windb2.conn.commit()
+        self.logger.info('Deleted {} rows of {} superseded forecasts from {}'.format(deleted, len(superseded),
+                                                                                      table_name))
+
+        return deleted
+
+    def create_latest_forecast_view(self, table_name):
+        """Creates <table_name>_latest, a materialized view of the most recent forecast for every point, valid time and
+        height in a table with an init column, so that reading the current forecast doesn't have to sort through
+        every cycle. The view has a unique index on the same columns as the table without init, and has to be
+        refreshed with refresh_latest_forecast_view after new forecasts are inserted.
+
+        table_name Name of the table e.g. eastward_wind_1
+
+        returns The name of the view
+        """
+
+        view_name = '{}_latest'.format(table_name.lower())
+        sql = 'CREATE MATERIALIZED VIEW IF NOT EXISTS {0} AS ' \
+              'SELECT DISTINCT ON ({2}) * FROM {1} ORDER BY {2}, init DESC NULLS LAST'\
+            .format(view_name, table_name, ', '.join(GEOVARIABLE_UNIQUE_COLUMNS))
+        self.logger.debug(sql)
+        self.windb2.curs.execute(sql)
+        self.windb2.curs.execute('CREATE UNIQUE INDEX IF NOT EXISTS {0}_key ON {0} ({1})'
+                                 .format(view_name, ', '.join(GEOVARIABLE_UNIQUE_COLUMNS)))
+        self.windb2.conn.commit()
+
+        return view_name
+
+    def refresh_latest_forecast_view(self, table_name, concurrently=True):
+        """Brings the <table_name>_latest view made by create_latest_forecast_view up to date.
+
+        table_name Name of the table e.g. eastward_wind_1
+        concurrently Refreshes the view without locking out readers, which is slower than a plain refresh
+        """
+
+        self.windb2.curs.execute('REFRESH MATERIALIZED VIEW {}{}_latest'
+                                 .format('CONCURRENTLY ' if concurrently else '', table_name.lower()))
+        self.windb2.conn.commit()
+
     def calculateHorizWindGeomKeys(self, domainKey, xMax, yMax):
         """Given a domain it figures out which HorizWindGeom key corresponds to each x,y pair in a domain.
         This saves a lot of time by removing a sub-query that would normally be required to do this
         many times throughout the insert.
+
+        The grids are kept in memory for the GEOMKEY_CACHE_SIZE most recently used domains, so inserting more files
+        into the same domain doesn't query horizgeom again. If geomkey_cache_dir is set, the grids are also saved
+        there as .npy files named after the row count and an MD5 checksum of the horizgeom rows of the domain, which
+        only takes a single aggregate query to check on the next run.
            
         domainKey The key of the domain you want to get the HorizWindGeom keys for.
         xMax max x dimension
         yMax max y dimension.
       
-        Returns a 2D array [x][y] of the corresponding HorizWindGeom key for each (x,y) pair.
+        Returns a 2D read-only array [x][y] of the corresponding HorizWindGeom key for each (x,y) pair.
         Throws an SQLException"""
-       
-        # Create  a new 2D array to store the keys
-        keyArray = numpy.zeros((xMax, yMax), numpy.int)
-       
-        # Info
-        self.logger.info("Calculating the x,y pair geomkeys ({},{})...".format(xMax, yMax))
 
-        # Get the matching key pairs
-        sql = "SELECT sx.x, sy.y, key " + \
-              "FROM (SELECT generate_series(0, " + str(xMax) + ") AS x) AS sx, " + \
-              "     (SELECT generate_series(0, " + str(yMax) + ") AS y) AS sy, " + \
-              "     horizgeom AS h WHERE domainkey=" + str(domainKey) + " AND h.x=sx.x AND h.y=sy.y ORDER BY x,y";
-        self.windb2.curs.execute(sql)
-         
-        for row in self.windb2.curs.fetchall():
-            
-            # Debug
-            # print("keyArray[{}, {}] = {}".format(row[0], row[1], row[2]))
-            
-            keyArray[row[0], row[1]] = row[2]
-           
-        # Info
-        print("Finished calculating the x,y pair geomkeys.")
+        # Check the grids already in memory
+        cache_key = (self.windb2.conn.dsn, int(domainKey), xMax, yMax)
+        try:
+            _geomkey_cache.move_to_end(cache_key)
+            return _geomkey_cache[cache_key]
+        except KeyError:
+            pass
+
+        # Check the grids saved on disk
+        cache_file = None
+        if self.geomkey_cache_dir is not None:
+            self.windb2.curs.execute("SELECT count(*), md5(string_agg(key || ',' || x || ',' || y, ';' ORDER BY key)) "
+                                     "FROM horizgeom WHERE domainkey={}".format(domainKey))
+            count, checksum = self.windb2.curs.fetchone()
+            cache_file = os.path.join(self.geomkey_cache_dir,
+                                      'geomkeys_{}_{}x{}_{}_{}.npy'.format(domainKey, xMax, yMax, count, checksum))
+
+        if cache_file is not None and os.path.exists(cache_file):
+            self.logger.debug("Reading the x,y pair geomkeys from {}".format(cache_file))
+            keyArray = numpy.load(cache_file)
+        else:
+            # Info
+            self.logger.info("Calculating the x,y pair geomkeys ({},{})...".format(xMax, yMax))
+
+            # Scatter the matching keys into a new 2D array all at once
+            sql = "SELECT x, y, key FROM horizgeom WHERE domainkey={} AND x>=0 AND x<{} AND y>=0 AND y<{}" \
+                  "".format(domainKey, xMax, yMax)
+            self.windb2.curs.execute(sql)
+            rows = numpy.array(self.windb2.curs.fetchall(), numpy.int64).reshape(-1, 3)
+            keyArray = numpy.zeros((xMax, yMax), numpy.int64)
+            keyArray[rows[:, 0], rows[:, 1]] = rows[:, 2]
+
+            if cache_file is not None:
+                # Write to a temporary file first so other processes never read a partly written grid
+                os.makedirs(self.geomkey_cache_dir, exist_ok=True)
+                tmp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+                with open(tmp_file, 'wb') as f:
+                    numpy.save(f, keyArray)
+                os.replace(tmp_file, cache_file)
+
+            # Info
+            self.logger.info("Finished calculating the x,y pair geomkeys.")
+
+        # Shared between inserters, so don't let anyone change it
+        keyArray.flags.writeable = False
+        _geomkey_cache[cache_key] = keyArray
+        while len(_geomkey_cache) > GEOMKEY_CACHE_SIZE:
+            _geomkey_cache.popitem(last=False)
 
         return keyArray
 
@@ -377,9 +1137,9 @@ class Insert(object):
         if domain_key is None:
 
             # Insert the name into the domain table which returns the new key
-            sql = "INSERT INTO domain(name, resolution, units, datasource) VALUES ('" + data_name + "', 0, 'm', '" + data_creator + "') RETURNING key"
+            sql = "INSERT INTO domain(name, resolution, units, datasource) VALUES (%s, 0, 'm', %s) RETURNING key"
             try:
-                self.windb2.curs.execute(sql)
+                self.windb2.curs.execute(sql, (data_name, data_creator))
             except psycopg2.ProgrammingError as detail:
                 self.logger.error("Inserting a new domain domain failed. Exiting...")
                 sys.exit(-1)
@@ -393,9 +1153,8 @@ class Insert(object):
                                   check=('speed>=0', 'direction>=0 AND direction<=360'))
 
             # Add a 2D point for the made up location of the
-            sql = "INSERT INTO horizgeom(domainkey, x, y, geom) \
-                   VALUES (" + str(domain_key) + ",0,0, st_geomfromtext('POINT(" + str(longitude) + ' ' + str(latitude) + ")',4326)) RETURNING key"
-            self.windb2.curs.execute(sql)
+            statements.execute(self.windb2.curs, 'insert_horizgeom_point',
+                               (domain_key, 0, 0, float(longitude), float(latitude)))
             geomkey = self.windb2.curs.fetchone()[0]
 
             # Commit all of these additions
@@ -405,26 +1164,18 @@ class Insert(object):
         elif longitude != 0 and latitude != 0:
 
             # Make sure there's only one geomkey for this domain
-            sql = 'SELECT count(geom) FROM horizgeom WHERE domainkey={}'.format(domain_key)
-            self.logger.debug(sql)
-            self.windb2.curs.execute(sql)
+            statements.execute(self.windb2.curs, 'domain_geom_count', (domain_key,))
             geomkey_count = self.windb2.curs.fetchone()[0]
             if geomkey_count != 1:
                 raise ValueError('There should only be one geomkey for this domain, found {} geomkeys'.format(geomkey_count))
 
             # Get the geomkey for the location
-            sql = 'SELECT key FROM horizgeom WHERE domainkey={} AND x=0 AND y=0'.format(domain_key)
-            self.logger.debug(sql)
-            self.windb2.curs.execute(sql)
+            statements.execute(self.windb2.curs, 'domain_origin_geomkey', (domain_key,))
             geomkey = self.windb2.curs.fetchone()[0]
 
             # Issue warning if this geomkey is far away based on the coordinates provide. Some of the NOAA NDBC have
             # significant "drift" over the years (on the order of several km).
-            sql = "SELECT st_distance_sphere(geom, " \
-                  "st_geomfromtext('POINT({} {})',4326)) FROM horizgeom " \
-                  "WHERE key={}".format(longitude, latitude, geomkey)
-            self.logger.debug(sql)
-            self.windb2.curs.execute(sql)
+            statements.execute(self.windb2.curs, 'geomkey_distance', (geomkey, float(longitude), float(latitude)))
             distance = self.windb2.curs.fetchone()[0]
             if distance > 100:
                 self.logger.warning('Station {} was reported to be {} m away from its orignal location'.format(data_name,
@@ -432,36 +1183,39 @@ class Insert(object):
 
             # Make sure we actually found a geomkey
             if geomkey is None:
-                self.logger.error('This query did not return a geomkey: {}'.format(sql))
+                self.logger.error('No geomkey at x=0, y=0 in domain {}'.format(domain_key))
                 raise ValueError('No geomkey found to match the insert location.')
 
         # Otherwise, this is an ideal domain and there is not geom
         else:
             geomkey = 0
 
-        # Open a temporary file to COPY from
-        tempFile = tempfile.NamedTemporaryFile(mode='w')
-
         # Insert all of the data
         table_name = 'wind_{}'.format(domain_key)
-        for data in winddata:
 
-            # Add this row to be inserted into the database
-            print('{}, {}, {}, {}, {}, {}'.format(domain_key, geomkey, data.time, data.speed, int(data.direction),
-                                                  data.height), file=tempFile)
+        def rows():
+            """Rows to be inserted into the database"""
+            for data in winddata:
+                yield '{}, {}, {}, {}, {}, {}\n'.format(domain_key, geomkey, data.time, data.speed, int(data.direction),
+                                                        data.height)
+
+        # Nothing to insert
+        if not winddata:
+            self.windb2.conn.commit()
+            return
 
         # Insert the data
-        tempFile.flush()
+        self.create_partitions(table_name, min(data.time for data in winddata), max(data.time for data in winddata))
         insertColumns = ('domainkey', 'geomkey', 't', 'speed', 'direction', 'height')
         try:
-            self.windb2.curs.copy_from(open(tempFile.name, 'r'), table_name, sep=',', columns=insertColumns)
+            self.copy_rows(table_name, insertColumns, rows())
         except psycopg2.IntegrityError as e:
 
             # Delete the duplicate data
             # TODO this doesn't exactly work as well as it does with WRF database because many different times need
             # TODO to be deleted for this to work
-            errorTest = 'duplicate key value violates unique constraint "{}_domainkey_geomkey_t_height_key"'.format(table_name)
-            if re.search(errorTest, str(e.pgerror)):
+            # The unique index is named after the partition if the table is partitioned, so go by the error code
+            if e.pgcode == psycopg2.errorcodes.UNIQUE_VIOLATION:
 
                 # Delete the data and retry the insert if asked to replace data in the function call
                 if replace_data:
@@ -470,13 +1224,13 @@ class Insert(object):
                     self.windb2.conn.rollback()
 
                     # Delete that timearr (assumes UTC timearr zone)
-                    sql = 'DELETE FROM {} WHERE t = timestamp with time zone\'{}\''.format(table_name, data.time.strftime('%Y-%m-%d %H:%M:%S %Z'))
+                    sql = 'DELETE FROM {} WHERE t = timestamp with time zone\'{}\''.format(table_name, winddata[-1].time.strftime('%Y-%m-%d %H:%M:%S %Z'))
                     print("Deleting conflicting times: " + sql)
                     self.windb2.curs.execute(sql)
                     self.windb2.conn.commit()
 
                     # Reinsert that timearr
-                    self.windb2.curs.copy_from(open(tempFile.name, 'r'), table_name, sep=',', columns=insertColumns)
+                    self.copy_rows(table_name, insertColumns, rows())
 
                 # Otherwise, just notify that the insert failed because of duplicate data. We do re-raise this error
                 # because it's assumed that we want to suplement the WinDB with other data-heights if available.
@@ -485,5 +1239,10 @@ class Insert(object):
                     self.logger.warning('Use \'replace_data=True\' if you want the data to be reinserted.')
                     self.windb2.conn.rollback()
 
+            # Any other integrity error aborted the transaction, so don't pretend it was inserted
+            else:
+                self.windb2.conn.rollback()
+                raise
+
         # Commit the changes
         self.windb2.conn.commit()
\ No newline at end of file
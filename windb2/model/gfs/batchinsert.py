@@ -0,0 +1,114 @@
+"""Inserts a whole GFS cycle into a WinDB2 at once. Each forecast hour's GRIB file is opened once and every variable in
+the config is inserted from it, and the files are spread over a bounded pool of worker processes that each have their
+own WinDB2 connection."""
+
+import logging
+import multiprocessing
+
+from windb2 import windb2
+from windb2.model.gfs import config, insert
+from windb2.model.wrf.batchinsert import InsertResult
+
+logger = logging.getLogger('windb2')
+
+# The connection and inserter of each worker process, which are set up once by _init_worker
+_worker = {}
+
+
+def insert_file(inserter, filename, domain_key, **kwargs):
+    """Inserts every variable in the config from one GRIB file with InsertGFS.insert_file. Failures are returned in the
+    InsertResults instead of being raised so that one bad file or variable doesn't stop the rest of the cycle.
+
+    inserter - InsertGFS
+    filename - GRIB file of one forecast hour
+    domain_key - Existing domain key in the database, or None to create a new domain from this file
+    kwargs - Passed on to InsertGFS.insert_file e.g. replace_data, mask, copy_format
+
+    returns domain_key, results - The domain key the data were inserted into, and an InsertResult for each variable
+    """
+
+    results = []
+
+    def report(var_name, rows, seconds, error):
+        results.append(InsertResult(filename, var_name, rows, seconds, error))
+
+    _, domain_key = inserter.insert_file(filename, domain_key, report=report, **kwargs)
+
+    return domain_key, results
+
+
+def _init_worker(db_host, db_name, db_user, port, config_file):
+    """Connects a worker process to the WinDB2."""
+
+    conn = windb2.WinDB2(db_host, db_name, dbUser=db_user, port=port)
+    conn.connect()
+    _worker['inserter'] = insert.InsertGFS(conn, config.WinDB2GFSConfigParser(config_file))
+
+
+def _insert_task(task):
+    """Inserts one forecast hour on a worker."""
+
+    filename, domain_key, kwargs = task
+    return insert_file(_worker['inserter'], filename, domain_key, **kwargs)[1]
+
+
+def insert_files(filenames, db_host, db_name, db_user='postgres', port=5432, config_file='windb2-gfs.json',
+                 domain_key=None, mask=None, workers=None, **kwargs):
+    """Inserts every variable in the config from the GRIB files of a GFS cycle into a WinDB2, one file per task on a
+    pool of worker processes.
+
+    The first file is inserted before any worker starts, which creates the domain (if domain_key is None) and the
+    variable tables, so all of the files must be on the same grid.
+
+    filenames - GRIB files to insert, usually one per forecast hour
+    db_host, db_name, db_user, port - WinDB2 to connect to. Each worker makes its own connection.
+    config_file - WinDB2 GFS config file listing the variables to insert
+    domain_key - Existing domain key in the database. If left blank, a new domain will be created.
+    mask - String name of a mask in the WinDB2 database. Only relevant when creating a new domain.
+    workers - Number of worker processes, defaults to the number of CPUs. Each one holds a decoded file in memory.
+    kwargs - Passed on to InsertGFS.insert_file e.g. replace_data, copy_format
+
+    returns domain_key, results - The domain key the data were inserted into, and an InsertResult for every file and
+            variable in the same order as filenames and the config, no matter which order the workers finished in
+    """
+
+    if not filenames:
+        raise ValueError('No files to insert')
+
+    # Insert the first file here so the workers don't race to create the domain and tables
+    conn = windb2.WinDB2(db_host, db_name, dbUser=db_user, port=port)
+    conn.connect()
+    try:
+        inserter = insert.InsertGFS(conn, config.WinDB2GFSConfigParser(config_file))
+        domain_key, results = insert_file(inserter, filenames[0], domain_key, mask=mask, **kwargs)
+    finally:
+        conn.close()
+    if domain_key is None:
+        logger.error('Unable to create a domain from {}'.format(filenames[0]))
+        return domain_key, results
+
+    # Fan the rest of the forecast hours out over the workers
+    tasks = [(filename, domain_key, kwargs) for filename in filenames[1:]]
+    if tasks:
+        pool = multiprocessing.Pool(workers, initializer=_init_worker,
+                                    initargs=(db_host, db_name, db_user, port, config_file))
+        try:
+            for file_results in pool.imap(_insert_task, tasks):
+                for result in file_results:
+                    if result.error is None:
+                        logger.info('Inserted {} rows of {} from {} in {:.1f} s'.format(result.rows, result.var_name,
+                                                                                        result.filename,
+                                                                                        result.seconds))
+                    else:
+                        logger.error('Failed to insert {} from {}'.format(result.var_name, result.filename))
+                results += file_results
+            pool.close()
+
+        # Stop the workers on Ctrl-C too
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    return domain_key, results
@@ -2,9 +2,11 @@ from __future__ import (absolute_import, division,
                         print_function, unicode_literals)
 from builtins import *
 import logging
+import os
 import re
 import sys
-import tempfile
+import time
+import traceback
 from datetime import datetime
 import pytz
 
@@ -12,9 +14,61 @@ import psycopg2
 import numpy
 import xarray
 from windb2.insert import Insert
-from windb2 import util
+from windb2 import insert, util
 import windb2.model.gfs.util
 
+
+def vars_to_insert(gfs_config):
+    """Returns the names of the variables in a WinDB2 GFS config that have levels to insert."""
+
+    return [var for var in gfs_config['vars'] if isinstance(gfs_config['vars'][var].get('insert'), list)]
+
+
+def open_gfs_file(gribfile, index_dir=None):
+    """Opens every hypercube of a GFS GRIB file in one pass with cfgrib, so that all of the variables can be inserted
+    without decoding the file again for each one. cfgrib writes an index of the GRIB messages the first time a file is
+    opened and reuses it after that.
+
+    gribfile - Name of the GRIB file
+    index_dir - Directory to keep the cfgrib index files in, next to the GRIB file by default
+
+    returns A list of xarray.Datasets, which should be closed when done
+    """
+
+    import cfgrib
+
+    backend_kwargs = {}
+    if index_dir is not None:
+        backend_kwargs['indexpath'] = os.path.join(index_dir, os.path.basename(gribfile) + '.{short_hash}.idx')
+    return cfgrib.open_datasets(gribfile, backend_kwargs=backend_kwargs)
+
+
+def variable_dataset(datasets, var_name, var_config):
+    """Finds a variable from a WinDB2 GFS config in the datasets of a GRIB file opened with open_gfs_file, at its
+    cfgribTypeOfLevel and the first level to insert.
+
+    returns An xarray.Dataset with only the variable, ready for InsertGFS.insert_variable
+    """
+
+    type_of_level = var_config.get('cfgribTypeOfLevel')
+    level = var_config['insert'][0]
+    for dataset in datasets:
+        if var_name not in dataset.data_vars:
+            continue
+        if type_of_level is None:
+            return dataset[[var_name]]
+        if type_of_level not in dataset.coords:
+            continue
+        levels = dataset.coords[type_of_level]
+        if levels.ndim == 0:
+            if levels.item() == level:
+                return dataset[[var_name]]
+        elif (levels == level).any():
+            return dataset[[var_name]].sel({type_of_level: level})
+
+    raise KeyError('{} at {}={} is not in the GRIB file'.format(var_name, type_of_level, level))
+
+
 class InsertGFS(Insert):
     """Class for inserting GFS into WinDB2."""
 
@@ -25,12 +79,20 @@ class InsertGFS(Insert):
             super().__init__(windb2)
 
         self.config = config.config
+        self.geomkey_cache_dir = self.config.get('geomkey_cache_dir')
+        self.partition = self.config.get('partition')
+        self.rows_inserted = 0
+
+        # Regions to insert as [west, south, east, north] bounding boxes, or the whole globe if there aren't any
+        self.bboxes = self.config.get('bbox')
+        if self.bboxes and not isinstance(self.bboxes[0], list):
+            self.bboxes = [self.bboxes]
 
         # Logging
         self.logger = logging.getLogger('windb2')
 
     def insert_variable(self, gfsfile, var_name, table_var_name, domain_key=None, replace_data=False, sql_where="true",
-                        mask=None, zero_seconds=False):
+                        mask=None, zero_seconds=False, copy_format='text'):
         """Inserts a GFS GRIB into a WinDB2 database.
        *
        * windb2Conn - Connection to a WinDB2 database.
@@ -42,12 +104,16 @@ class InsertGFS(Insert):
        * file_type - Type of netCDF file to insert: {'windb2' (default), or 'wrf'}
        * mask - String name of a mask in the WinDB2 database. Only relevant when creating a new domain (the mask is
        *        applied automatically thereafter).
+       * copy_format - Format the rows are sent to the COPY command in: {'text' (default), or 'binary'}
        *
        * returns timesInsertedList, domain_key - A list of times inserted in ISO time format, and the
          domain_key where the data was inserted.
          :param file_type:
        """
 
+        if copy_format != 'text' and copy_format != 'binary':
+            raise TypeError('Unsupported copy_format: {}'.format(copy_format))
+
         # Open the GFS GRIB file if it already isn't open
         if type(gfsfile) != xarray.Dataset:
             gfsfile = xarray.open_dataset(gfsfile, engine='cfgrib',
@@ -55,15 +121,12 @@ class InsertGFS(Insert):
                                                                              'stepType': 'instant'}})
         nlong = gfsfile.longitude.shape[0]
         nlat = gfsfile.latitude.shape[0]
-        x_coord_array = \
-            numpy.tile(gfsfile.longitude.data[numpy.newaxis], (nlat, 1))[numpy.newaxis]  # insert_horiz_geom wants a 2D coordinate below
-        x_coord_array = windb2.model.gfs.util.center_coords_on_prime_meridian(x_coord_array)  # make centered on zero instead of going 0 to 360 degrees
-        y_coord_array = \
-            numpy.tile(gfsfile.latitude.data[numpy.newaxis], (nlong, 1)).T[numpy.newaxis]  # insert_horiz_geom wants a 2D coordinate below
         init_t = \
             datetime.utcfromtimestamp(gfsfile.time.time.data.astype(datetime) / 1E9)  # convert datetime64 to datetime: https://stackoverflow.com/a/50625532
         valid_t = datetime.utcfromtimestamp(gfsfile.time.valid_time.data.astype(datetime) / 1E9)
-        gfsvar = gfsfile[var_name].data
+
+        # Index windows of the regions to insert in the global grid
+        windows = windb2.model.gfs.util.bbox_windows(gfsfile.longitude.data, gfsfile.latitude.data, self.bboxes)
 
         # Create a new and/or domain if necessary
         resolution = abs(gfsfile.latitude.data[1] - gfsfile.latitude.data[0])
@@ -71,7 +134,15 @@ class InsertGFS(Insert):
             domain_key = self.create_new_domain('Global Forecast System',
                                                 gfsfile.attrs['GRIB_centreDescription'],
                                                 resolution, 'deg', mask)
-            self.insert_horiz_geom(domain_key, x_coord_array, y_coord_array, 4326, mask=mask)  # SRID=4326 is WGS84 for GFS
+
+            # The points keep their x,y in the global grid, but only those in the regions are added. insert_horiz_geom
+            # wants 2D coordinates, centered on zero instead of going 0 to 360 degrees.
+            x_coord_array = numpy.tile(gfsfile.longitude.data[numpy.newaxis], (nlat, 1))[numpy.newaxis]
+            x_coord_array = windb2.model.gfs.util.center_coords_on_prime_meridian(x_coord_array)
+            y_coord_array = numpy.tile(gfsfile.latitude.data[numpy.newaxis], (nlong, 1)).T[numpy.newaxis]
+            keep = windb2.model.gfs.util.bbox_mask(gfsfile.longitude.data, gfsfile.latitude.data, self.bboxes)
+            # SRID=4326 is WGS84 for GFS
+            self.insert_horiz_geom(domain_key, x_coord_array, y_coord_array, 4326, mask=mask, keep=keep)
 
             # Mask the domain if necessary
             # TODO unclear why this is not done inside of create_new_domain
@@ -86,43 +157,49 @@ class InsertGFS(Insert):
         # Get the geomkeys associated with the coordinates
         horizgeomkey = self.calculateHorizWindGeomKeys(domain_key, nlong, nlat)
 
+        # Make sure there's a partition for this time if the table is partitioned
+        self.create_partitions('{}_{}'.format(table_var_name, domain_key), valid_t)
+
         # Create a counter to execute every so often
         startTime = datetime.now()
-        counter = 0
-
-        # Open a temporary file to COPY from
-        temp_file = tempfile.NamedTemporaryFile(mode='w')
-
-        # Iterate through the x,y, and timearr and insert the WRF variable
-        for x in range(horizgeomkey.shape[0]):
-            for y in range(horizgeomkey.shape[1]):
-
-                # Make sure that this is actually a x,y point we want to insert
-                # In order to create a mask of selective insert points, all
-                # a horizGeomKey of zero means we don't want to insert this one
-                if horizgeomkey[x, y] == 0:
-                    continue
-
-                # Add this row to be inserted into the database
-                if self.config['vars'][var_name]['dims'] == 2:
-                    val = gfsvar[y, x]
-
-                if not numpy.isnan(val):
-                    insert_val = '{}, {}, {}, {}, {}, {}'.format(domain_key, horizgeomkey[x, y],
-                                                                 valid_t.strftime('%Y-%m-%d %H:%M:%S %Z'),
-                                                                 val,
-                                                                 0,  # TODO this should come from the config
-                                                                 init_t.strftime('%Y-%m-%d %H:%M:%S %Z'))
-                    print(insert_val, file=temp_file)
-                    counter += 1
-
-        # Insert the data
-        temp_file.flush()
+
+        # Build the x,y block of each region at once, transposing the data from [y, x] to [x, y] like the horizgeomkey.
+        # The variable is indexed before it's read so that only the region is loaded into memory. A horizgeomkey of
+        # zero or a missing value means the point isn't inserted.
+        geomkeys = []
+        values = []
+        for x_index, y_index in windows:
+            gfsvar = gfsfile[var_name].isel(longitude=x_index, latitude=y_index).data
+            val_block = numpy.ma.filled(numpy.ma.asarray(gfsvar, numpy.float32), numpy.nan).T
+            window_geomkeys = horizgeomkey[x_index][:, y_index]
+            point_mask = insert.insert_mask(window_geomkeys, val_block)
+            geomkeys.append(window_geomkeys[point_mask])
+            values.append(val_block[point_mask])
+        geomkeys = numpy.concatenate(geomkeys)
+        values = numpy.concatenate(values)
+
+        # Overlapping regions would insert the same point twice
+        if len(windows) > 1:
+            geomkeys, first = numpy.unique(geomkeys, return_index=True)
+            values = values[first]
+        counter = int(geomkeys.shape[0])
+
+        # Encode all of the rows in one go and stream them into the table
         insert_columns = ('domainkey', 'geomkey', 't', 'value', 'height', 'init')
-        self.windb2.curs.copy_from(open(temp_file.name, 'r'), '{}_{}'.format(table_var_name, domain_key), sep=',',
-                                   columns=insert_columns)
+        if copy_format == 'binary':
+            # TODO height should come from the config
+            rows = insert.pgcopy_binary((int(domain_key), geomkeys, valid_t, values, 0, init_t),
+                                        ('int', 'int', 'timestamptz', 'real', 'real', 'timestamptz'))
+        else:
+            rows = insert.format_rows(domain_key, geomkeys, valid_t.strftime('%Y-%m-%d %H:%M:%S %Z'), values,
+                                      0,  # TODO this should come from the config
+                                      init_t.strftime('%Y-%m-%d %H:%M:%S %Z'))
+        self.copy_rows('{}_{}'.format(table_var_name, domain_key), insert_columns, rows,
+                       binary=copy_format == 'binary')
+
         # Commit the changes
         self.windb2.conn.commit()
+        self.rows_inserted += counter
 
         # Calaculate the insert rate
         elapsedTime = (datetime.now() - startTime).seconds
@@ -133,11 +210,65 @@ class InsertGFS(Insert):
         except UnboundLocalError:
             print('Inserted {} x,y wind points'.format(counter))
 
-        # Close the tempfile so it is deleted
-        temp_file.close()
-
         return [valid_t.strftime('%Y-%m-%dT%H:%M:%S.000Z')], domain_key
 
+    def insert_file(self, gribfile, domain_key=None, replace_data=False, mask=None, copy_format='text', report=None):
+        """Inserts every variable with levels to insert in the config from a GFS GRIB file, opening and indexing the
+        file once for all of them.
+
+        gribfile - Name of the GRIB file
+        domain_key - Existing domain key in the database. If left blank, a new domain will be created.
+        replace_data, mask, copy_format - See insert_variable
+        report - Called as report(var_name, rows, seconds, error) after each variable, where error is the formatted
+                 traceback of a failure or None. If given, a variable that fails is rolled back and reported instead of
+                 raised so that the rest of the file is still inserted, and a file that can't be opened is reported as
+                 a failure of every variable.
+
+        returns timesInsertedList, domain_key - See insert_variable
+        """
+
+        var_names = vars_to_insert(self.config)
+        times = []
+        start = time.time()
+        try:
+            datasets = open_gfs_file(gribfile, self.config.get('index_dir'))
+        except Exception:
+            if report is None:
+                raise
+            error = traceback.format_exc()
+            for var_name in var_names:
+                report(var_name, 0, time.time() - start, error)
+            return times, domain_key
+
+        try:
+            for var_name in var_names:
+                var_config = self.config['vars'][var_name]
+                self.logger.debug('Inserting {} from {}'.format(var_name, gribfile))
+                rows_before = self.rows_inserted
+                start = time.time()
+                try:
+                    times, domain_key = self.insert_variable(variable_dataset(datasets, var_name, var_config),
+                                                             var_name, var_config.get('cfVarName', var_name),
+                                                             domain_key=domain_key, replace_data=replace_data,
+                                                             mask=mask, copy_format=copy_format)
+                    error = None
+                except (Exception, SystemExit):
+                    if report is None:
+                        raise
+                    error = traceback.format_exc()
+                    try:
+                        self.windb2.conn.rollback()
+                    except Exception:
+                        self.logger.exception('Unable to roll back after failing to insert {} from {}'
+                                              .format(var_name, gribfile))
+                if report is not None:
+                    report(var_name, self.rows_inserted - rows_before, time.time() - start, error)
+        finally:
+            for dataset in datasets:
+                dataset.close()
+
+        return times, domain_key
+
     def _create_initialization_time_column(self, table_name, domain_key):
         """Adds the initialization time column to allow for multiple forecasts to coexist"""
         self.windb2.curs.execute('ALTER TABLE {}_{} ADD COLUMN init TIMESTAMP WITH TIME ZONE'
@@ -0,0 +1,24 @@
+import unittest
+from windb2.model.gfs import batchinsert
+from windb2.model.gfs.test_insert import RecordingInsertGFS
+
+
+class TestInsertFile(unittest.TestCase):
+
+    def testUnreadableFile(self):
+        # A file that can't be opened fails every variable without raising, so the rest of the cycle carries on
+        inserter = RecordingInsertGFS(None)
+        domain_key, results = batchinsert.insert_file(inserter, 'gfs.t00z.pgrb2.0p25.f999', '1')
+        self.assertEqual(domain_key, '1')
+        self.assertEqual([(result.filename, result.var_name, result.rows) for result in results],
+                         [('gfs.t00z.pgrb2.0p25.f999', 'u10', 0)])
+        self.assertIsNotNone(results[0].error)
+        self.assertEqual(inserter.copied, [])
+
+        # Without a report the failure is raised
+        with self.assertRaises(Exception):
+            inserter.insert_file('gfs.t00z.pgrb2.0p25.f999', '1')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+import struct
+import unittest
+import numpy
+import xarray
+from windb2 import insert as windb2_insert
+from windb2.model.gfs import insert
+
+
+class FakeConfig(object):
+
+    def __init__(self, **options):
+        self.config = dict(options, vars={'u10': {'dims': 2, 'cfgribTypeOfLevel': 'heightAboveGround', 'insert': [10]}})
+
+
+class FakeWinDB2(object):
+    """Stands in for a connected WinDB2 with the variable table already created."""
+
+    def __init__(self):
+        self.conn = self
+
+    def table_exists(self, table_name):
+        return True
+
+    def commit(self):
+        pass
+
+
+class RecordingInsertGFS(insert.InsertGFS):
+    """InsertGFS that records the rows sent to COPY instead of sending them to a database."""
+
+    def __init__(self, geomkeys, **options):
+        super().__init__(FakeWinDB2(), FakeConfig(**options))
+        self.geomkeys = geomkeys
+        self.copied = []
+
+    def calculateHorizWindGeomKeys(self, domainKey, xMax, yMax):
+        return self.geomkeys
+
+    def create_partitions(self, table_name, t_min, t_max=None):
+        return []
+
+    def copy_rows(self, table_name, columns, rows, sep=',', binary=False):
+        self.copied.append((table_name, columns, rows, binary))
+
+
+def gfs_dataset(values):
+    """Returns a dataset shaped like a cfgrib GFS field with [latitude, longitude] values."""
+
+    nlat, nlong = values.shape
+    return xarray.Dataset({'u10': (('latitude', 'longitude'), values)},
+                          coords={'latitude': numpy.linspace(90, -90, nlat),
+                                  'longitude': numpy.arange(nlong) * 360. / nlong,
+                                  'time': numpy.datetime64('2020-06-01T00:00', 'ns'),
+                                  'valid_time': numpy.datetime64('2020-06-01T06:00', 'ns')})
+
+
+class TestInsertVariable(unittest.TestCase):
+
+    def setUp(self):
+        rng = numpy.random.RandomState(0)
+        self.values = rng.standard_normal((3, 4)).astype(numpy.float32)  # [y, x]
+        self.values[1, 2] = numpy.nan
+        self.geomkeys = numpy.arange(1, 13).reshape((4, 3))  # [x, y]
+        self.geomkeys[0, 1] = 0
+
+    def testTextRowsMatchPerPoint(self):
+        # Rows the way the per-(x,y) loop used to print them
+        expected = []
+        for x in range(self.geomkeys.shape[0]):
+            for y in range(self.geomkeys.shape[1]):
+                if self.geomkeys[x, y] != 0 and not numpy.isnan(self.values[y, x]):
+                    expected.append((self.geomkeys[x, y], float(self.values[y, x])))
+
+        inserter = RecordingInsertGFS(self.geomkeys)
+        times, domain_key = inserter.insert_variable(gfs_dataset(self.values), 'u10', 'eastward_wind', domain_key='1')
+        self.assertEqual(times, ['2020-06-01T06:00:00.000Z'])
+        table_name, columns, rows, binary = inserter.copied[0]
+        self.assertEqual(table_name, 'eastward_wind_1')
+        self.assertFalse(binary)
+
+        rows = [row.split(', ') for row in rows.splitlines()]
+        self.assertEqual([(int(row[1]), float(row[3])) for row in rows], expected)
+        self.assertEqual(rows[0][2], '2020-06-01 06:00:00 ')
+        self.assertEqual(rows[0][5], '2020-06-01 00:00:00 ')
+
+    def testBinaryMatchesText(self):
+        inserter = RecordingInsertGFS(self.geomkeys)
+        inserter.insert_variable(gfs_dataset(self.values), 'u10', 'eastward_wind', domain_key='1',
+                                 copy_format='binary')
+        inserter.insert_variable(gfs_dataset(self.values), 'u10', 'eastward_wind', domain_key='1')
+        binary_rows, text_rows = inserter.copied[0][2], inserter.copied[1][2]
+
+        # Field count, then the length and value of the domain key and geomkey in each binary row
+        row_size = struct.calcsize('>h ii ii iq if if iq')
+        body = binary_rows[len(windb2_insert.PGCOPY_HEADER):-2]
+        self.assertEqual(len(body) // row_size, len(text_rows.splitlines()))
+        geomkeys = [struct.unpack_from('>h ii ii', body, i * row_size)[4] for i in range(len(body) // row_size)]
+        self.assertEqual(geomkeys, [int(row.split(', ')[1]) for row in text_rows.splitlines()])
+
+        with self.assertRaises(TypeError):
+            inserter.insert_variable(gfs_dataset(self.values), 'u10', 'eastward_wind', domain_key='1',
+                                     copy_format='csv')
+
+    def testRegions(self):
+        # A 90 degree grid with the first region across the prime meridian and a second one that overlaps it
+        inserter = RecordingInsertGFS(self.geomkeys, bbox=[[-90, -90, 0, 0], [0, -90, 0, 90]])
+        inserter.insert_variable(gfs_dataset(self.values), 'u10', 'eastward_wind', domain_key='1',
+                                 copy_format='binary')
+        body = inserter.copied[0][2][len(windb2_insert.PGCOPY_HEADER):-2]
+        row_size = struct.calcsize('>h ii ii iq if if iq')
+        rows = [struct.unpack_from('>h ii ii iq if', body, i * row_size) for i in range(len(body) // row_size)]
+
+        # Longitudes 270 and 0 at latitudes 0 and -90 and longitude 0 at latitude 90 once each, without the masked point
+        # at longitude 0 and latitude 0 or anything at longitudes 90 and 180
+        expected = sorted((self.geomkeys[x, y], self.values[y, x]) for x, y in ((3, 1), (3, 2), (0, 2), (0, 0)))
+        self.assertEqual([(row[4], row[8]) for row in rows], expected)
+
+
+class TestVariableDataset(unittest.TestCase):
+
+    def setUp(self):
+        values = numpy.zeros((2, 3))
+        dims = ('latitude', 'longitude')
+        self.datasets = [
+            xarray.Dataset({'u10': (dims, values), 'v10': (dims, values)}, coords={'heightAboveGround': 10}),
+            xarray.Dataset({'t2m': (dims, values), 'r2': (dims, values + 50)}, coords={'heightAboveGround': 2}),
+            xarray.Dataset({'t': (('isobaricInhPa',) + dims, numpy.stack([values + 280, values + 250]))},
+                           coords={'isobaricInhPa': [850, 500]}),
+            xarray.Dataset({'t': (dims, values + 290)}, coords={'surface': 0})]
+
+    def testFindsLevel(self):
+        dataset = insert.variable_dataset(self.datasets, 'r2', {'cfgribTypeOfLevel': 'heightAboveGround',
+                                                                 'insert': [2]})
+        self.assertEqual(list(dataset.data_vars), ['r2'])
+        self.assertEqual(float(dataset['r2'][0, 0]), 50)
+
+        # The same variable at different types of level, and a level out of a level dimension
+        self.assertEqual(float(insert.variable_dataset(self.datasets, 't', {'cfgribTypeOfLevel': 'surface',
+                                                                             'insert': [0]})['t'][0, 0]), 290)
+        dataset = insert.variable_dataset(self.datasets, 't', {'cfgribTypeOfLevel': 'isobaricInhPa', 'insert': [500]})
+        self.assertEqual(dataset['t'].shape, (2, 3))
+        self.assertEqual(float(dataset['t'][0, 0]), 250)
+
+        with self.assertRaises(KeyError):
+            insert.variable_dataset(self.datasets, 'u10', {'cfgribTypeOfLevel': 'heightAboveGround', 'insert': [80]})
+
+    def testVarsToInsert(self):
+        gfs_config = {'vars': {'u10': {'insert': [10]}, 'gust': {'dims': 2}, 't2m': {'insert': [2]}}}
+        self.assertEqual(sorted(insert.vars_to_insert(gfs_config)), ['t2m', 'u10'])
+
+
+if __name__ == '__main__':
+    unittest.main()
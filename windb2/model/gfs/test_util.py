@@ -6,3 +6,30 @@ class TestUtil(unittest.TestCase):
     def test_coord_shift(self):
         self.assertEqual(util.center_coords_on_prime_meridian(numpy.array([181])), -179)
         self.assertEqual(util.center_coords_on_prime_meridian(numpy.array([360])), 0)
+
+    def test_longitude_index(self):
+        longitude = numpy.arange(0, 360, 0.25)
+
+        # Regions either side of the seam of the 0 to 360 degree grid, given in either convention
+        self.assertEqual(util.longitude_index(longitude, 10, 20), slice(40, 81))
+        self.assertEqual(util.longitude_index(longitude, -170, -160), slice(760, 801))
+        self.assertEqual(util.longitude_index(longitude, 170, -170), slice(680, 761))
+        self.assertEqual(util.longitude_index(longitude, -180, 180), slice(None))
+
+        # Across the prime meridian the window wraps around the end of the grid
+        index = util.longitude_index(longitude, -1, 1)
+        numpy.testing.assert_array_equal(longitude[index], [359, 359.25, 359.5, 359.75, 0, 0.25, 0.5, 0.75, 1])
+
+    def test_bbox_windows(self):
+        longitude = numpy.arange(0, 360, 1.)
+        latitude = numpy.arange(90, -91, -1.)
+        self.assertEqual(util.bbox_windows(longitude, latitude), [(slice(None), slice(None))])
+        x_index, y_index = util.bbox_windows(longitude, latitude, [[-125, 32, -117, 42]])[0]
+        self.assertEqual((longitude[x_index][[0, -1]].tolist(), latitude[y_index][[0, -1]].tolist()),
+                         ([235, 243], [42, 32]))
+
+        # Overlapping boxes are only counted once
+        mask = util.bbox_mask(longitude, latitude, [[-1, -1, 1, 1], [0, 0, 2, 2]])
+        self.assertEqual(mask.shape, (181, 360))
+        self.assertEqual(numpy.count_nonzero(mask), 9 + 9 - 4)
+        self.assertTrue(mask[90, 359] and mask[88, 2] and not mask[88, 359])
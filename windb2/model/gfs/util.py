@@ -5,3 +5,65 @@ def center_coords_on_prime_meridian(longitude):
     longitude[longitude > 180] = longitude[longitude > 180] - 360
 
     return longitude
+
+
+def _contiguous(index):
+    """Returns a slice instead of an index array if the indexes are contiguous, so xarray can read a plain window."""
+
+    if index.size > 0 and (numpy.diff(index) == 1).all():
+        return slice(int(index[0]), int(index[-1]) + 1)
+    return index
+
+
+def longitude_index(longitude, west, east):
+    """Returns the index of the longitudes from west to east, going east across the 0/360 seam of the GFS grid if
+    necessary. The bounds can be given from -180 to 180 or 0 to 360 degrees."""
+
+    if east - west >= 360:
+        return slice(None)
+    longitude = numpy.asarray(longitude) % 360
+    west %= 360
+    east %= 360
+    if west <= east:
+        index = numpy.flatnonzero((longitude >= west) & (longitude <= east))
+    else:
+        index = numpy.concatenate((numpy.flatnonzero(longitude >= west), numpy.flatnonzero(longitude <= east)))
+
+    return _contiguous(index)
+
+
+def latitude_index(latitude, south, north):
+    """Returns the index of the latitudes from south to north, which are in either order in the grid."""
+
+    latitude = numpy.asarray(latitude)
+    return _contiguous(numpy.flatnonzero((latitude >= south) & (latitude <= north)))
+
+
+def bbox_windows(longitude, latitude, bboxes=None):
+    """Returns the x (longitude) and y (latitude) index of each bounding box in the GFS grid, which can be used to read
+    only the regions wanted with xarray's isel.
+
+    longitude - 1D array of the grid longitudes from 0 to 360 degrees
+    latitude - 1D array of the grid latitudes
+    bboxes - List of [west, south, east, north] bounding boxes in degrees, or None for the whole grid
+
+    returns A list of (x_index, y_index), each a slice or an array of indexes
+    """
+
+    if not bboxes:
+        return [(slice(None), slice(None))]
+
+    return [(longitude_index(longitude, west, east), latitude_index(latitude, south, north))
+            for west, south, east, north in bboxes]
+
+
+def bbox_mask(longitude, latitude, bboxes=None):
+    """Returns a boolean [y, x] array of the grid points in any of the bounding boxes, see bbox_windows."""
+
+    mask = numpy.zeros((len(latitude), len(longitude)), dtype=bool)
+    x_all = numpy.arange(len(longitude))
+    y_all = numpy.arange(len(latitude))
+    for x_index, y_index in bbox_windows(longitude, latitude, bboxes):
+        mask[y_all[y_index][:, numpy.newaxis], x_all[x_index]] = True
+
+    return mask
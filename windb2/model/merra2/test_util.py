@@ -1,7 +1,11 @@
+import os
+import struct
+import tempfile
 import unittest
 import numpy
+from netCDF4 import Dataset
 from windb2.model.merra2 import util
-from windb2 import windb2
+from windb2 import insert, windb2
 
 
 class TestUtil(unittest.TestCase):
@@ -21,4 +25,49 @@ class TestUtil(unittest.TestCase):
         self.assertEqual(util._convert_long_to_index(-179.375, -90), (0, 0))
         self.assertEqual(util._convert_long_to_index(180, 90), (575, 360))
         numpy.testing.assert_array_equal(util._convert_long_to_index([-100.625, -100], [32.5, 33.0]),
-                                         [[126, 127], [245, 246]])
\ No newline at end of file
+                                         [[126, 127], [245, 246]])
+
+
+class TestInsert(unittest.TestCase):
+
+    def setUp(self):
+        # Two nodes and three hours of u50m with a missing value at the second node
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, 'merra2.nc')
+        with Dataset(self.filename, 'w') as ncfile:
+            ncfile.createDimension('time', 3)
+            ncfile.createDimension('lat', 1)
+            ncfile.createDimension('lon', 2)
+            time = ncfile.createVariable('time', 'f8', ('time',))
+            time.units = 'days since 1980-01-01 00:30:00'
+            time[:] = numpy.arange(3) / 24. + 1e-9
+            u50m = ncfile.createVariable('u50m', 'f4', ('time', 'lat', 'lon'))
+            u50m.missing_value = numpy.float32(1e15)
+            u50m.set_auto_mask(False)
+            u50m[:] = [[[1, 2]], [[3, 1e15]], [[5, 6]]]
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def testHeight(self):
+        self.assertEqual(util.merra2_height('u50m'), 50)
+        self.assertEqual(util.merra2_height('ps'), -9999)
+
+    def testCopyBlock(self):
+        with Dataset(self.filename) as ncfile:
+            times = util.merra2_times(ncfile)
+            values = util.read_merra2_variable(ncfile, 'u50m')
+        numpy.testing.assert_array_equal(times, numpy.array(['1980-01-01T00:30', '1980-01-01T01:30',
+                                                             '1980-01-01T02:30'], 'datetime64[us]'))
+        self.assertTrue(numpy.isnan(values[1, 0, 1]))
+
+        block, nrows = util.merra2_copy_block(3, numpy.array([[11, 12]]), times, 50., values)
+        self.assertEqual(nrows, 5)
+
+        # Node by node, then time
+        row_format = '>h ii ii iq if if'
+        body = block[len(insert.PGCOPY_HEADER):-2]
+        rows = [struct.unpack_from(row_format, body, i * struct.calcsize(row_format)) for i in range(nrows)]
+        self.assertEqual([(row[4], row[8], row[10]) for row in rows],
+                         [(11, 50, 1), (11, 50, 3), (11, 50, 5), (12, 50, 2), (12, 50, 6)])
+        self.assertEqual(rows[1][6] - rows[0][6], 3600 * 10**6)
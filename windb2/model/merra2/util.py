@@ -105,81 +105,134 @@ def download_all_merra2(windb2, long, lat, variables, dryrun=False, download_mis
 
             start_t_incl += timedelta(days=chunk_size_days)
 
-def insert_merra2_file(windb2conn, ncfile, vars, reinsert=False):
-    """Inserts a MERRA2 file downloaded using ncks
-
-    ncfile: netCDF file downloaded with ncks
-    vars: CSV list of MERRA2 variables (e.g. u50m,v50m,ps)
-    """
-    from netCDF4 import Dataset, num2date
+def merra2_height(var):
+    """Returns the height in the name of a MERRA2 variable e.g. 50 for u50m, or -9999 for one without a height like ps"""
     import re
-    from windb2.struct import geovariable, insert
-    import pytz
 
-    # Info
-    print('Inserting: {}'.format(ncfile))
+    var_re = re.match(r'([a-z]+)([0-9]*)([a-z]*)[,]*', var)
+    if var_re.group(2):
+        return float(var_re.group(2))
+    return -9999.
 
-    # Open the netCDF file
-    ncfile = Dataset(ncfile, 'r')
 
-    # Get the times
+def merra2_times(ncfile):
+    """Returns the times of an open MERRA2 netCDF file as a numpy.datetime64 array in UTC"""
+    from netCDF4 import num2date
+
     timevar = ncfile.variables['time']
-    timearr = num2date(timevar[:], units=timevar.units)
+    times = num2date(timevar[:], units=timevar.units, only_use_cftime_datetimes=False)
 
-    # For each variable...
-    for var in vars.split(','):
+    # Clean up the seconds because every other time has a residual
+    return np.array([t.replace(microsecond=0, tzinfo=None) for t in times], 'datetime64[us]')
 
-        # Masked value to check for
-        missing_value = ncfile[var].missing_value
 
+def read_merra2_variable(ncfile, var):
+    """Reads a whole [time, lat, long] variable from an open MERRA2 netCDF file at once, with NaN wherever the value
+    is masked or equal to the missing_value"""
 
-        # Break up the variable name
-        var_re = re.match(r'([a-z]+)([0-9]*)([a-z]*)[,]*', var)
+    ncvar = ncfile.variables[var]
+    values = np.ma.asarray(ncvar[:])
+    if hasattr(ncvar, 'missing_value'):
+        values = np.ma.masked_equal(values, ncvar.missing_value)
+
+    return np.ma.filled(values.astype(np.float32), np.nan)
 
-        # For each lat
-        latcount = 0
-        latarr = ncfile.variables['lat'][:]
-        for lat in latarr:
 
-            # For each long
-            longcount = 0
-            longarr = ncfile.variables['lon'][:]
-            for long in longarr:
+def merra2_copy_block(domain_key, geomkeys, times, height, values):
+    """Encodes every node and time of a MERRA2 variable as binary COPY rows for a <var>_<domainkey> table, leaving out
+    the missing values. The rows are ordered by node and then time.
 
-                # For each time in the variable
-                tcount = 0
-                varstoinsert = []
-                for t in timearr:
+    domain_key: key of the MERRA2 domain
+    geomkeys: [lat, long] array of the geomkey of each node
+    times: numpy.datetime64 array of the times in UTC
+    height: height of the variable, see merra2_height
+    values: [time, lat, long] array of the variable with NaN for missing values, see read_merra2_variable
 
-                    # Clean up the seconds because every other time has a residual
-                    t = t.replace(microsecond=0).replace(tzinfo=pytz.utc)
+    returns bytes to pass to Insert.copy_rows with binary=True, and the number of rows
+    """
+    from windb2 import insert
 
-                    # Figure out the height
-                    if var_re.group(2) is not None:
-                        height = var_re.group(2)
-                    else:
-                        height = -9999
+    values = values.transpose(1, 2, 0)
+    mask = ~np.isnan(values)
+    block = insert.pgcopy_binary([domain_key, np.broadcast_to(geomkeys[:, :, np.newaxis], values.shape)[mask],
+                                  np.broadcast_to(times, values.shape)[mask], height, values[mask]],
+                                 ['int', 'int', 'timestamptz', 'real', 'real'])
 
-                    # Append the data to insert
-                    if ncfile.variables[var][tcount, latcount, longcount] != missing_value:
-                        v = geovariable.GeoVariable(var, t, height,
-                            ncfile.variables[var][tcount, latcount, longcount])
-                    else:
-                        v = geovariable.GeoVariable(var, t, height, None)
-                    varstoinsert.append(v)
+    return block, int(mask.sum())
 
-                    # Increment t
-                    tcount += 1
 
-                # Insert the data
-                insert.insertGeoVariable(windb2conn, "MERRA2", "NASA", varstoinsert,
-                                         longitude=long, latitude=lat, reinsert=reinsert)
-                # Increment long
-                longcount += 1
+def insert_merra2_file(windb2conn, ncfile, vars, reinsert=False):
+    """Inserts a MERRA2 file downloaded using ncks. Each variable is read from the file at once and all of its nodes
+    and times are sent with a binary COPY, and the whole file is inserted in one transaction. Missing values aren't
+    inserted.
 
-            # Increment lat
-            latcount += 1
+    ncfile: netCDF file downloaded with ncks
+    vars: CSV list of MERRA2 variables (e.g. u50m,v50m,ps)
+    reinsert: deletes the data at the nodes between the first and last times in the file before inserting
+
+    returns the number of rows inserted
+    """
+    from datetime import datetime
+    from netCDF4 import Dataset
+    from psycopg2 import sql as pgsql
+    from windb2 import insert, statements
+    from windb2.struct import insert as struct_insert
+    from windb2.windb2 import find_geomkey
+    import pytz
 
+    # Info
+    print('Inserting: {}'.format(ncfile))
+
+    # Open the netCDF file
+    ncfile = Dataset(ncfile, 'r')
+    inserter = insert.Insert(windb2conn)
+    try:
+        times = merra2_times(ncfile)
+        t_min = times.min().astype(datetime).replace(tzinfo=pytz.utc)
+        t_max = times.max().astype(datetime).replace(tzinfo=pytz.utc)
+
+        # Find or create the domain and a point for each node
+        domain_key = windb2conn.findDomainForDataName('MERRA2')
+        if domain_key is None:
+            domain_key = inserter.create_new_domain('MERRA2', 'NASA', 0, 'degrees')
+        latarr = ncfile.variables['lat'][:]
+        longarr = ncfile.variables['lon'][:]
+        geomkeys = np.zeros((len(latarr), len(longarr)), np.int32)
+        for latcount, lat in enumerate(latarr):
+            for longcount, long in enumerate(longarr):
+                geomkey = find_geomkey(windb2conn.curs, float(long), float(lat), domain_key)
+                if geomkey is None:
+                    statements.execute(windb2conn.curs, 'insert_horizgeom_point',
+                                       (domain_key, 0, 0, float(long), float(lat)))
+                    geomkey = windb2conn.curs.fetchone()[0]
+                geomkeys[latcount, longcount] = geomkey
+
+        # Copy in each variable
+        rows = 0
+        for var in vars.split(','):
+            table_name = '{}_{}'.format(var, domain_key).lower()
+            struct_insert.create_geovariable_table(windb2conn, table_name)
+            inserter.create_partitions(table_name, t_min, t_max)
+
+            if reinsert:
+                windb2conn.curs.execute(pgsql.SQL('DELETE FROM {} WHERE geomkey=ANY(%s) AND t>=%s AND t<=%s')
+                                        .format(pgsql.Identifier(table_name)),
+                                        (geomkeys.ravel().tolist(), t_min, t_max))
+                print('Reinsert deleted {} rows from {}'.format(windb2conn.curs.rowcount, table_name))
+
+            block, nrows = merra2_copy_block(domain_key, geomkeys, times, merra2_height(var),
+                                             read_merra2_variable(ncfile, var))
+            inserter.copy_rows(table_name, ['domainkey', 'geomkey', 't', 'height', 'value'], block, binary=True)
+            rows += nrows
+
+        windb2conn.conn.commit()
+    except BaseException:
+        windb2conn.conn.rollback()
+        raise
+    finally:
+        ncfile.close()
+
+    return rows
 
 
 def export_to_csv(windb2conn, long, lat, variables, startyear=1980):
@@ -200,7 +253,7 @@ def export_to_csv(windb2conn, long, lat, variables, startyear=1980):
         # Get the geomkey for this node
         sql = "SELECT key, domainkey " \
               "FROM horizgeom " \
-              "WHERE st_transform(geom,4326)=st_geomfromtext('POINT({} {})',4326) LIMIT 1"\
+              "WHERE geom4326 ~= st_setsrid(st_makepoint({}, {}), 4326) LIMIT 1"\
             .format(long_grid[it.multi_index], lat_grid[it.multi_index])
         windb2conn.curs.execute(sql)
         geomkey, domainkey = windb2conn.curs.fetchone()
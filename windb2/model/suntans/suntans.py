@@ -15,13 +15,12 @@ import scipy.io.netcdf as nc
 import argparse
 from windb2 import insert, util
 import os
-import tempfile
 from datetime import datetime
 import math
 import psycopg2
+import psycopg2.errorcodes
 import sys
 import logging
-import re
 import logging
 import pytz
 
@@ -34,11 +33,17 @@ logger = logging.getLogger('windb2')
    * ncFile - Either an open file or a string name of a file to open.
    * domainKey - Existing domain key in the database. If left blank, a new domain will be created.
    * replaceData - Deletes data for the same time in the database if True. Useful for freshening data.
+   * copyFormat - Format the rows are sent to the COPY command in: {'text' (default), or 'binary'}
    *
    * returns timesInsertedList, domainKey - A list of times inserted in ISO time format, and the
      domainKey where the data was inserted.
 """
-def insertNcFile(windb2_conn, ncFile, domainKey=None, tableName="current", replaceData=False, sqlWhere="true"):
+def insertNcFile(windb2_conn, ncFile, domainKey=None, tableName="current", replaceData=False, sqlWhere="true",
+                 copyFormat='text'):
+
+    # Make sure the COPY format is supported
+    if copyFormat != 'text' and copyFormat != 'binary':
+        raise TypeError('Unsupported copyFormat: {}'.format(copyFormat))
 
     # Connect to the WinDB
     inserter = insert.Insert(windb2_conn)
@@ -96,51 +101,74 @@ def insertNcFile(windb2_conn, ncFile, domainKey=None, tableName="current", repla
             tncfCount += 1
             continue
 
-        # Open a temporary file to COPY from
-        temp_file = tempfile.NamedTemporaryFile(mode='w+b')
-
         # Create the time in GeoServer/GeoWebCache format
         timeValuesToReturn.append(tncf.strftime('%Y-%m-%dT%H:%M:%S.000Z'))
 
         # Info
         print('Processing time: ', timeValuesToReturn[-1])
 
-        # Iterate through the x,y, and timearr and insert the tidal current data
-        for x in range(horizGeomKey.shape[0]):
-            for y in range(horizGeomKey.shape[1]):
+        def rows():
+            """Rows of tidal current data to be inserted into the database"""
+
+            # Iterate through the x,y, and timearr and insert the tidal current data
+            for x in range(horizGeomKey.shape[0]):
+                for y in range(horizGeomKey.shape[1]):
+
+                    # Make sure that this is actually a x,y point we want to insert
+                    # In order to create a mask of selective insert points, all
+                    # a horizGeomKey of zero means we don't want to insert this one
+                    if horizGeomKey[x,y]==0:
+                        continue;
+
+                    # Write the data string to the COPY stream
+                    if not numpy.isnan(u[tncfCount,y,x]):
 
-                # Make sure that this is actually a x,y point we want to insert
-                # In order to create a mask of selective insert points, all
-                # a horizGeomKey of zero means we don't want to insert this one
-                if horizGeomKey[x,y]==0:
-                    continue;
+                        # Calculate speed
+                        speed = math.sqrt(math.pow(u[tncfCount,y,x],2) + math.pow(v[tncfCount,y,x],2))
 
-                # Write the data string to the temp file
-                if not numpy.isnan(u[tncfCount,y,x]):
+                        # Calculate direction (using the 'flow' convention for tides)
+                        dir = int(util.calc_dir_deg(u[tncfCount,y,x], v[tncfCount,y,x]))
 
-                    # Calculate speed
-                    speed = math.sqrt(math.pow(u[tncfCount,y,x],2) + math.pow(v[tncfCount,y,x],2))
+                        # Add this row to be inserted into the database
+                        yield '{},{},{},{},{},{}\n'.format(domainKey, horizGeomKey[x,y],
+                                                           tncf.strftime('%Y-%m-%d %H:%M:%S %Z'), speed, dir, 0)
 
-                    # Calculate direction (using the 'flow' convention for tides)
-                    dir = int(util.calc_dir_deg(u[tncfCount,y,x], v[tncfCount,y,x]))
+        def binaryRows():
+            """The whole x,y block of tidal current data encoded in the binary COPY format"""
 
-                    # Add this row to be inserted into the database
-                    str_to_write = '{},{},{},{},{},{}\n'.format(domainKey, horizGeomKey[x,y],
-                                                                   tncf.strftime('%Y-%m-%d %H:%M:%S %Z'), speed, dir, 0)
-                    temp_file.write(bytes(str_to_write, 'utf-8'))
-                    counter += 1
+            # Transpose from [y, x] to [x, y] like the horizGeomKey
+            uBlock = numpy.array(u[tncfCount], numpy.float64).T
+            vBlock = numpy.array(v[tncfCount], numpy.float64).T
+            insertMask = (horizGeomKey != 0) & ~numpy.isnan(uBlock)
+            uBlock = uBlock[insertMask]
+            vBlock = vBlock[insertMask]
 
+            # Calculate direction (using the 'flow' convention for tides)
+            dir = numpy.trunc(util.calc_dir_deg(uBlock, vBlock))
+
+            return insert.pgcopy_binary((int(domainKey), horizGeomKey[insertMask], tncf,
+                                         numpy.sqrt(uBlock * uBlock + vBlock * vBlock), dir, 0),
+                                        ('int', 'int', 'timestamptz', 'real', 'smallint', 'real')), \
+                int(numpy.count_nonzero(insertMask))
+
+        def copyRows():
+            """Streams the rows for this time into the table and returns the number of rows inserted"""
+            if copyFormat == 'binary':
+                data, nrows = binaryRows()
+                inserter.copy_rows(tableName + '_' + domainKey, insertColumns, data, binary=True)
+                return nrows
+            return inserter.copy_rows(tableName + '_' + domainKey, insertColumns, rows())
 
         # Insert the data at height 0 for tidal current
-        temp_file.flush()
+        inserter.create_partitions(tableName + '_' + domainKey, tncf)
         insertColumns = ('domainkey', 'geomkey', 't', 'speed', 'direction', 'height')
         try:
-            windb2_conn.curs.copy_from(open(temp_file.name, 'rb'), tableName + '_' + domainKey, sep=',', columns=insertColumns)
+            counter += copyRows()
         except psycopg2.IntegrityError as e:
 
             # Delete the duplicate data
-            errorTest = 'duplicate key value violates unique constraint "' + tableName + "_" + domainKey + '_domainkey_geomkey_t_height_key"'
-            if re.search(errorTest, str(e)):
+            # The unique index is named after the partition if the table is partitioned, so go by the error code
+            if e.pgcode == psycopg2.errorcodes.UNIQUE_VIOLATION:
 
                 # Delete the data and retry the insert if asked to replace data in the function call
                 if replaceData:
@@ -157,7 +185,7 @@ def insertNcFile(windb2_conn, ncFile, domainKey=None, tableName="current", repla
                     windb2_conn.conn.commit()
 
                     # Reinsert that timearr
-                    windb2_conn.curs.copy_from(open(temp_file.name, 'r'), tableName + '_' + domainKey, sep=',', columns=insertColumns)
+                    counter += copyRows()
 
                 # Otherwise, just notify that the insert failed because of duplicate data
                 else:
@@ -165,6 +193,11 @@ def insertNcFile(windb2_conn, ncFile, domainKey=None, tableName="current", repla
                     logging.error("Use 'replaceData=True' if you want the data to be reinserted.")
                     raise
 
+            # Any other integrity error aborted the transaction, so don't pretend it was inserted
+            else:
+                windb2_conn.conn.rollback()
+                raise
+
         # Commit the changes
         windb2_conn.conn.commit()
 
@@ -174,9 +207,6 @@ def insertNcFile(windb2_conn, ncFile, domainKey=None, tableName="current", repla
             insertRate = counter / elapsedTime
             print("Inserted ", counter, " x,y wind points at ", insertRate, " I/s")
 
-        # Close the tempfile so it is deleted
-        temp_file.close()
-
         # Increment the time
         ttiCount += 1
 
@@ -0,0 +1,195 @@
+"""Inserts many WinDB2 or WRF netCDF files into a WinDB2 at once, fanning the files and variables out over a pool of
+worker processes that each have their own WinDB2 connection."""
+
+import glob
+import logging
+import multiprocessing
+import re
+import time
+import traceback
+from collections import namedtuple, OrderedDict
+
+from netCDF4 import Dataset
+from windb2 import windb2
+from windb2.model.wrf import config, insert
+
+logger = logging.getLogger('windb2')
+
+# Outcome of inserting one variable from one file. error is the formatted traceback, or None if the insert worked.
+InsertResult = namedtuple('InsertResult', ['filename', 'var_name', 'rows', 'seconds', 'error'])
+
+# The connection and inserter of each worker process, which are set up once by _init_worker
+_worker = {}
+
+
+def file_type(filename):
+    """Returns the WinDB2 file type of a netCDF file from its name: 'wrf' for a wrfout file or 'windb2' for a height
+    interpolated file. Raises a TypeError for anything else."""
+
+    if re.match(r'.*wrfout_.+[0-9][0-9]$', filename):
+        return 'wrf'
+    elif re.match(r'.*wrfout_.+height-interp\.nc', filename):
+        return 'windb2'
+    raise TypeError('File provided is neither a WRF or WinDB2 file: {}'.format(filename))
+
+
+def expand_inputs(patterns=(), manifest=None):
+    """Expands glob patterns and a manifest file into a list of files to insert.
+
+    patterns - File names or glob patterns, each of which is expanded in sorted order
+    manifest - Name of a file listing one file name or glob pattern per line. Blank lines and lines starting with a '#'
+               are ignored.
+
+    returns A list of file names in the order given, without duplicates
+    """
+
+    patterns = list(patterns)
+    if manifest is not None:
+        with open(manifest) as f:
+            patterns += [line.strip() for line in f if line.strip() and not line.strip().startswith('#')]
+
+    filenames = OrderedDict()
+    for pattern in patterns:
+
+        # Get rid of escaped colon characters that are often added in Unix shells
+        pattern = re.sub(r'[\\]', '', pattern)
+        matches = sorted(glob.glob(pattern))
+        if not matches:
+            raise IOError('No files found matching: {}'.format(pattern))
+        for filename in matches:
+            filenames[filename] = True
+
+    return list(filenames)
+
+
+def vars_to_insert(windb2_config):
+    """Returns the names of the variables in a WinDB2 WRF config that have heights to insert."""
+
+    return [var for var in windb2_config['vars'] if isinstance(windb2_config['vars'][var].get('insert'), list)]
+
+
+def summarize(results):
+    """Totals the results for each file.
+
+    results - InsertResults
+
+    returns A list of (filename, rows, seconds, failed var names) in the order the files first appear in the results
+    """
+
+    files = OrderedDict()
+    for result in results:
+        rows, seconds, failed = files.get(result.filename, (0, 0., []))
+        if result.error is not None:
+            failed = failed + [result.var_name]
+        files[result.filename] = (rows + result.rows, seconds + result.seconds, failed)
+
+    return [(filename,) + totals for filename, totals in files.items()]
+
+
+def _init_worker(db_host, db_name, db_user, port, config_file):
+    """Connects a worker process to the WinDB2."""
+
+    conn = windb2.WinDB2(db_host, db_name, dbUser=db_user, port=port)
+    conn.connect()
+    _worker['inserter'] = insert.InsertWRF(conn, config.Windb2WrfConfigParser(config_file))
+
+
+def _insert_task(task):
+    """Inserts one variable from one file, returning an InsertResult instead of raising so that one bad file doesn't
+    stop the rest of the batch."""
+
+    filename, var_name, domain_key, kwargs = task
+    inserter = _worker['inserter']
+    rows_before = inserter.rows_inserted
+    start = time.time()
+    try:
+        ncfile = Dataset(filename, 'r')
+        try:
+            inserter.insert_variable(ncfile, var_name, domain_key=domain_key, file_type=file_type(filename), **kwargs)
+        finally:
+            ncfile.close()
+    except (Exception, SystemExit):
+        error = traceback.format_exc()
+        try:
+            inserter.windb2.conn.rollback()
+        except Exception:
+            logger.exception('Unable to roll back after failing to insert {} from {}'.format(var_name, filename))
+        return InsertResult(filename, var_name, inserter.rows_inserted - rows_before, time.time() - start, error)
+
+    return InsertResult(filename, var_name, inserter.rows_inserted - rows_before, time.time() - start, None)
+
+
+def insert_files(filenames, db_host, db_name, db_user='postgres', port=5432, config_file='windb2-wrf.json',
+                 domain_key=None, mask=None, workers=None, bulk_load=False, **kwargs):
+    """Inserts every variable in the config from many files into a WinDB2 using a pool of worker processes.
+
+    The domain (if domain_key is None) and the variable tables are created once from the first file before any worker
+    starts, so all of the files must be on the same grid.
+
+    filenames - WinDB2 height interpolated or wrfout files to insert
+    db_host, db_name, db_user, port - WinDB2 to connect to. Each worker makes its own connection.
+    config_file - WinDB2 WRF config file listing the variables to insert
+    domain_key - Existing domain key in the database. If left blank, a new domain will be created.
+    mask - String name of a mask in the WinDB2 database. Only relevant when creating a new domain.
+    workers - Number of worker processes, defaults to the number of CPUs
+    bulk_load - Drops the indexes of the variable tables while the files are loaded and rebuilds them at the end (see
+                Insert.bulk_load), which is much faster for backfilling many files
+    kwargs - Passed on to InsertWRF.insert_variable e.g. replace_data, zero_seconds, copy_format
+
+    returns domain_key, results - The domain key the data were inserted into, and an InsertResult for every file and
+            variable in the same order as filenames and the config, no matter which order the workers finished in
+    """
+
+    if not filenames:
+        raise ValueError('No files to insert')
+    windb2_config = config.Windb2WrfConfigParser(config_file)
+    var_names = vars_to_insert(windb2_config.config)
+
+    # Create the domain and tables up front so the workers don't race to create them
+    conn = windb2.WinDB2(db_host, db_name, dbUser=db_user, port=port)
+    conn.connect()
+    try:
+        inserter = insert.InsertWRF(conn, windb2_config)
+        if domain_key is None:
+            domain_key = inserter.create_domain(filenames[0], file_type=file_type(filenames[0]), mask=mask)
+        for var_name in var_names:
+            inserter.create_variable_table(var_name, domain_key, file_type=file_type(filenames[0]))
+        conn.conn.commit()
+        domain_key = str(domain_key)
+
+        # Fan the files and variables out over the workers
+        tasks = [(filename, var_name, domain_key, kwargs) for filename in filenames for var_name in var_names]
+        if bulk_load:
+            with inserter.bulk_load(['{}_{}'.format(var_name.lower(), domain_key) for var_name in var_names]):
+                results = _run_tasks(tasks, workers, (db_host, db_name, db_user, port, config_file))
+        else:
+            results = _run_tasks(tasks, workers, (db_host, db_name, db_user, port, config_file))
+    finally:
+        conn.close()
+
+    return domain_key, results
+
+
+def _run_tasks(tasks, workers, initargs):
+    """Runs the insert tasks on a pool of worker processes, returning the InsertResults in the order of the tasks."""
+
+    results = []
+    pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=initargs)
+    try:
+        for result in pool.imap(_insert_task, tasks):
+            if result.error is None:
+                logger.info('Inserted {} rows of {} from {} in {:.1f} s'.format(result.rows, result.var_name,
+                                                                                result.filename, result.seconds))
+            else:
+                logger.error('Failed to insert {} from {}'.format(result.var_name, result.filename))
+            results.append(result)
+        pool.close()
+
+    # Stop the workers on Ctrl-C too
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    return results
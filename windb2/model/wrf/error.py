@@ -15,6 +15,10 @@
 import datetime
 import sys
 
+import numpy
+
+from windb2 import nearest, statements, timerange
+
 def findBuoysInProximityToWRFPoints(wrfDomainNum, curs):
   """
   findBuoysInProximityToWRFPoints returns a 2D array with WRF point 
@@ -31,28 +35,21 @@ def findBuoysInProximityToWRFPoints(wrfDomainNum, curs):
   buoykeys = curs.fetchall()
 
   # Get the resolution of the WRF domian to use as a distance cutoff
-  sql = "SELECT resolution FROM domain WHERE key=" + str(wrfDomainNum)
-  curs.execute(sql)
+  statements.execute(curs, 'domain_resolution', (int(wrfDomainNum),))
   wrfDomainResolution = curs.fetchone()[0]
 
-  # Find the closest wrfgeom to the buoygeom, putting a limit of twice the resolution
-  for buoykey in buoykeys:
-    closestWRFKeySql = "SELECT m.key AS wrfkey, st_distance_sphere(st_transform(m.geom,4326), st_transform(b.geom,4326)) AS dist \
-                        FROM (SELECT * FROM horizgeom WHERE key=" + str(buoykey[0]) + ") b, \
-                             (SELECT * FROM horizgeom WHERE domainkey=" + str(wrfDomainNum) + ") m \
-                             WHERE st_distance_sphere(st_transform(m.geom,4326), st_transform(b.geom,4326))<=" + str(wrfDomainResolution) + " \
-                            ORDER BY dist LIMIT 1"
-    curs.execute(closestWRFKeySql)
-    temp = curs.fetchone()
+  # Find the closest wrfgeom to all of the buoygeoms at once, putting a limit of the resolution
+  buoyLongLats = buoyLongLatsForKeys([buoykey[0] for buoykey in buoykeys], curs)
+  wrfkeys, dists = nearest.nearest_geomkeys(curs, wrfDomainNum, buoyLongLats[:, 0], buoyLongLats[:, 1],
+                                            wrfDomainResolution)
+  for buoykey, wrfkey, dist in zip(buoykeys, wrfkeys, dists):
 
     # Make sure we got a result
-    if not(temp):
+    if not(wrfkey):
       continue
 
-    # print 
-
     # Add the results to the array to return
-    closestWRFPointsToBuoys.append([temp[0], buoykey[1], buoykey[0], temp[1]])
+    closestWRFPointsToBuoys.append([int(wrfkey), buoykey[1], buoykey[0], float(dist)])
 
   return closestWRFPointsToBuoys
    
@@ -61,26 +58,28 @@ def findWRFPointInProximityToBuoy(buoyDomainKey, wrfDomainNum, curs):
   findBuoysInProximityToWRFPoints returns a WRF point geomkey and distance [m] from that point.
   """
 
-  # Create a empty list to return with the wrfkey, buoydomain, buoykey, distmeters
-  closestBuoyPointToBuoys = []
-
-  # Find the closest wrfgeom to the buoygeom, putting a limit of twice the resolution
-  sql = "SELECT m.key AS wrfkey, st_distance_sphere(st_transform(m.geom,4326), st_transform(b.geom,4326)) AS dist \
-                    FROM (SELECT * FROM horizgeom WHERE domainkey=" + str(buoyDomainKey) + ") b, \
-                         (SELECT * FROM horizgeom WHERE domainkey=" + str(wrfDomainNum) + ") m \
-                        ORDER BY dist LIMIT 1"
-  curs.execute(sql)
-  temp = curs.fetchone()
-  
-  # Debug
-  print(sql)
+  # Find the closest wrfgeom to each of the buoygeoms in one query
+  curs.execute("SELECT key FROM horizgeom WHERE domainkey=%s", (buoyDomainKey,))
+  buoyLongLats = buoyLongLatsForKeys([row[0] for row in curs.fetchall()], curs)
+  wrfkeys, dists = nearest.nearest_geomkeys(curs, wrfDomainNum, buoyLongLats[:, 0], buoyLongLats[:, 1])
 
   # Make sure we got a result
-  if temp == None:
+  if not numpy.any(wrfkeys):
       sys.stderr.write("ERROR: No stations returned.")
       return False
 
-  return temp[0],temp[1]
+  closest = numpy.nanargmin(dists)
+  return int(wrfkeys[closest]), float(dists[closest])
+
+def buoyLongLatsForKeys(geomkeys, curs):
+  """
+  Returns an N x 2 numpy.array of the longitude and latitude of each geomkey, in the order of the geomkeys.
+  """
+
+  curs.execute("SELECT st_x(h.geom4326), st_y(h.geom4326) \
+                FROM unnest(%s::integer[]) WITH ORDINALITY AS k(key, i) JOIN horizgeom h ON h.key=k.key \
+                ORDER BY k.i", (list(geomkeys),))
+  return numpy.array(curs.fetchall(), numpy.float64).reshape(-1, 2)
 
 
 def findObservationalDomainsInLatitudinalBand(minLatitude, maxLatitude, curs):
@@ -116,11 +115,14 @@ def findObservationalDomainsInLatitudinalBand(minLatitude, maxLatitude, curs):
 def calculateBuoyErrorForPeriod(conn, wrfDomain, wrfKey, wrfHeight, buoyDomain, buoyRangeLowHeight, buoyRangeHighHeight, startDateIncl, endDateExcl, noteForRecord):
     # Get the cursor for the connection
     curs = conn.cursor()
+
+    # Filter on the month as a half-open time range so that the t index can be used
+    monthRange, monthParams = timerange.time_range('m.t', *timerange.month_bounds(startDateIncl.year, startDateIncl.month))
         
     # Get the number of WRF data available at this same time period
     checkwrfDataExists = "SELECT count(*) FROM wind_" + str(wrfDomain) + " m WHERE m.height=" + str(wrfHeight) + " AND m.geomkey=" + str(wrfKey) + \
-                                 " AND date_part('month',m.t)=" + str(startDateIncl.month) + " AND date_part('year',m.t)=" + str(startDateIncl.year)
-    curs.execute(checkwrfDataExists)
+                                 " AND " + monthRange
+    curs.execute(checkwrfDataExists, monthParams)
     print("Ran this query: ", curs.query)
     countOfWrfData = curs.fetchone()[0]
     print("fetchone()[0]=", countOfWrfData)
@@ -131,8 +133,8 @@ def calculateBuoyErrorForPeriod(conn, wrfDomain, wrfKey, wrfHeight, buoyDomain,
     # Make sure there is at least some data for this buoy during this particular month
     # Otherwise you get a division by zero
     checkBuoyDataExists = "SELECT count(*) FROM wind_" + str(buoyDomain) + " m WHERE m.height>=" + str(buoyRangeLowHeight) + " AND m.height<=" + str(buoyRangeHighHeight) + \
-                                 " AND date_part('month',m.t)=" + str(startDateIncl.month) + " AND date_part('year',m.t)=" + str(startDateIncl.year)
-    curs.execute(checkBuoyDataExists)
+                                 " AND " + monthRange
+    curs.execute(checkBuoyDataExists, monthParams)
     print("Ran this query: ", curs.query)
     countOfBuoyData = curs.fetchone()[0]
     print("fetchone()[0]=", countOfBuoyData)
@@ -172,17 +174,16 @@ def calculateBuoyErrorForPeriod(conn, wrfDomain, wrfKey, wrfHeight, buoyDomain,
                           sum(bias(m.speed, b.speed::real))/count(*) AS bias,
                           sum(bias(U(m.speed,m.direction)::real, U(b.speed,b.direction)::real))/count(*) AS bias_u,
                           sum(bias(V(m.speed,m.direction)::real, V(b.speed,b.direction)::real))/count(*) AS bias_v, 
-                          count(*) AS COUNT,""" + \
-                          "'" + noteForRecord + "', " + \
+                          count(*) AS COUNT, %(note)s, """ + \
                           "now() \
                       FROM wind_" + str(wrfDomain) + " m,wind_" + str(buoyDomain) + " b WHERE m.geomkey=" + str(wrfKey) + " AND \
                       b.height>=" + str(buoyRangeLowHeight) + " AND b.height<=" + str(buoyRangeHighHeight) + " AND m.height=" + str(wrfHeight) + " AND \
-                      date_part('month',m.t)=" + str(startDateIncl.month) + " AND date_part('year',m.t)=" + str(startDateIncl.year) + " \
+                      " + monthRange + " \
                       AND b.speed > 1.0 AND b.t=m.t RETURNING count, bias, bias_u, bias_v"
 
     # Execute the query
     print("Running this query:", errorQuery)
-    curs.execute(errorQuery)
+    curs.execute(errorQuery, dict(monthParams, note=noteForRecord))
     
     # DebugfindWRFPointNearLongLat
     #print "Ran this query: ", curs.query
@@ -214,7 +215,7 @@ def calculateBuoyErrorForPeriod(conn, wrfDomain, wrfKey, wrfHeight, buoyDomain,
                               V(b.speed,b.direction)::real))/count(*)) AS rmseub_v \
                   FROM wind_" + str(wrfDomain) + " m,wind_" + str(buoyDomain) + " b WHERE m.geomkey=" + str(wrfKey) + " AND \
                               b.height>=" + str(buoyRangeLowHeight) + " AND b.height<=" + str(buoyRangeHighHeight) + " AND m.height=" + str(wrfHeight) + " AND \
-                              date_part('month',m.t)=" + str(startDateIncl.month) + " AND date_part('year',m.t)=" + str(startDateIncl.year) + " \
+                              " + monthRange + " \
                               AND b.speed > 1.0 AND b.t=m.t"
     
     # Debug
@@ -222,7 +223,7 @@ def calculateBuoyErrorForPeriod(conn, wrfDomain, wrfKey, wrfHeight, buoyDomain,
 
     # Get the unbiased results
     # Execute the query
-    curs.execute(unbiasedQuery)
+    curs.execute(unbiasedQuery, monthParams)
     
     # Debug
     print("Ran this query: ", curs.query)
@@ -257,12 +258,15 @@ def calculateBuoyErrorForPeriod(conn, wrfDomain, wrfKey, wrfHeight, buoyDomain,
 def calculateBuoyErrorForDayOfRun(conn, wrfDomain, wrfKey, wrfHeight, buoyDomain, buoyRangeLowHeight, buoyRangeHighHeight, dayForCalc, dayOfRun, noteForRecord):
     # Get the cursor for the connection
     curs = conn.cursor()
+
+    # Filter on the day as a half-open time range so that the t index can be used
+    dayRange, dayParams = timerange.time_range('m.t', *timerange.day_bounds(dayForCalc))
     
     # Make sure there is at least some data for this buoy during this particular month
     # Otherwise you get a division by zero
     checkBuoyDataExists = "SELECT count(*) FROM wind_" + str(buoyDomain) + " m WHERE m.height>=" + buoyRangeLowHeight + " AND m.height<=" + buoyRangeHighHeight + \
-                                " AND m.t::date = date'" + dayForCalc.isoformat() + "'"
-    curs.execute(checkBuoyDataExists)
+                                " AND " + dayRange
+    curs.execute(checkBuoyDataExists, dayParams)
     #print "Ran this query: ", curs.query
     countOfBuoyData = curs.fetchone()[0]
     print("fetchone()[0]=", countOfBuoyData)
@@ -302,16 +306,15 @@ def calculateBuoyErrorForDayOfRun(conn, wrfDomain, wrfKey, wrfHeight, buoyDomain
                           sum(bias(m.speed, b.speed::real))/count(*) AS bias,
                           sum(bias(U(m.speed,m.direction)::real, U(b.speed,b.direction)::real))/count(*) AS bias_u,
                           sum(bias(V(m.speed,m.direction)::real, V(b.speed,b.direction)::real))/count(*) AS bias_v, 
-                          count(*) AS COUNT,""" + \
-                          "'" + noteForRecord + "', " + \
+                          count(*) AS COUNT, %(note)s, """ + \
                           "now() \
                       FROM wind_" + str(wrfDomain) + " m,wind_" + str(buoyDomain) + " b WHERE m.geomkey=" + str(wrfKey) + " AND \
                       b.height>=" + buoyRangeLowHeight + " AND b.height<=" + buoyRangeHighHeight + " AND m.height=" + wrfHeight + " AND \
-                      m.t::date = date'" + dayForCalc.isoformat() + "' \
-                      b.speed > 1.0 RETURNING count"
+                      " + dayRange + " \
+                      AND b.speed > 1.0 AND b.t=m.t RETURNING count"
 
     # Execute the query
-    curs.execute(errorQuery)
+    curs.execute(errorQuery, dict(dayParams, note=noteForRecord))
     
     # Debug
     #print "Ran this query: ", curs.query
@@ -331,16 +334,11 @@ def findWRFPointNearLongLat(wrfDomainNum, longitude, latitude, curs):
   Return distance from nearest point and the units
   """
 
-  # Find the closest wrfgeom to the buoygeom, putting a limit of twice the resolution
-  sql = "SELECT m.key AS wrfkey, st_distancesphere(st_transform(m.geom,4326), st_geomfromtext('POINT(" + str(longitude) + " " + str(latitude) + ")',4326)) AS dist \
-                    FROM (SELECT * FROM horizgeom WHERE domainkey=" + str(wrfDomainNum) + ") m \
-                        ORDER BY dist LIMIT 1"
-  curs.execute(sql)
-  temp = curs.fetchone()
-  
+  # Find the closest wrfgeom to the point
+  wrfkeys, dists = nearest.nearest_geomkeys(curs, wrfDomainNum, [longitude], [latitude])
+
   # Make sure we got a result
-  if temp == None:
+  if not wrfkeys[0]:
       print("ERROR: No WRF points returned.", file=sys.stderr)
       return False
-  return temp[0], temp[1]
-  
+  return int(wrfkeys[0]), float(dists[0])
@@ -198,3 +198,113 @@ def uv_column_interp(u_mass_column, v_mass_column, heights_above_ground, heights
 
     return numpy.hstack((u_mass_coord_interp_log_law, u_mass_coord_interp_linear)), \
            numpy.hstack((v_mass_coord_interp_log_law, v_mass_coord_interp_linear))
+
+
+def interp_columns(heights_to_interp, column_heights, values, left=None, right=None):
+    """Linearly interpolates every column of a grid at once. Gives the same result as calling numpy.interp on each
+    column, but finds the levels to interpolate between for the whole grid with a single comparison against the height
+    cube and gathers the values and weights with numpy.take_along_axis.
+
+    :param heights_to_interp: 1D array of the heights to interpolate to
+    :param column_heights: Heights of the values with the shape [z, ...] e.g. [z, y, x], increasing in z
+    :param values: Values at the column_heights
+    :param left: Value or array with the shape [...] to return below the bottom of a column, defaults to the bottom value
+    :param right: Value or array with the shape [...] to return above the top of a column, defaults to the top value
+
+    :returns Array of the interpolated values with the shape [len(heights_to_interp), ...]
+    """
+
+    column_heights = numpy.asarray(column_heights, numpy.float64)
+    values = numpy.asarray(values, numpy.float64)
+    assert(column_heights.shape == values.shape)
+    heights = numpy.asarray(heights_to_interp, numpy.float64).reshape((-1,) + (1,) * (column_heights.ndim - 1))
+
+    # Index of the level at or below each height in each column (i.e. searchsorted with side='right' minus one), kept
+    # within the column so that the heights off either end can be filled in below
+    below = numpy.sum(column_heights[numpy.newaxis] <= heights[:, numpy.newaxis], axis=1) - 1
+    below = numpy.clip(below, 0, column_heights.shape[0] - 2)
+    z_below = numpy.take_along_axis(column_heights, below, axis=0)
+    z_above = numpy.take_along_axis(column_heights, below + 1, axis=0)
+    value_below = numpy.take_along_axis(values, below, axis=0)
+    value_above = numpy.take_along_axis(values, below + 1, axis=0)
+
+    # Same arithmetic as numpy.interp, including returning the value itself when a height falls right on a level
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        slope = (value_above - value_below) / (z_above - z_below)
+        interp = numpy.where(heights == z_below, value_below, slope * (heights - z_below) + value_below)
+
+    # Heights off the bottom or top of a column
+    interp = numpy.where(heights < column_heights[0], values[0] if left is None else left, interp)
+    interp = numpy.where(heights == column_heights[-1], values[-1], interp)
+    interp = numpy.where(heights > column_heights[-1], values[-1] if right is None else right, interp)
+
+    return interp
+
+
+def uv_grid_interp(u_mass, v_mass, heights_above_ground, heights_to_interp, z_o=None):
+    """Interpolates the U and V wind to heights above ground for every column of a grid at once. This is the
+    vectorized version of uv_column_interp and gives the same result within floating point tolerance.
+
+    Heights within the model levels are linearly interpolated. Heights below the lowest eta level use the log-law for
+    the speed and the direction of the lowest level. Without the surface roughness, the log-law is fit through the
+    levels at or below 100 m (or the lowest two levels if the second one is above 100 m) with a least squares
+    regression of speed against log(z), and negative speeds are set to zero.
+
+    :param u_mass: WRF U wind speed already interpolated to the mass coordinate system with the shape [z, y, x]
+    :param v_mass: WRF V wind speed already interpolated to the mass coordinate system with the shape [z, y, x]
+    :param heights_above_ground: Heights of the eta levels with the shape [z, y, x]
+    :param heights_to_interp: 1D array of heights to interpolate to in increasing order
+    :param z_o: WRF ZNT surface roughness with the shape [y, x], if available
+
+    :returns 2 arrays u, v of the height interpolated wind with the shape [len(heights_to_interp), y, x]
+    """
+
+    u_mass = numpy.asarray(u_mass, numpy.float64)
+    v_mass = numpy.asarray(v_mass, numpy.float64)
+    z = numpy.asarray(heights_above_ground, numpy.float64)
+    assert(u_mass.shape == v_mass.shape)
+    assert(u_mass.shape == z.shape)
+    heights = numpy.asarray(heights_to_interp, numpy.float64).reshape((-1,) + (1,) * (z.ndim - 1))
+
+    # Linear interp where we have model data
+    u_interp = interp_columns(heights_to_interp, z, u_mass)
+    v_interp = interp_columns(heights_to_interp, z, v_mass)
+
+    # Find the heights that need log-law interpolation i.e. lower than the lowest eta-half level
+    z_bottom = numpy.min(z, axis=0)
+    mask_log_law = heights < z_bottom
+    if not numpy.any(mask_log_law):
+        return u_interp, v_interp
+
+    speed = util.speed(u_mass, v_mass)
+    if z_o is None:
+
+        # Check for non-physical heights
+        if numpy.any(mask_log_law.any(axis=0) & (z_bottom < 0)) or numpy.min(heights) < 0:
+            raise ValueError('Negative value for speed or height above ground level detected.')
+
+        # Least squares fit of speed = m*log(z) + b in each column, using the levels up to 100 m or up to the second
+        # level if that's higher
+        z_max = numpy.where(z[1] < 100, 100., z[1])
+        fit = z <= z_max
+        n = numpy.sum(fit, axis=0)
+        z_log = numpy.log(numpy.where(fit, z, 1.))
+        z_log_mean = numpy.sum(z_log * fit, axis=0) / n
+        speed_mean = numpy.sum(speed * fit, axis=0) / n
+        z_log_anomaly = (z_log - z_log_mean) * fit
+        m = numpy.sum(z_log_anomaly * (speed - speed_mean), axis=0) / numpy.sum(z_log_anomaly ** 2, axis=0)
+        b = speed_mean - m * z_log_mean
+        speed_log_law = numpy.maximum(m * numpy.log(heights) + b, 0)
+
+    # Use the log-law with the WRF ZNT (surface roughness) to diagnose U,V
+    else:
+        z_o = numpy.asarray(z_o, numpy.float64)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            speed_log_law = speed[0] * numpy.log(heights / z_o) / numpy.log(z_bottom / z_o)
+
+    # Use the same wind direction as the bottom level where we have WRF data for the direction
+    dir_log_law = numpy.radians(util.calc_dir_deg(u_mass[0], v_mass[0]))
+    u_interp = numpy.where(mask_log_law, numpy.sin(dir_log_law) * speed_log_law, u_interp)
+    v_interp = numpy.where(mask_log_law, numpy.cos(dir_log_law) * speed_log_law, v_interp)
+
+    return u_interp, v_interp
@@ -4,10 +4,12 @@ __author__ = 'Mike Dvorak'
 
 """Vertically interpolates a WRF netCDF output file to eta-half levels."""
 
+import math
+import multiprocessing
 import numpy
 import numpy.ma
 from netCDF4 import Dataset
-from windb2.model.wrf import config
+from windb2.model.wrf import config, wrf
 import windb2.model.wrf.constants as constants
 import logging
 
@@ -29,6 +31,9 @@ class HeightInterpFile:
     CLOUD_HEIGHTS['low'] = {'top': 2000, 'bottom': 0}
     CLOUD_HEIGHTS['fog'] = {}
 
+    # 4D variables read for each time step, used to work out how many time steps fit in the memory budget
+    slab_vars = ('U', 'V', 'P', 'PB', 'T', 'QVAPOR', 'CLDFRA')
+
     eta_height_w = None
     eta_height_mass = None
     heights_to_interp = None
@@ -89,22 +94,24 @@ class HeightInterpFile:
         # Return the average
         return (t1 + t2) / 2.
 
-    def calc_eta_heights(self, nc_infile):
+    def calc_eta_heights(self, nc_infile, times=slice(None)):
         """Calculates the eta heights inclusive of the highest desired vertical interpolation height.
 
+        times - Slice of the time steps to calculate the heights for, all of them by default
+
         Returns:
             scipy.io.netcdf.variable with the interpolated heights of the dimensions Time, south_north,
             x"""
 
         # Pressure at mass point
-        pressure = nc_infile.variables['P'][:] + nc_infile.variables['PB'][:]
+        pressure = nc_infile.variables['P'][times] + nc_infile.variables['PB'][times]
 
         # Calculate height of the first eta half level, nearest the surface
         # WRF potential temperature is shifted by 300 K: http://www2.mmm.ucar.edu/wrf/users/docs/user_guide_V3/users_guide_chap5.htm#special_fields
-        pressure_surface = nc_infile.variables['PSFC'][:]
-        temperature_bottom_layer = self.calc_mean_temperature_across_layer(nc_infile.variables['T2'][:],
+        pressure_surface = nc_infile.variables['PSFC'][times]
+        temperature_bottom_layer = self.calc_mean_temperature_across_layer(nc_infile.variables['T2'][times],
                                                                            pressure_surface,
-                                                                           nc_infile.variables['T'][:, 0, :, :] + 300.,
+                                                                           nc_infile.variables['T'][times, 0, :, :] + 300.,
                                                                            pressure[:, 0, :, :])
         height_first_eta_half = constants.R_CONST / constants.G_CONST * temperature_bottom_layer * \
                                 numpy.log(pressure_surface / pressure[:, 0, :, :])
@@ -112,9 +119,9 @@ class HeightInterpFile:
         # Calculate regular temperature at the mass point by averaging temperature above and below w point
         pressure_below = pressure[:, :-1, :, :]
         pressure_above = pressure[:, 1:, :, :]
-        temperature_at_mass = self.calc_mean_temperature_across_layer(nc_infile.variables['T'][:, :-1, :, :] + 300.,
+        temperature_at_mass = self.calc_mean_temperature_across_layer(nc_infile.variables['T'][times, :-1, :, :] + 300.,
                                                                       pressure_below,
-                                                                      nc_infile.variables['T'][:, 1:, :, :] + 300.,
+                                                                      nc_infile.variables['T'][times, 1:, :, :] + 300.,
                                                                       pressure_above)
 
         # Hypsometric equation
@@ -122,7 +129,7 @@ class HeightInterpFile:
                       numpy.log(pressure_below / pressure_above)
 
         # Add in the first level half eta layer height
-        height_at_eta_half_level = numpy.insert(heightDiffs, 0, height_first_eta_half[:, numpy.newaxis, :, :], axis=1)
+        height_at_eta_half_level = numpy.concatenate((height_first_eta_half[:, numpy.newaxis, :, :], heightDiffs), axis=1)
 
         # Sum up all of the heights from the ground up to get the height above ground level
         height_eta_half_above_ground = numpy.cumsum(height_at_eta_half_level, axis=1)
@@ -177,8 +184,31 @@ class HeightInterpFile:
                 ncvar_cld_dict[height].longdescription = 'Fog is the cloud fraction in the lowest vertical level of the model.'
                 ncvar_cld_dict[height].units = '1'
 
+    @staticmethod
+    def calc_dew_point(qvapor, pressure):
+        """Calculates the dew point (K) from the water vapor mixing ratio (kg kg-1) and pressure (Pa) using the equation
+        found in this post: http://forum.wrfforum.com/viewtopic.php?f=7&t=1862"""
+        A = 2.53e11 # Pa
+        B = 5.42e3 # K
+        E = 0.622 # (approximated from R'/Rv)
+        return B / numpy.log(A*E/(qvapor*pressure))
+
     # @profile
-    def interp_file(self, wrf_filename, close_file=True):
+    def interp_file(self, wrf_filename, close_file=True, engine='grid', workers=None):
+        """Interpolates a wrfout file to the heights in the config, writing a new file with the outfile_extension.
+
+        wrf_filename - Name of the wrfout file
+        close_file - Closes the new file when done
+        engine - 'grid' (default) interpolates all of the columns of a time step at once, 'column' interpolates
+                 one column at a time
+        workers - Number of processes to spread the slabs of time steps over. Each worker reads its slabs directly from
+                  the wrfout file, and the memory_budget_mb in the config is shared between them, see time_slabs. The
+                  default of None interpolates the file in this process.
+        """
+
+        if engine != 'grid' and engine != 'column':
+            raise TypeError('Unsupported interpolation engine: {}'.format(engine))
+
         # Open the netCDF file
         nc_infile = Dataset(wrf_filename, mode='r')
         nc_outfile = Dataset(wrf_filename + self.outfile_extension, mode='w', format='NETCDF4')
@@ -202,12 +232,12 @@ class HeightInterpFile:
         nc_outfile.createDimension('height', len(self.heights_to_interp))
 
 
-        new_eta_height_coord_var = nc_outfile.createVariable('atmosphere_hybrid_height_coordinate', 'f',
-                                                             dimensions=('Time', 'atmosphere_sigma_coordinate', 'y', 'x'))
+        nc_outfile.createVariable('atmosphere_hybrid_height_coordinate', 'f',
+                                  dimensions=('Time', 'atmosphere_sigma_coordinate', 'y', 'x'))
         new_height_agl_coord_var = nc_outfile.createVariable('height', 'f', dimensions=('height',))
         new_height_agl_coord_var.units = 'm'
         new_height_agl_coord_var.positive = 'true'
-        new_height_agl_coord_var[:] = numpy.array(self.heights_to_interp, numpy.float)
+        new_height_agl_coord_var[:] = numpy.array(self.heights_to_interp, numpy.float64)
 
         # New variables in the netCDF file
         # Names according to the Climate and Forecast (CF) Convention v29:
@@ -236,33 +266,127 @@ class HeightInterpFile:
             self._set_metadata_cld(new_cloud_fraction, self.CLOUD_HEIGHTS)
 
 
+        # Note how the winds below the lowest model level will be diagnosed
+        if 'WIND' in self.windb2_config['vars']:
+            new_u.lower_pbl_interp = self._lower_pbl_interp(nc_infile)
+            new_v.lower_pbl_interp = new_u.lower_pbl_interp
+
+        # Work through the file a slab of time steps at a time so that the memory used doesn't grow with the number of
+        # times in the file
+        slabs = self.time_slabs(nc_infile, workers)
+        if workers is None or workers <= 1:
+            for slab in slabs:
+                self._write_slab(nc_outfile, slab, self.interp_slab(nc_infile, slab, engine))
+        else:
+            # Each worker reads its own slab from the input file and this process writes the results as they come back
+            pool = multiprocessing.Pool(min(workers, len(slabs)))
+            try:
+                for slab, results in pool.imap_unordered(_interp_slab_task,
+                                                         [(self.windb2_config, wrf_filename, slab, engine)
+                                                          for slab in slabs]):
+                    self._write_slab(nc_outfile, slab, results)
+                    logger.debug('Interpolated time steps {} to {}'.format(slab.start, slab.stop - 1))
+                pool.close()
+
+            # Stop the workers on Ctrl-C too
+            except BaseException:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        nc_infile.close()
+
+        # Write the netCDF vars
+        if 'WIND' in self.windb2_config['vars']:
+            new_height_agl_coord_var[:] = numpy.array(self.windb2_config['interp']['heights'])
+
+        # Close the file if asked
+        if close_file:
+            nc_outfile.close()
+
+    def time_slabs(self, nc_infile, workers=None):
+        """Splits the time steps of a wrfout file into slabs that are interpolated at once. Each of the workers holds a
+        slab in memory at the same time, so the memory_budget_mb in the config is divided between them, and the slabs
+        are small enough that every worker gets at least one.
+
+        nc_infile - Open wrfout netCDF file
+        workers - Number of processes the slabs are spread over, None for this process only
+
+        returns A slice of the time steps for each slab
+        """
+
+        workers = max(workers or 1, 1)
+        ntimes = len(nc_infile.dimensions['Time'])
+        memory_budget_mb = self.windb2_config.get('memory_budget_mb')
+        if memory_budget_mb is not None:
+            memory_budget_mb /= workers
+        steps_per_slab = wrf.time_steps_per_slab([nc_infile.variables[name] for name in self.slab_vars
+                                                  if name in nc_infile.variables], memory_budget_mb)
+        steps_per_slab = max(1, min(steps_per_slab, int(math.ceil(ntimes / workers))))
+
+        return [slice(slab_start, min(slab_start + steps_per_slab, ntimes))
+                for slab_start in range(0, ntimes, steps_per_slab)]
+
+    def _lower_pbl_interp(self, nc_infile):
+        """Returns how the winds below the lowest model level are diagnosed: 'log-law' if there is a roughness length
+        (ZNT) in the file, otherwise 'log-linear'. Returns None if the winds aren't being interpolated."""
+        if 'WIND' not in self.windb2_config['vars']:
+            return None
+        elif 'ZNT' in nc_infile.variables:
+            return 'log-law'
+        return 'log-linear'
+
+    @staticmethod
+    def _write_slab(nc_outfile, slab, results):
+        """Writes the arrays returned by interp_slab to the time steps of the slab in the height interpolated file."""
+        for name, values in results.items():
+            nc_outfile[name][slab] = values
+
+    def interp_slab(self, nc_infile, slab, engine='grid'):
+        """Interpolates a slab of time steps of a wrfout file to the heights in the config.
+
+        nc_infile - Open wrfout netCDF4 Dataset
+        slab - Slice of the time steps to interpolate
+        engine - 'grid' or 'column', see interp_file
+
+        returns A dict of arrays for the time steps in the slab, keyed by the variable names in the height
+                interpolated file
+        """
+
+        lower_pbl_interp = self._lower_pbl_interp(nc_infile)
+        vars = self.windb2_config['vars']
+
         # Calculate the eta half-heights
-        height_eta_half_above_ground = self.calc_eta_heights(nc_infile)
-        new_eta_height_coord_var[:, :, :, :] = height_eta_half_above_ground[:, :, :, :]
+        height_eta_half_above_ground = self.calc_eta_heights(nc_infile, slab)
+        results = {'atmosphere_hybrid_height_coordinate': height_eta_half_above_ground}
+
+        # Interpolated values for the slab
+        nslab, _, ny, nx = height_eta_half_above_ground.shape
+        shape = (nslab, len(self.heights_to_interp), ny, nx)
+        new_theta = numpy.ndarray(shape, numpy.float64) if 'THETA' in vars else None
+        new_pres = numpy.ndarray(shape, numpy.float64) if 'PRES' in vars else None
+        new_dpt = numpy.ndarray(shape, numpy.float64) if 'DPT' in vars else None
+        if 'CLD' in vars:
+            new_cloud_fraction = {height: numpy.ndarray((nslab, ny, nx), numpy.float64)
+                                  for height in self.CLOUD_HEIGHTS.keys()}
 
         # Get the wind vars from WRF
-        u_var = nc_infile.variables['U'][:, :, :, :]
-        v_var = nc_infile.variables['V'][:, :, :, :]
+        if 'WIND' in vars:
+            u_var = nc_infile.variables['U'][slab, :, :, :]
+            v_var = nc_infile.variables['V'][slab, :, :, :]
+            if lower_pbl_interp == 'log-law':
+                znt_var = nc_infile.variables['ZNT'][slab, :, :]
 
-        # Try and get ZNT which will be used for diagnosing winds below the lowest model level
-        if 'WIND' in self.windb2_config['vars']:
-            try:
-                znt_var = nc_infile.variables['ZNT'][:, :, :]
-                lower_pbl_interp = 'log-law'
-            except KeyError:
-                lower_pbl_interp = 'log-linear'
-
-            # Add the interpolation method for the lowest level
-            new_u.lower_pbl_interp = lower_pbl_interp
-            new_v.lower_pbl_interp = lower_pbl_interp
-
-        # Interpolate each variable from eta-mass coordinates to height coordinates
-        u_mass = (u_var[:, :, :, 1:] + u_var[:, :, :, :-1]) / 2.
-        v_mass = (v_var[:, :, 1:, :] + v_var[:, :, :-1, :]) / 2.
-        u_grid_rotated = numpy.ndarray(
-            (u_mass.shape[0], len(self.heights_to_interp), u_mass.shape[2], u_mass.shape[3]), numpy.float64)
-        v_grid_rotated = numpy.ndarray(u_grid_rotated.shape, numpy.float64)
-        for t in range(height_eta_half_above_ground.shape[0]):
+            # Interpolate each variable from eta-mass coordinates to height coordinates
+            u_mass = (u_var[:, :, :, 1:] + u_var[:, :, :, :-1]) / 2.
+            v_mass = (v_var[:, :, 1:, :] + v_var[:, :, :-1, :]) / 2.
+            u_grid_rotated = numpy.ndarray(shape, numpy.float64)
+            v_grid_rotated = numpy.ndarray(shape, numpy.float64)
+
+        for ts in range(nslab):
+
+            # Time index in the file
+            t = slab.start + ts
 
             # Calculate the pressure on the eta-levels for this time
             pressure_3d_at_time_t = numpy.concatenate(([nc_infile['PSFC'][t, :, :]],
@@ -270,86 +394,124 @@ class HeightInterpFile:
                                                        nc_infile['PB'][t, :, :, :]))
 
             # Calculate the cloud fractions
-            if 'CLD' in self.windb2_config['vars']:
-                self.calc_cloud_fraction(height_eta_half_above_ground, nc_infile, new_cloud_fraction, t)
-
-            for y in range(height_eta_half_above_ground[t].shape[1]):
-                for x in range(height_eta_half_above_ground[t].shape[2]):
+            if 'CLD' in vars:
+                for height, cloud_fraction in self.calc_cloud_fraction(height_eta_half_above_ground[ts],
+                                                                       nc_infile['CLDFRA'][t]).items():
+                    new_cloud_fraction[height][ts] = cloud_fraction
+
+            # Interpolate all of the columns for this time at once
+            if engine == 'grid':
+                if 'WIND' in vars:
+                    u_grid_rotated[ts], v_grid_rotated[ts] = \
+                        heightinterp.uv_grid_interp(u_mass[ts], v_mass[ts], height_eta_half_above_ground[ts],
+                                                    self.heights_to_interp,
+                                                    znt_var[ts] if lower_pbl_interp == 'log-law' else None)
+                self._interp_grid(t, ts, height_eta_half_above_ground[ts], nc_infile, pressure_3d_at_time_t,
+                                  new_theta, new_pres, new_dpt)
+                continue
+
+            for y in range(ny):
+                for x in range(nx):
 
                     # Interpolate the wind fields
-                    if 'WIND' in self.windb2_config['vars']:
+                    if 'WIND' in vars:
 
                         # Select interpolation for lower PBL
                         if lower_pbl_interp=='log-law':
-                            z_o = znt_var[t, y, x]
+                            z_o = znt_var[ts, y, x]
                         else:
                             z_o = None
 
-                        u_grid_rotated[t, :, y, x], v_grid_rotated[t, :, y, x] = \
-                            heightinterp.uv_column_interp(u_mass[t, :, y, x], v_mass[t, :, y, x],
-                                                          height_eta_half_above_ground[t, :, y, x],
+                        u_grid_rotated[ts, :, y, x], v_grid_rotated[ts, :, y, x] = \
+                            heightinterp.uv_column_interp(u_mass[ts, :, y, x], v_mass[ts, :, y, x],
+                                                          height_eta_half_above_ground[ts, :, y, x],
                                                           self.heights_to_interp, z_o)
 
                     # Interpolate potential temperature
                     # Return the 2 m potential temperature if below the lowest height in the model
-                    if 'THETA' in self.windb2_config['vars']:
-                        new_theta[t, :, y, x] = numpy.interp(self.heights_to_interp,
-                                                             numpy.concatenate(([2],
-                                                                                height_eta_half_above_ground[t, :, y,
-                                                                                x])),
-                                                             numpy.concatenate(([nc_infile['TH2'][t, y, x]],
-                                                                                nc_infile['T'][t, :, y, x] + 300.)),
-                                                             nc_infile['TH2'][t, y, x])
+                    if 'THETA' in vars:
+                        new_theta[ts, :, y, x] = numpy.interp(self.heights_to_interp,
+                                                              numpy.concatenate(([2],
+                                                                                 height_eta_half_above_ground[ts, :, y,
+                                                                                 x])),
+                                                              numpy.concatenate(([nc_infile['TH2'][t, y, x]],
+                                                                                 nc_infile['T'][t, :, y, x] + 300.)),
+                                                              nc_infile['TH2'][t, y, x])
 
                     # Interpolate pressure
                     # Use surface pressure at the surface at height zero
-                    if 'PRES' in self.windb2_config['vars']:
-                        new_pres[t, :, y, x] = numpy.interp(self.heights_to_interp,
-                                                            numpy.concatenate(([0],
-                                                                               height_eta_half_above_ground[t, :, y, x])),
-                                                            pressure_3d_at_time_t[y, x])
+                    if 'PRES' in vars:
+                        new_pres[ts, :, y, x] = numpy.interp(self.heights_to_interp,
+                                                             numpy.concatenate(([0],
+                                                                                height_eta_half_above_ground[ts, :, y, x])),
+                                                             pressure_3d_at_time_t[:, y, x])
 
                     # Interpolate dew point
                     # Use surface pressure at t he surface at height zero
-                    if 'DPT' in self.windb2_config['vars']:
+                    if 'DPT' in vars:
 
                         # Combine 2 m and 3D water
                         qvapor = numpy.concatenate(([nc_infile['Q2'][t, y, x]], nc_infile['QVAPOR'][t, :, y, x]))
 
-                        # Calculate the dew point using the equation found in this post: http://forum.wrfforum.com/viewtopic.php?f=7&t=1862
-                        A = 2.53e11 # Pa
-                        B = 5.42e3 # K
-                        E = 0.622 # (approximated from R'/Rv)
-                        p = pressure_3d_at_time_t[:, y, x] # pressure in Pa
-
-                        new_dpt[t, :, y, x] = numpy.interp(self.heights_to_interp,
-                                                             numpy.concatenate(([0],
-                                                                                height_eta_half_above_ground[t, :, y, x])),
-                                                             B / numpy.log(A*E/(qvapor*p)))
+                        new_dpt[ts, :, y, x] = numpy.interp(self.heights_to_interp,
+                                                            numpy.concatenate(([0],
+                                                                               height_eta_half_above_ground[ts, :, y, x])),
+                                                            self.calc_dew_point(qvapor, pressure_3d_at_time_t[:, y, x]))
+
+        # Names according to the Climate and Forecast (CF) Convention, matching the variables made in interp_file
+        if 'THETA' in vars:
+            results['air_potential_temperature'] = new_theta
+        if 'PRES' in vars:
+            results['air_pressure'] = new_pres
+        if 'DPT' in vars:
+            results['dew_point_temperature'] = new_dpt
+        if 'CLD' in vars:
+            for height in self.CLOUD_HEIGHTS.keys():
+                results['cloud_fraction_{}'.format(height)] = new_cloud_fraction[height]
 
-                    # Interpolate density if inverse density was written out in WRF or if the theta and P were
-                    # calculated above
-                    #TODO implement check for WRF inverse-air density variable
-                    if 'RHO' in self.windb2_config['vars'] and 'THETA' in self.windb2_config['vars']\
-                            and 'PRES' in self.windb2_config['vars']:
+        # Interpolate density if inverse density was written out in WRF or if the theta and P were
+        # calculated above
+        #TODO implement check for WRF inverse-air density variable
+        if 'RHO' in vars and 'THETA' in vars and 'PRES' in vars:
 
-                        # Use the equation of state to calculate the density
-                        # TODO this has to convert to actual temperature rather than potential temperature
-                        new_rho[:, :, :, :] = new_pres / (numpy.asarray(new_theta)*constants.R_CONST)
+            # Use the equation of state to calculate the density
+            # TODO this has to convert to actual temperature rather than potential temperature
+            results['air_density'] = new_pres / (new_theta*constants.R_CONST)
 
         # Rotate the wind to the earth grid
-        u_earth_rotated, v_earth_rotated = self._rotate_winds(nc_infile, u_grid_rotated, v_grid_rotated)
+        if 'WIND' in vars:
+            results['eastward_wind'], results['northward_wind'] = \
+                self._rotate_winds(nc_infile, u_grid_rotated, v_grid_rotated, slab)
 
-        # Write the netCDF vars
-        if 'WIND' in self.windb2_config['vars']:
-            new_eta_height_coord_var[:, :, :, :] = height_eta_half_above_ground
-            new_height_agl_coord_var[:] = numpy.array(self.windb2_config['interp']['heights'])
-            new_u[:, :, :, :] = u_earth_rotated
-            new_v[:, :, :, :] = v_earth_rotated
+        return results
 
-        # Close the file if asked
-        if close_file:
-            nc_outfile.close()
+    def _interp_grid(self, t, ts, height_eta_half, nc_infile, pressure_3d, new_theta, new_pres, new_dpt):
+        """Interpolates the theta, pressure and dew point of every column of time t at once into time ts of the slab.
+        Does the same interpolation as the column loop in interp_slab."""
+
+        # Heights of the surface values to add to the bottom of the columns
+        surface = numpy.zeros((1,) + height_eta_half.shape[1:])
+
+        # Interpolate potential temperature
+        # Return the 2 m potential temperature if below the lowest height in the model
+        if 'THETA' in self.windb2_config['vars']:
+            th2 = numpy.asarray(nc_infile['TH2'][t])
+            new_theta[ts] = heightinterp.interp_columns(self.heights_to_interp,
+                                                        numpy.concatenate((surface + 2, height_eta_half)),
+                                                        numpy.concatenate(([th2], nc_infile['T'][t] + 300.)), th2)
+
+        # Interpolate pressure
+        # Use surface pressure at the surface at height zero
+        if 'PRES' in self.windb2_config['vars']:
+            new_pres[ts] = heightinterp.interp_columns(self.heights_to_interp,
+                                                       numpy.concatenate((surface, height_eta_half)), pressure_3d)
+
+        # Interpolate dew point
+        if 'DPT' in self.windb2_config['vars']:
+            qvapor = numpy.concatenate(([nc_infile['Q2'][t]], nc_infile['QVAPOR'][t]))
+            new_dpt[ts] = heightinterp.interp_columns(self.heights_to_interp,
+                                                      numpy.concatenate((surface, height_eta_half)),
+                                                      self.calc_dew_point(qvapor, pressure_3d))
 
     def _calc_pres(self, height_eta_half_above_ground, nc_infile, t, y, x):
         """Interpolates the pressure at different heights above ground level"""
@@ -357,26 +519,39 @@ class HeightInterpFile:
                                   nc_infile['P'][t, :, y, x] +
                                   nc_infile['PB'][t, :, y, x]))
 
-    def _rotate_winds(self, nc_infile, u_grid_rotated, v_grid_rotated):
-        """Rotates the coordinates from grid-relative to earth-relative."""
+    def _rotate_winds(self, nc_infile, u_grid_rotated, v_grid_rotated, times=slice(None)):
+        """Rotates the coordinates from grid-relative to earth-relative for a slice of time steps."""
 
         # Details about this rotation here: http://forum.wrfforum.com/viewtopic.php?f=8&t=3225
-        u_earth_rotated = u_grid_rotated * numpy.asarray(nc_infile['COSALPHA'])[:, numpy.newaxis, :, :] - \
-                          v_grid_rotated * numpy.asarray(nc_infile['SINALPHA'])[:, numpy.newaxis, :, :]
-        v_earth_rotated = v_grid_rotated * numpy.asarray(nc_infile['COSALPHA'])[:, numpy.newaxis, :, :] + \
-                          u_grid_rotated * numpy.asarray(nc_infile['SINALPHA'])[:, numpy.newaxis, :, :]
+        cosalpha = numpy.asarray(nc_infile['COSALPHA'][times])[:, numpy.newaxis, :, :]
+        sinalpha = numpy.asarray(nc_infile['SINALPHA'][times])[:, numpy.newaxis, :, :]
+        u_earth_rotated = u_grid_rotated * cosalpha - v_grid_rotated * sinalpha
+        v_earth_rotated = v_grid_rotated * cosalpha + u_grid_rotated * sinalpha
         return u_earth_rotated, v_earth_rotated
 
 
-    def calc_cloud_fraction(self, height_eta_half_above_ground, nc_infile, new_cloud_fraction, t):
+    def calc_cloud_fraction(self, height_eta_half_at_t, cldfra_at_t):
+        """Returns the cloud fraction of each of the CLOUD_HEIGHTS for one time step, keyed by the name of the height."""
 
         # Get the maximum cloud fraction value at each height
-        cloud_indices = {}
+        new_cloud_fraction = {}
         for height in self.CLOUD_HEIGHTS.keys():
             if(height != 'fog'):
-                cloud_indices = numpy.logical_and(height_eta_half_above_ground[t, :, :, :] >= self.CLOUD_HEIGHTS[height]['bottom'],
-                                                  height_eta_half_above_ground[t, :, :, :] <= self.CLOUD_HEIGHTS[height]['top'])
-                cloudfra_interp_masked = numpy.ma.array(nc_infile['CLDFRA'][t], mask=~cloud_indices)
-                new_cloud_fraction[height][t] = numpy.ma.max(cloudfra_interp_masked, axis=0)
+                cloud_indices = numpy.logical_and(height_eta_half_at_t >= self.CLOUD_HEIGHTS[height]['bottom'],
+                                                  height_eta_half_at_t <= self.CLOUD_HEIGHTS[height]['top'])
+                cloudfra_interp_masked = numpy.ma.array(cldfra_at_t, mask=~cloud_indices)
+                new_cloud_fraction[height] = numpy.ma.max(cloudfra_interp_masked, axis=0)
             else:
-                new_cloud_fraction[height][t] = nc_infile['CLDFRA'][t, 0]
\ No newline at end of file
+                new_cloud_fraction[height] = cldfra_at_t[0]
+        return new_cloud_fraction
+
+
+def _interp_slab_task(task):
+    """Opens a wrfout file and interpolates one slab of its time steps in a worker process of interp_file."""
+
+    windb2_config, wrf_filename, slab, engine = task
+    nc_infile = Dataset(wrf_filename, mode='r')
+    try:
+        return slab, HeightInterpFile(windb2_config).interp_slab(nc_infile, slab, engine)
+    finally:
+        nc_infile.close()
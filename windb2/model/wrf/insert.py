@@ -2,19 +2,41 @@ from __future__ import (absolute_import, division,
                         print_function, unicode_literals)
 from builtins import *
 import logging
-import re
 import sys
-import tempfile
 from datetime import datetime
 import pytz
 
 import psycopg2
+import psycopg2.errorcodes
 import numpy
 from netCDF4._netCDF4 import Dataset, chartostring
 from windb2.insert import Insert
 
 from windb2 import insert, util
-from windb2.model.wrf.wrf import logger, create_wrf_srid
+from windb2.model.wrf.wrf import logger, create_wrf_srid, time_steps_per_slab, TimeSlabs
+
+
+def wind_speed_direction(u, v):
+    """Calculates the speed and the meteorological "coming from" direction for arrays of U and V wind components.
+
+    The speed is calculated in double precision and the direction is truncated to an integer. With NumPy 1.x (1.16
+    in requirements.txt) this is exactly what util.speed and util.calc_dir_deg return for a single float32 grid point.
+    NumPy 2 keeps util.speed of float32 values in float32, so there the speeds only agree to float32 precision.
+
+    u - numpy.array of U wind components
+    v - numpy.array of V wind components
+
+    returns speed, direction - numpy.arrays of float64 and int
+    """
+
+    u = numpy.asarray(u, numpy.float64)
+    v = numpy.asarray(v, numpy.float64)
+    speed = numpy.sqrt(u * u + v * v)
+
+    # Negate U and V to get the direction that the wind is coming from
+    direction = util.calc_dir_deg(-u, -v)
+
+    return speed, numpy.trunc(direction).astype(numpy.int64)
 
 
 class InsertWRF(Insert):
@@ -27,12 +49,17 @@ class InsertWRF(Insert):
             super().__init__(windb2)
 
         self.config = config.config
+        self.geomkey_cache_dir = self.config.get('geomkey_cache_dir')
+        self.partition = self.config.get('partition')
 
         # Logging
         self.loggerSQL = logging.getLogger('windb2')
 
+        # Running total of the rows inserted by this inserter
+        self.rows_inserted = 0
+
     def insert_variable(self, ncfile, var_name, domain_key=None, replace_data=False, sql_where="true",
-                        file_type='windb2', mask=None, zero_seconds=False):
+                        file_type='windb2', mask=None, zero_seconds=False, copy_format='text'):
         """Inserts a netCDF file with WinDB2 or WRF output into a WinDB2 database.
        *
        * windb2Conn - Connection to a WinDB2 database.
@@ -43,6 +70,7 @@ class InsertWRF(Insert):
        * file_type - Type of netCDF file to insert: {'windb2' (default), or 'wrf'}
        * mask - String name of a mask in the WinDB2 database. Only relevant when creating a new domain (the mask is
        *        applied automatically thereafter).
+       * copy_format - Format the rows are sent to the COPY command in: {'text' (default), or 'binary'}
        *
        * returns timesInsertedList, domain_key - A list of times inserted in ISO time format, and the
          domain_key where the data was inserted.
@@ -52,6 +80,8 @@ class InsertWRF(Insert):
         # Make sure this the file_type of file is support
         if file_type != 'windb2' and file_type != 'wrf':
             raise TypeError('Unsupported file file_type: {}'.format(file_type))
+        if copy_format != 'text' and copy_format != 'binary':
+            raise TypeError('Unsupported copy_format: {}'.format(copy_format))
 
         # Open the WinDB netCDF file
         logger.debug('netCDF file file_type passed to wrf.insertNcFile={}'.format(type(ncfile)))
@@ -62,8 +92,6 @@ class InsertWRF(Insert):
         if file_type== 'windb2':
             nlong = len(ncfile.dimensions['x'])
             nlat = len(ncfile.dimensions['y'])
-            x_coord_array = ncfile.groups['WRF']['XLONG'][:]
-            y_coord_array = ncfile.groups['WRF']['XLAT'][:]
             if self.config['vars'][var_name]['dims'] == 3:
                 height_array = ncfile.variables['height'][:]
             elif self.config['vars'][var_name]['dims'] == 2:
@@ -74,47 +102,34 @@ class InsertWRF(Insert):
         elif file_type== 'wrf':
             nlong = len(ncfile.dimensions['west_east'])
             nlat = len(ncfile.dimensions['south_north'])
-            x_coord_array = ncfile['XLONG'][:]
-            y_coord_array = ncfile['XLAT'][:]
             height_array = [self.config[var_name]['insert'][0]]
             init_t = datetime.strptime(ncfile.SIMULATION_START_DATE, '%Y-%m-%d_%H:%M:%S').replace(tzinfo=pytz.utc)
 
-        # Read in the vars to insert
+        # Get the vars to insert, which are read a slab of time steps at a time to keep the memory bounded
         wrf_copied_var = False
         if file_type == 'windb2' and var_name.lower() == 'WIND'.lower():
-            u = ncfile.variables['eastward_wind'][:]
-            v = ncfile.variables['northward_wind'][:]
+            ncvars = [ncfile.variables['eastward_wind'], ncfile.variables['northward_wind']]
         elif file_type == 'windb2' and var_name.lower() == 'DPT'.lower():
-            ncVariable = ncfile.variables['dew_point_temperature'][:]
+            ncvars = [ncfile.variables['dew_point_temperature']]
         # Otherwise try find the WinDB2 interp or WRF var
         else:
             try:
-                ncVariable = ncfile.variables[var_name][:]
+                ncvars = [ncfile.variables[var_name]]
             except KeyError as e:
                 wrf_copied_var = True
-                ncVariable = ncfile.groups['WRF'][var_name][:]
+                ncvars = [ncfile.groups['WRF'][var_name]]
+        steps_per_slab = time_steps_per_slab(ncvars, self.config.get('memory_budget_mb'))
+        if len(ncvars) == 2:
+            u, v = [TimeSlabs(ncvar, steps_per_slab) for ncvar in ncvars]
+        else:
+            ncVariable = TimeSlabs(ncvars[0], steps_per_slab)
 
         # Create a new and/or domain if necessary
         if domain_key is None:
-            if file_type== 'windb2':
-                domain_key = str(self.create_new_domain(ncfile.groups['WRF'].TITLE, "WRF", ncfile.groups['WRF'].DX, 'm', mask))
-            elif file_type== 'wrf':
-                domain_key = str(self.create_new_domain(ncfile.TITLE, "WRF", ncfile.DX, 'm', mask))
-            self.insert_horiz_geom(domain_key, x_coord_array, y_coord_array, create_wrf_srid(self.windb2, ncfile))
-
-            # Mask the domain if necessary
-            if mask is not None:
-                self.mask_domain(domain_key, mask)
+            domain_key = self.create_domain(ncfile, file_type=file_type, mask=mask)
 
         # Create a new table if necessary and add an initialization time column
-        if file_type == 'windb2' and var_name.lower() == 'wind'.lower():
-            if not self.windb2.table_exists('wind' + '_' + domain_key):
-                self.create_new_table(domain_key, var_name, ('speed', 'direction'), ('real', 'smallint'))
-                self._create_initialization_time_column(var_name, domain_key)
-        else:
-            if not self.windb2.table_exists('{}_{}'.format(var_name.lower(), domain_key)):
-                self.create_new_table(domain_key, var_name, ('value',), ('real',))
-                self._create_initialization_time_column(var_name.lower(), domain_key)
+        self.create_variable_table(var_name, domain_key, file_type=file_type)
 
         # Make sure it's a string so that we don't have concatenation problems later
         domain_key = str(domain_key)
@@ -150,6 +165,9 @@ class InsertWRF(Insert):
             # Info
             print('Processing time for {}: {}'.format(var_name, timeValuesToReturn[-1]))
 
+            # Make sure there's a partition for this time if the table is partitioned
+            self.create_partitions(var_name + '_' + domain_key, t)
+
             # Iterate through the x,y, and timearr and insert the WRF variable
             for h in height_array:
 
@@ -167,71 +185,52 @@ class InsertWRF(Insert):
                 else:
                     height = 0
 
-                counter = 0
+                # Build the whole x,y block for this time and height at once. The data are transposed from [y, x] to
+                # [x, y] so the rows come out in the same order as the horizGeomKey array.
+                t_str = t.strftime('%Y-%m-%d %H:%M:%S %Z')
+                init_str = init_t.strftime('%Y-%m-%d %H:%M:%S %Z')
+                if file_type == 'windb2' and var_name.lower() == 'wind'.lower():
+                    u_block = numpy.ma.filled(u[tCount][z], numpy.nan).T
+                    v_block = numpy.ma.filled(v[tCount][z], numpy.nan).T
+                    mask = insert.insert_mask(horizGeomKey, u_block, v_block)
 
-                # Open a temporary file to COPY from
-                tempFile = tempfile.NamedTemporaryFile(mode='w')
+                    # Note that we negate U and V so they exist in WinDB2 as the vernacular "coming from" wind direction
+                    values = wind_speed_direction(u_block[mask], v_block[mask])
+                    value_types = ('real', 'smallint')
 
-                for x in range(horizGeomKey.shape[0]):
-                    for y in range(horizGeomKey.shape[1]):
+                else:
+                    if file_type == 'wrf' or self.config['vars'][var_name]['dims'] == 2:
+                        val_block = numpy.ma.filled(ncVariable[tCount], numpy.nan).T
+                    elif self.config['vars'][var_name]['dims'] == 3:
+                        val_block = numpy.ma.filled(ncVariable[tCount][z], numpy.nan).T
+                    mask = insert.insert_mask(horizGeomKey, val_block)
+                    values = (val_block[mask],)
+                    value_types = ('real',)
+
+                if copy_format == 'binary':
+                    rows = insert.pgcopy_binary((int(domain_key), horizGeomKey[mask], t) + tuple(values) +
+                                                (height, init_t),
+                                                ('int', 'int', 'timestamptz') + value_types + ('real', 'timestamptz'))
+                elif file_type == 'wrf':
+                    rows = insert.format_rows(domain_key, horizGeomKey[mask], t_str, *values, init_str)
+                else:
+                    rows = insert.format_rows(domain_key, horizGeomKey[mask], t_str, *values, height, init_str)
 
-                        # Make sure that this is actually a x,y point we want to insert
-                        # In order to create a mask of selective insert points, all
-                        # a horizGeomKey of zero means we don't want to insert this one
-                        if horizGeomKey[x, y] == 0:
-                            continue
+                counter = int(numpy.count_nonzero(mask))
 
-                        # Write the data string to the temp file
-                        if file_type == 'windb2' and var_name.lower() == 'wind'.lower():
-                            if not (numpy.isnan(u[tCount, z, y, x]) or numpy.isnan(v[tCount, z, y, x])):
-
-                                # Add this row to be inserted into the database
-                                # Note that we negate U and V so they exist in WinDB2 as the vernacular "coming from" wind direction
-                                print('{}, {}, {}, {}, {}, {}, {}'.format(domain_key, horizGeomKey[x, y],
-                                                                      t.strftime('%Y-%m-%d %H:%M:%S %Z'),
-                                                                      util.speed(u[tCount, z, y, x], v[tCount, z, y, x]),
-                                                                      int(util.calc_dir_deg(-u[tCount, z, y, x],
-                                                                      -v[tCount, z, y, x])),
-                                                                      height,
-                                                                      init_t.strftime('%Y-%m-%d %H:%M:%S %Z')), file=tempFile)
-                                counter += 1
-
-                        elif file_type == 'windb2':
-                            # Add this row to be inserted into the database
-                            if self.config['vars'][var_name]['dims'] == 2:
-                                val = ncVariable[tCount, y, x]
-                            elif self.config['vars'][var_name]['dims'] == 3:
-                                val = ncVariable[tCount, z, y, x]
-
-                            if not numpy.isnan(val):
-                                print('{}, {}, {}, {}, {}, {}'.format(domain_key, horizGeomKey[x, y],
-                                                                      t.strftime('%Y-%m-%d %H:%M:%S %Z'),
-                                                                      val,
-                                                                      height,
-                                                                      init_t.strftime('%Y-%m-%d %H:%M:%S %Z')), file=tempFile)
-                                counter += 1
-
-                        elif file_type == 'wrf':
-                            if not numpy.isnan(ncVariable[tCount, y, x]):
-
-                                # Add this row to be inserted into the database
-                                print('{}, {}, {}, {}, {}'.format(domain_key, horizGeomKey[x, y], t.strftime('%Y-%m-%d %H:%M:%S %Z'),
-                                      ncVariable[tCount, y, x], init_t.strftime('%Y-%m-%d %H:%M:%S %Z')), file=tempFile)
-                                counter += 1
-
-                # Insert the data
-                tempFile.flush()
+                # Insert the data, streaming the whole block to the COPY command in one go
                 if file_type == 'windb2' and var_name.lower() == 'wind'.lower():
                     insertColumns = columns=('domainkey', 'geomkey', 't', 'speed', 'direction', 'height', 'init')
                 else:
                     insertColumns = columns=('domainkey', 'geomkey', 't', 'value', 'height', 'init')
                 try:
-                    self.windb2.curs.copy_from(open(tempFile.name, 'r'), var_name + '_' + domain_key, sep=',', columns=insertColumns)
+                    self.copy_rows(var_name + '_' + domain_key, insertColumns, rows, binary=copy_format == 'binary')
+                    self.rows_inserted += counter
                 except psycopg2.IntegrityError as e:
 
                     # Delete the duplicate data
-                    errorTest = 'duplicate key value violates unique constraint "' + var_name.lower() + "_" + domain_key + '_domainkey_geomkey_t_height_init_key"'
-                    if re.search(errorTest, str(e.pgerror)):
+                    # The unique index is named after the partition if the table is partitioned, so go by the code
+                    if e.pgcode == psycopg2.errorcodes.UNIQUE_VIOLATION:
 
                         # Delete the data and retry the insert if asked to replace data in the function call
                         if replace_data:
@@ -248,7 +247,8 @@ class InsertWRF(Insert):
                             self.windb2.conn.commit()
 
                             # Reinsert that timearr
-                            self.windb2.curs.copy_from(open(tempFile.name, 'r'), var_name + '_' + domain_key, sep=',', columns=insertColumns)
+                            self.copy_rows(var_name + '_' + domain_key, insertColumns, rows, binary=copy_format == 'binary')
+                            self.rows_inserted += counter
 
                             # Commit again or the reinserts won't stick
                             self.windb2.conn.commit()
@@ -262,6 +262,10 @@ class InsertWRF(Insert):
                             self.windb2.conn.rollback()
                             continue
 
+                    # Any other integrity error aborted the transaction, so don't pretend it was inserted
+                    self.windb2.conn.rollback()
+                    raise
+
                 # Commit the changes
                 self.windb2.conn.commit()
 
@@ -274,14 +278,56 @@ class InsertWRF(Insert):
                 except UnboundLocalError:
                     print('Inserted {}, {}-m height x,y wind points'.format(counter, height_array[0]))
 
-                # Close the tempfile so it is deleted
-                tempFile.close()
-
             # Increment the time
             tCount += 1
 
         return timeValuesToReturn, domain_key
 
+    def create_domain(self, ncfile, file_type='windb2', mask=None):
+        """Creates a new domain with the horizontal geometry of a WinDB2 or WRF netCDF file.
+
+        ncfile - Either an open file or a string name of a file to open.
+        file_type - Type of netCDF file: {'windb2' (default), or 'wrf'}
+        mask - String name of a mask in the WinDB2 database to apply to the new domain.
+
+        returns domain_key - The key of the new domain as a string
+        """
+
+        if type(ncfile) != Dataset:
+            ncfile = Dataset(ncfile, 'r')
+
+        if file_type == 'windb2':
+            domain_key = str(self.create_new_domain(ncfile.groups['WRF'].TITLE, "WRF", ncfile.groups['WRF'].DX, 'm', mask))
+            x_coord_array = ncfile.groups['WRF']['XLONG'][:]
+            y_coord_array = ncfile.groups['WRF']['XLAT'][:]
+        elif file_type == 'wrf':
+            domain_key = str(self.create_new_domain(ncfile.TITLE, "WRF", ncfile.DX, 'm', mask))
+            x_coord_array = ncfile['XLONG'][:]
+            y_coord_array = ncfile['XLAT'][:]
+        else:
+            raise TypeError('Unsupported file file_type: {}'.format(file_type))
+        self.insert_horiz_geom(domain_key, x_coord_array, y_coord_array, create_wrf_srid(self.windb2, ncfile))
+
+        # Mask the domain if necessary
+        if mask is not None:
+            self.mask_domain(domain_key, mask)
+
+        return domain_key
+
+    def create_variable_table(self, var_name, domain_key, file_type='windb2'):
+        """Creates the table for a variable in a domain, with an initialization time column, if it doesn't already
+        exist."""
+
+        domain_key = str(domain_key)
+        if file_type == 'windb2' and var_name.lower() == 'wind'.lower():
+            if not self.windb2.table_exists('wind' + '_' + domain_key):
+                self.create_new_table(domain_key, var_name, ('speed', 'direction'), ('real', 'smallint'))
+                self._create_initialization_time_column(var_name, domain_key)
+        else:
+            if not self.windb2.table_exists('{}_{}'.format(var_name.lower(), domain_key)):
+                self.create_new_table(domain_key, var_name, ('value',), ('real',))
+                self._create_initialization_time_column(var_name.lower(), domain_key)
+
     def _create_initialization_time_column(self, table_name, domain_key):
         """Adds the initialization time column to allow for multiple forecasts to coexist"""
         self.windb2.curs.execute('ALTER TABLE {}_{} ADD COLUMN init TIMESTAMP WITH TIME ZONE'.format(table_name, domain_key))
@@ -14,8 +14,7 @@ import logging
 
 import matplotlib
 
-from windb2 import util
-from windb2.util import none2NaN
+from windb2 import statements, timerange, util, windb2
 
 
 def plotBuoyWRFWindSpeedPerMonth(yearNum, monthNum, timeDeltaMinutes, wrfDomain, wrfGeomKey, wrfHeight, buoyDomain, curs):
@@ -24,33 +23,31 @@ def plotBuoyWRFWindSpeedPerMonth(yearNum, monthNum, timeDeltaMinutes, wrfDomain,
    import matplotlib.pyplot as plt
    import numpy
 
+   # Filter on the month as a half-open time range so that the t index can be used
+   monthRange, monthParams = timerange.time_range('t', *timerange.month_bounds(yearNum, monthNum))
+
    # Execute the statement to get the avg winds
-   windBuoyDataSql = """SELECT t, m_u, m_v, b_u, b_v
+   windBuoyDataSql = """SELECT """ + windb2.EPOCH_US_SQL.format('t') + """, m_u, m_v, b_u, b_v
                         FROM (SELECT t, U(speed,direction) as m_u, V(speed,direction) as m_v
                               FROM wind_""" + str(wrfDomain) + """
                               WHERE geomkey=""" + str(wrfGeomKey) + """ AND 
                                     height=""" + str(wrfHeight) + """ AND 
-                                    date_part('month', t)=""" + str(monthNum) + """ AND 
-                                    date_part('year', t)=""" + str(yearNum) + """) m
+                                    """ + monthRange + """) m
                         LEFT JOIN
                              (SELECT t, U(speed,direction) as b_u, V(speed,direction) as b_v
                               FROM wind_""" + str(buoyDomain) + """
-                              WHERE date_part('month', t)=""" + str(monthNum) + """ AND 
-                                    date_part('year', t)=""" + str(yearNum) + """) b 
+                              WHERE """ + monthRange + """) b 
                         USING (t) 
                         ORDER BY t;"""
    logging.debug("Executing the statement: {}".format(windBuoyDataSql))
-   curs.execute(windBuoyDataSql)
-   queryResult = curs.fetchall()
-   queryResult = numpy.array(queryResult)
+   # The missing buoy data come back as NaNs, which can be used in masked arrays
+   queryResult = windb2.fetch_array(curs.connection, windBuoyDataSql,
+                                    [('t', 'datetime64[us]'), ('m_u', numpy.float64), ('m_v', numpy.float64),
+                                     ('b_u', numpy.float64), ('b_v', numpy.float64)], monthParams)
 
    # Divide up the data
-   time = queryResult[:,0]
-   wrfBuoyWind = numpy.array(queryResult[:,1:],dtype=numpy.float)
-   
-   # Get rid of the None because they cannot be used in masked arrays, convert to NaNs
-   for i in range(wrfBuoyWind.shape[1]):
-       wrfBuoyWind[:,i] = none2NaN(wrfBuoyWind[:, i])
+   time = queryResult['t']
+   wrfBuoyWind = numpy.column_stack([queryResult[name] for name in ('m_u', 'm_v', 'b_u', 'b_v')])
 
    # Get the height of the buoy data (and assume they are all the same from this location)
    buoyHeightSql = "SELECT DISTINCT(height) FROM wind_" + str(buoyDomain)
@@ -69,7 +66,7 @@ def plotBuoyWRFWindSpeedPerMonth(yearNum, monthNum, timeDeltaMinutes, wrfDomain,
    #
    # Get the name of the buoy
    #
-   curs.execute("SELECT name FROM domain WHERE key=" + str(buoyDomain))
+   statements.execute(curs, 'domain_name', (int(buoyDomain),))
    buoyName = str(curs.fetchone()[0]).upper()
    plt.title(buoyName + ", " + str(yearNum) + "-" + str(monthNum))
    
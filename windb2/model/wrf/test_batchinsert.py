@@ -0,0 +1,52 @@
+import os
+import shutil
+import tempfile
+import unittest
+from windb2.model.wrf import batchinsert
+
+
+class TestBatchInsert(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.files = []
+        for name in ('wrfout_d01_2016-02-14_01:00:00', 'wrfout_d01_2016-02-14_00:00:00',
+                     'wrfout_d01_2016-02-14_00:00:00-height-interp.nc'):
+            self.files.append(os.path.join(self.dir, name))
+            open(self.files[-1], 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testFileType(self):
+        self.assertEqual(batchinsert.file_type(self.files[0]), 'wrf')
+        self.assertEqual(batchinsert.file_type(self.files[2]), 'windb2')
+        with self.assertRaises(TypeError):
+            batchinsert.file_type('wrfout_d01.txt')
+
+    def testExpandInputs(self):
+        manifest = os.path.join(self.dir, 'manifest.txt')
+        with open(manifest, 'w') as f:
+            f.write('# height interpolated files\n\n{}\n{}\n'.format(self.files[2], self.files[0]))
+
+        # Globs are sorted, the manifest keeps its order and duplicates are dropped
+        filenames = batchinsert.expand_inputs([os.path.join(self.dir, 'wrfout_d01_*00')], manifest)
+        self.assertEqual(filenames, [self.files[1], self.files[0], self.files[2]])
+
+        with self.assertRaises(IOError):
+            batchinsert.expand_inputs([os.path.join(self.dir, 'wrfout_d02_*')])
+
+    def testVarsToInsert(self):
+        windb2_config = {'vars': {'WIND': {'dims': 3, 'insert': [10]}, 'DPT': {'dims': 3}, 'T2': {'insert': [2]}}}
+        self.assertEqual(sorted(batchinsert.vars_to_insert(windb2_config)), ['T2', 'WIND'])
+
+    def testSummarize(self):
+        results = [batchinsert.InsertResult('b', 'WIND', 10, 1., None),
+                   batchinsert.InsertResult('a', 'WIND', 5, 1., None),
+                   batchinsert.InsertResult('b', 'T2', 0, 0.5, 'Traceback'),
+                   batchinsert.InsertResult('a', 'T2', 5, 1., None)]
+        self.assertEqual(batchinsert.summarize(results), [('b', 10, 1.5, ['T2']), ('a', 10, 2., [])])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -69,5 +69,35 @@ class TestHeightInterpMethods(unittest.TestCase):
                                           [[0, util.u_flow(5, 45)], [0, util.v_flow(5, 45)]],
                                           decimal=2)
 
+    def _random_columns(self, seed=0):
+        rng = numpy.random.RandomState(seed)
+        shape = (6, 4, 5)
+        u = rng.standard_normal(shape) * 8
+        v = rng.standard_normal(shape) * 8
+        z = numpy.cumsum(rng.uniform(5, 60, shape), axis=0)
+        z[:, 0, 0] = numpy.arange(1, 7) * 120.  # second level above 100 m
+        return u, v, z, rng.uniform(0.0001, 1, shape[1:])
+
+    def testInterpColumns(self):
+        u, v, z, z_o = self._random_columns()
+        heights = numpy.array([0, 2, 10, 40, z[2, 1, 1], 100, 500, 1000])
+        interp = heightinterp.interp_columns(heights, z, u, left=z_o)
+        for y in range(z.shape[1]):
+            for x in range(z.shape[2]):
+                numpy.testing.assert_array_equal(interp[:, y, x], numpy.interp(heights, z[:, y, x], u[:, y, x],
+                                                                               z_o[y, x]))
+
+    def testUVGridInterp(self):
+        u, v, z, z_o = self._random_columns()
+        heights = [2, 10, 40, 80, 150]
+        for roughness in (None, z_o):
+            u_interp, v_interp = heightinterp.uv_grid_interp(u, v, z, heights, roughness)
+            for y in range(z.shape[1]):
+                for x in range(z.shape[2]):
+                    u_column, v_column = heightinterp.uv_column_interp(u[:, y, x], v[:, y, x], z[:, y, x], heights,
+                                                                       None if roughness is None else z_o[y, x])
+                    numpy.testing.assert_allclose(u_interp[:, y, x], u_column, rtol=1e-10, atol=1e-10)
+                    numpy.testing.assert_allclose(v_interp[:, y, x], v_column, rtol=1e-10, atol=1e-10)
+
 if __name__ == '__main__':
     unittest.main()
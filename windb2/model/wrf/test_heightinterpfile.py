@@ -0,0 +1,133 @@
+import os
+import shutil
+import tempfile
+import unittest
+import netCDF4
+import numpy
+from windb2.model.wrf import wrf
+from windb2.model.wrf.heightinterpfile import HeightInterpFile
+
+
+def write_random_wrf_file(filename, znt=True, seed=0, nt=2):
+    """Writes a small wrfout file with nt times of a random but physically plausible atmosphere."""
+
+    rng = numpy.random.RandomState(seed)
+    nz, ny, nx = 8, 5, 6
+    ncfile = netCDF4.Dataset(filename, 'w')
+    ncfile.TITLE = 'Random test atmosphere'
+    ncfile.createDimension('Time', None)
+    ncfile.createDimension('DateStrLen', 19)
+    ncfile.createDimension('bottom_top', nz)
+    ncfile.createDimension('south_north', ny)
+    ncfile.createDimension('south_north_stag', ny + 1)
+    ncfile.createDimension('west_east', nx)
+    ncfile.createDimension('west_east_stag', nx + 1)
+
+    def var(name, dims, data):
+        ncfile.createVariable(name, 'f4', dims)[:] = data
+
+    times = ncfile.createVariable('Times', 'S1', ('Time', 'DateStrLen'))
+    times[:] = [netCDF4.stringtoarr('2016-02-14_0{}:00:00'.format(t), 19) for t in range(nt)]
+
+    # Pressure falling with height from the surface
+    psfc = 101325 - rng.uniform(0, 3000, (nt, ny, nx))
+    pressure = psfc[:, numpy.newaxis] - numpy.cumsum(rng.uniform(50, 800, (nt, nz, ny, nx)), axis=1)
+    var('PSFC', ('Time', 'south_north', 'west_east'), psfc)
+    var('P', ('Time', 'bottom_top', 'south_north', 'west_east'), pressure - 90000)
+    var('PB', ('Time', 'bottom_top', 'south_north', 'west_east'), numpy.full(pressure.shape, 90000.))
+    var('T', ('Time', 'bottom_top', 'south_north', 'west_east'), rng.uniform(-15, -10, (nt, nz, ny, nx)))
+    var('T2', ('Time', 'south_north', 'west_east'), rng.uniform(285, 290, (nt, ny, nx)))
+    var('TH2', ('Time', 'south_north', 'west_east'), rng.uniform(285, 290, (nt, ny, nx)))
+    var('Q2', ('Time', 'south_north', 'west_east'), rng.uniform(0.005, 0.01, (nt, ny, nx)))
+    var('QVAPOR', ('Time', 'bottom_top', 'south_north', 'west_east'), rng.uniform(0.001, 0.01, (nt, nz, ny, nx)))
+    var('U', ('Time', 'bottom_top', 'south_north', 'west_east_stag'), rng.standard_normal((nt, nz, ny, nx + 1)) * 8)
+    var('V', ('Time', 'bottom_top', 'south_north_stag', 'west_east'), rng.standard_normal((nt, nz, ny + 1, nx)) * 8)
+    if znt:
+        var('ZNT', ('Time', 'south_north', 'west_east'), rng.uniform(0.0001, 1, (nt, ny, nx)))
+    var('COSALPHA', ('Time', 'south_north', 'west_east'), numpy.full((nt, ny, nx), 0.99))
+    var('SINALPHA', ('Time', 'south_north', 'west_east'), numpy.full((nt, ny, nx), 0.14))
+    var('XLONG', ('Time', 'south_north', 'west_east'), numpy.tile(numpy.arange(nx, dtype=float), (nt, ny, 1)))
+    var('XLAT', ('Time', 'south_north', 'west_east'), numpy.tile(numpy.arange(ny, dtype=float)[:, None], (nt, 1, nx)))
+    ncfile.close()
+
+
+class TestHeightInterpFile(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.config = {'interp': {'heights': [2, 10, 40, 80, 200]},
+                       'vars': {'WIND': {'dims': 3}, 'THETA': {'dims': 3}, 'PRES': {'dims': 3}, 'DPT': {'dims': 3}}}
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testGridMatchesColumns(self):
+        for znt in (True, False):
+            results = {}
+            for engine in ('column', 'grid'):
+                filename = os.path.join(self.dir, 'wrfout_{}_{}'.format(engine, znt))
+                write_random_wrf_file(filename, znt=znt)
+                HeightInterpFile(self.config).interp_file(filename, engine=engine)
+                with netCDF4.Dataset(filename + HeightInterpFile.outfile_extension) as ncfile:
+                    results[engine] = {name: ncfile[name][:] for name in ('eastward_wind', 'northward_wind',
+                                                                          'air_potential_temperature',
+                                                                          'air_pressure', 'dew_point_temperature')}
+            for name in results['column']:
+                numpy.testing.assert_allclose(results['grid'][name], results['column'][name], rtol=1e-6,
+                                              err_msg=name)
+
+    def testSlabsMatchWholeFile(self):
+        results = []
+        for budget in (None, 1000):
+            filename = os.path.join(self.dir, 'wrfout_{}'.format(budget))
+            write_random_wrf_file(filename)
+            self.config['memory_budget_mb'] = budget
+            HeightInterpFile(self.config).interp_file(filename)
+            with netCDF4.Dataset(filename + HeightInterpFile.outfile_extension) as ncfile:
+                results.append([ncfile[name][:] for name in ('eastward_wind', 'air_pressure',
+                                                             'atmosphere_hybrid_height_coordinate')])
+        for one_step, whole_file in zip(*results):
+            numpy.testing.assert_array_equal(one_step, whole_file)
+
+    def testWorkersMatchOneProcess(self):
+        self.config['vars']['RHO'] = {'dims': 3}
+        self.config['vars']['CLD'] = {'dims': 2}
+        names = ('eastward_wind', 'northward_wind', 'air_potential_temperature', 'air_pressure', 'air_density',
+                 'dew_point_temperature', 'cloud_fraction_low', 'atmosphere_hybrid_height_coordinate')
+        results = []
+        for workers in (None, 2):
+            filename = os.path.join(self.dir, 'wrfout_{}'.format(workers))
+            write_random_wrf_file(filename)
+            with netCDF4.Dataset(filename, 'a') as ncfile:
+                ncfile.createVariable('CLDFRA', 'f4', ('Time', 'bottom_top', 'south_north', 'west_east'))[:] = \
+                    numpy.random.RandomState(1).uniform(0, 1, ncfile['T'].shape)
+            HeightInterpFile(self.config).interp_file(filename, workers=workers)
+            with netCDF4.Dataset(filename + HeightInterpFile.outfile_extension) as ncfile:
+                results.append([ncfile[name][:] for name in names])
+        for name, one_process, pool in zip(names, *results):
+            numpy.testing.assert_array_equal(pool, one_process, err_msg=name)
+
+    def testWorkersGetSlabs(self):
+        # The whole small file fits in the budget of one process, but is split so that both workers have a slab
+        filename = os.path.join(self.dir, 'wrfout_slabs')
+        write_random_wrf_file(filename, nt=8)
+        self.config['memory_budget_mb'] = 4096
+        with netCDF4.Dataset(filename) as ncfile:
+            self.assertEqual(HeightInterpFile(self.config).time_slabs(ncfile), [slice(0, 8)])
+            self.assertEqual(HeightInterpFile(self.config).time_slabs(ncfile, workers=2), [slice(0, 4), slice(4, 8)])
+
+            # A budget for four time steps is shared between the workers
+            step_mb = 1. / wrf.time_steps_per_slab([ncfile[name] for name in HeightInterpFile.slab_vars
+                                                    if name in ncfile.variables], 1)
+            self.config['memory_budget_mb'] = 4.5 * step_mb
+            self.assertEqual(len(HeightInterpFile(self.config).time_slabs(ncfile)), 2)
+            self.assertEqual(HeightInterpFile(self.config).time_slabs(ncfile, workers=2),
+                             [slice(0, 2), slice(2, 4), slice(4, 6), slice(6, 8)])
+
+    def testUnsupportedEngine(self):
+        with self.assertRaises(TypeError):
+            HeightInterpFile(self.config).interp_file('wrfout_d01', engine='gpu')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+import numpy
+from windb2 import util
+from windb2 import insert as windb2_insert
+from windb2.model.wrf import insert
+
+
+class TestInsertRows(unittest.TestCase):
+
+    def setUp(self):
+        rng = numpy.random.RandomState(1)
+        self.u = (rng.standard_normal((4, 3)) * 8).astype(numpy.float32)  # [y, x]
+        self.v = (rng.standard_normal((4, 3)) * 8).astype(numpy.float32)
+        self.u[1, 2] = numpy.nan
+        self.geomkey = numpy.arange(1, 13).reshape((3, 4))  # [x, y]
+        self.geomkey[0, 3] = 0
+
+    def testWindRowsMatchPerCell(self):
+        # Rows the way the per-(x,y) loop used to print them
+        expected = ''
+        for x in range(self.geomkey.shape[0]):
+            for y in range(self.geomkey.shape[1]):
+                if self.geomkey[x, y] == 0 or numpy.isnan(self.u[y, x]) or numpy.isnan(self.v[y, x]):
+                    continue
+                expected += '{}, {}, {}, {}, {}, {}, {}\n'.format('1', self.geomkey[x, y], 't',
+                                                                  util.speed(self.u[y, x], self.v[y, x]),
+                                                                  int(util.calc_dir_deg(-self.u[y, x], -self.v[y, x])),
+                                                                  numpy.float32(10), 'init')
+
+        mask = windb2_insert.insert_mask(self.geomkey, self.u.T, self.v.T)
+        rows = windb2_insert.format_rows('1', self.geomkey[mask], 't',
+                                         *insert.wind_speed_direction(self.u.T[mask], self.v.T[mask]),
+                                         numpy.float32(10), 'init')
+        self.assertEqual(rows.count('\n'), 10)
+
+        # NumPy 2 no longer promotes the float32 speeds of the loop to float64, so they only agree to float32 precision
+        if numpy.lib.NumpyVersion(numpy.__version__) < '2.0.0':
+            self.assertEqual(rows, expected)
+        else:
+            rows = [row.split(', ') for row in rows.splitlines()]
+            expected = [row.split(', ') for row in expected.splitlines()]
+            self.assertEqual([row[:3] + row[4:] for row in rows], [row[:3] + row[4:] for row in expected])
+            numpy.testing.assert_allclose([float(row[3]) for row in rows], [float(row[3]) for row in expected],
+                                          rtol=1e-6)
+
+    def testValueRows(self):
+        mask = windb2_insert.insert_mask(self.geomkey, self.u.T)
+        rows = windb2_insert.format_rows('1', self.geomkey[mask], 't', self.u.T[mask], 2, 'init')
+        self.assertEqual(rows.splitlines()[0], '1, 1, t, {}, 2, init'.format(self.u[0, 0]))
+        self.assertEqual(windb2_insert.format_rows('1', self.geomkey[~(self.geomkey >= 0)], 't'), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import os
+import shutil
+import tempfile
+import unittest
+import netCDF4
+import numpy
+from windb2.model.wrf import wrf
+
+
+class TestTimeSlabs(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.ncfile = netCDF4.Dataset(os.path.join(self.dir, 'slabs.nc'), 'w')
+        self.ncfile.createDimension('Time', None)
+        self.ncfile.createDimension('z', 4)
+        self.ncfile.createDimension('y', 8)
+        self.ncfile.createDimension('x', 16)
+        self.var = self.ncfile.createVariable('U', 'f4', ('Time', 'z', 'y', 'x'))
+        self.var[:] = numpy.arange(5 * 4 * 8 * 16).reshape((5, 4, 8, 16))
+
+    def tearDown(self):
+        self.ncfile.close()
+        shutil.rmtree(self.dir)
+
+    def testTimeStepsPerSlab(self):
+        # Each time step is 4*8*16 float32 values, or 2 kB, so 8 kB with the default overhead
+        self.assertEqual(wrf.time_steps_per_slab([self.var]), 1)
+        self.assertEqual(wrf.time_steps_per_slab([self.var], 0.001), 1)
+        self.assertEqual(wrf.time_steps_per_slab([self.var], 1), 128)
+        self.assertEqual(wrf.time_steps_per_slab([self.var, self.var], 1, overhead=1), 256)
+
+    def testTimeSlabs(self):
+        slabs = wrf.TimeSlabs(self.var, 2)
+        self.assertEqual(len(slabs), 5)
+        for t in (0, 1, 4, 3, 2):
+            numpy.testing.assert_array_equal(slabs[t], self.var[t])
+        self.assertEqual(slabs._slab.shape[0], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -11,6 +11,7 @@
 # 
 #
 import logging
+import numpy
 
 # Set up logging for InsertAbstract
 logger = logging.getLogger('windb2')
@@ -60,3 +61,50 @@ def create_wrf_srid(windb2_instance, ncfile):
     srid = windb2_instance.curs.fetchone()[0]
     print("Newly created SRID: ", srid)
     return srid
+
+
+# Rough number of copies of each variable held in memory while a time step is processed (the variable itself plus
+# float64 intermediates)
+SLAB_OVERHEAD = 4
+
+
+def time_steps_per_slab(ncvars, memory_budget_mb=None, overhead=SLAB_OVERHEAD):
+    """Calculates how many time steps of some netCDF variables can be read and processed at once.
+
+    ncvars - netCDF variables with Time as the first dimension that are read for each time step
+    memory_budget_mb - Memory in MB to use for a slab of time steps. One time step is read at a time if this is None.
+    overhead - Number of copies of each variable held in memory while processing a time step
+
+    Returns the number of time steps per slab, which is always at least one.
+    """
+
+    if memory_budget_mb is None:
+        return 1
+
+    bytes_per_step = overhead * sum(int(numpy.prod(var.shape[1:])) * var.dtype.itemsize for var in ncvars)
+    return max(1, int(memory_budget_mb * 2**20 // max(bytes_per_step, 1)))
+
+
+class TimeSlabs(object):
+    """Reads a netCDF variable a slab of time steps at a time, so that indexing a time step only keeps its slab in
+    memory instead of the whole variable.
+
+    ncvar - netCDF variable with Time as the first dimension
+    steps_per_slab - Number of time steps to read at once
+    """
+
+    def __init__(self, ncvar, steps_per_slab=1):
+        self.ncvar = ncvar
+        self.steps_per_slab = steps_per_slab
+        self._start = None
+        self._slab = None
+
+    def __len__(self):
+        return self.ncvar.shape[0]
+
+    def __getitem__(self, t):
+        """Returns time step t, reading the slab containing it if it hasn't been read already."""
+        if self._slab is None or not self._start <= t < self._start + self._slab.shape[0]:
+            self._start = t - t % self.steps_per_slab
+            self._slab = self.ncvar[self._start:self._start + self.steps_per_slab]
+        return self._slab[t - self._start]
@@ -0,0 +1,136 @@
+"""Finds the nearest horizgeom points of a domain to many longitude, latitude pairs at once, either with one KNN query
+in the WinDB2 or offline with a KD-tree of the domain's points."""
+
+import logging
+
+import numpy
+
+logger = logging.getLogger('windb2')
+
+# Radius of the sphere used by PostGIS ST_DistanceSphere [m]
+EARTH_RADIUS_M = 6370986.
+
+# Number of the nearest points in long,lat degrees that are compared on the sphere
+KNN_CANDIDATES = 8
+
+
+def nearest_geomkeys(curs, domain, longitudes, latitudes, max_distance=None):
+    """Finds the nearest point in a domain to each long,lat pair with a single query.
+
+    The closest KNN_CANDIDATES points in degrees are found with the KNN <-> operator, which uses the GiST index on
+    horizgeom.geom4326, and the nearest of those on the sphere is returned.
+
+    curs - psycopg2 cursor
+    domain - Domain key
+    longitudes - Longitudes in degrees E (W is negative)
+    latitudes - Latitudes in degrees N (S is negative)
+    max_distance - Points further than this [m] are not matched
+
+    returns geomkeys, distances - numpy.arrays with the geomkey of and the distance [m] to the nearest point for each
+            pair, where 0 and NaN mean no point was found
+    """
+
+    longitudes = numpy.asarray(longitudes, numpy.float64).ravel()
+    latitudes = numpy.asarray(latitudes, numpy.float64).ravel()
+    geomkeys = numpy.zeros(longitudes.shape, numpy.int64)
+    distances = numpy.full(longitudes.shape, numpy.nan)
+    if longitudes.size == 0:
+        return geomkeys, distances
+
+    sql = """SELECT p.i, n.key, n.dist
+             FROM unnest(%(longitudes)s::double precision[], %(latitudes)s::double precision[])
+                  WITH ORDINALITY AS p(longitude, latitude, i)
+             JOIN LATERAL (
+                 SELECT c.key, st_distancesphere(c.geom4326,
+                                                 st_setsrid(st_makepoint(p.longitude, p.latitude), 4326)) AS dist
+                 FROM (SELECT h.key, h.geom4326
+                       FROM horizgeom h
+                       WHERE h.domainkey=%(domain)s AND h.geom4326 IS NOT NULL
+                       ORDER BY h.geom4326 <-> st_setsrid(st_makepoint(p.longitude, p.latitude), 4326)
+                       LIMIT %(candidates)s) c
+                 ORDER BY dist LIMIT 1) n ON true"""
+    curs.execute(sql, {'longitudes': longitudes.tolist(), 'latitudes': latitudes.tolist(), 'domain': domain,
+                       'candidates': KNN_CANDIDATES})
+    rows = numpy.array(curs.fetchall(), numpy.float64).reshape(-1, 3)
+
+    # Ordinality starts at one
+    i = rows[:, 0].astype(numpy.int64) - 1
+    geomkeys[i] = rows[:, 1]
+    distances[i] = rows[:, 2]
+
+    if max_distance is not None:
+        too_far = ~(distances <= max_distance)
+        geomkeys[too_far] = 0
+        distances[too_far] = numpy.nan
+
+    return geomkeys, distances
+
+
+def _unit_vectors(longitudes, latitudes):
+    """Converts longitudes and latitudes in degrees to points on the unit sphere."""
+
+    longitudes = numpy.radians(numpy.asarray(longitudes, numpy.float64))
+    latitudes = numpy.radians(numpy.asarray(latitudes, numpy.float64))
+    return numpy.column_stack((numpy.cos(latitudes) * numpy.cos(longitudes),
+                               numpy.cos(latitudes) * numpy.sin(longitudes),
+                               numpy.sin(latitudes)))
+
+
+class GeomKeyTree(object):
+    """KD-tree of the points of a domain for finding the nearest geomkeys without a database, e.g. for screening many
+    candidate locations offline. The points are placed on a unit sphere, so the nearest point in the tree is also the
+    nearest on the sphere.
+
+    geomkeys - Geomkey of each point
+    longitudes, latitudes - Location of each point in degrees
+    """
+
+    def __init__(self, geomkeys, longitudes, latitudes):
+        from scipy.spatial import cKDTree
+
+        self.geomkeys = numpy.asarray(geomkeys, numpy.int64).ravel()
+        self.longitudes = numpy.asarray(longitudes, numpy.float64).ravel()
+        self.latitudes = numpy.asarray(latitudes, numpy.float64).ravel()
+        self.tree = cKDTree(_unit_vectors(self.longitudes, self.latitudes))
+
+    @classmethod
+    def from_domain(cls, curs, domain):
+        """Builds the tree from the horizgeom points of a domain."""
+
+        curs.execute('SELECT key, st_x(geom4326), st_y(geom4326) '
+                     'FROM horizgeom WHERE domainkey=%s AND geom4326 IS NOT NULL', (domain,))
+        points = numpy.array(curs.fetchall(), numpy.float64).reshape(-1, 3)
+        logger.info('Built a KD-tree of the {} points in domain {}'.format(points.shape[0], domain))
+        return cls(points[:, 0], points[:, 1], points[:, 2])
+
+    @classmethod
+    def load(cls, filename):
+        """Reads a tree written by save."""
+
+        with numpy.load(filename) as points:
+            return cls(points['geomkeys'], points['longitudes'], points['latitudes'])
+
+    def save(self, filename):
+        """Writes the points of the tree to a .npz file so it can be used without the WinDB2."""
+
+        numpy.savez(filename, geomkeys=self.geomkeys, longitudes=self.longitudes, latitudes=self.latitudes)
+
+    def query(self, longitudes, latitudes, max_distance=None):
+        """Finds the nearest point to each long,lat pair, see nearest_geomkeys.
+
+        returns geomkeys, distances - numpy.arrays with the geomkey of and the great circle distance [m] to the
+                nearest point for each pair, where 0 and NaN mean no point was found
+        """
+
+        shape = numpy.broadcast(longitudes, latitudes).shape
+        chords, i = self.tree.query(_unit_vectors(numpy.ravel(longitudes), numpy.ravel(latitudes)))
+        found = numpy.isfinite(chords)
+        geomkeys = numpy.where(found, self.geomkeys[numpy.minimum(i, self.geomkeys.size - 1)], 0)
+        distances = 2 * EARTH_RADIUS_M * numpy.arcsin(numpy.minimum(chords / 2, 1))
+
+        if max_distance is not None:
+            found &= distances <= max_distance
+            geomkeys[~found] = 0
+        distances[~found] = numpy.nan
+
+        return geomkeys.reshape(shape), distances.reshape(shape)
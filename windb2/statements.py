@@ -0,0 +1,111 @@
+"""Registry of the queries WinDB2 runs over and over, e.g. once for every MERRA2 node, buoy or time step. Each one is
+prepared with typed parameters the first time it's used on a connection and run with EXECUTE after that, so that
+PostgreSQL parses and plans it once per session instead of on every call. Table names are filled in with
+psycopg2.sql.Identifier, which gives each table its own prepared statement."""
+
+import hashlib
+import weakref
+from psycopg2 import sql
+
+# Longest identifier PostgreSQL keeps, longer prepared statement names are hashed
+MAX_NAME_LENGTH = 63
+
+# Registered statements by name: (query, parameter types)
+STATEMENTS = {}
+
+# Names of the statements prepared on each connection
+_prepared = weakref.WeakKeyDictionary()
+
+
+def register(name, query, types=()):
+    """Adds a statement to the registry, replacing any with the same name.
+
+    name - Name to execute the statement by
+    query - Query with $1, $2, ... for the parameters and {}-style fields like {table} for identifiers
+    types - PostgreSQL type of each parameter e.g. ('int', 'timestamptz')
+    """
+
+    STATEMENTS[name] = (query, tuple(types))
+
+
+def statement_name(name, **identifiers):
+    """Returns the name of the prepared statement for a registered statement and its identifiers."""
+
+    full_name = '_'.join(['windb2', name] + [identifiers[key] for key in sorted(identifiers)])
+    if len(full_name) > MAX_NAME_LENGTH:
+        full_name = 'windb2_{}'.format(hashlib.md5(full_name.encode()).hexdigest())
+    return full_name
+
+
+def prepared(conn):
+    """Returns the names of the statements already prepared on a connection."""
+
+    return _prepared.setdefault(conn, set())
+
+
+def execute(curs, name, params=(), **identifiers):
+    """Runs a registered statement, preparing it first if this is the first time it's been run on the cursor's
+    connection. Fetch the results from the cursor as usual.
+
+    curs - psycopg2 cursor
+    name - Name of the registered statement
+    params - Sequence of the parameters
+    identifiers - Identifier for each {}-style field in the query e.g. table='wind_1'
+    """
+
+    query, types = STATEMENTS[name]
+    if len(params) != len(types):
+        raise ValueError('{} takes {} parameters, got {}'.format(name, len(types), len(params)))
+    prepared_name = sql.Identifier(statement_name(name, **identifiers))
+
+    # Prepare the statement once per connection
+    names = prepared(curs.connection)
+    if prepared_name.string not in names:
+        prepare = sql.SQL('PREPARE {}').format(prepared_name)
+        if types:
+            prepare += sql.SQL(' ({})').format(sql.SQL(', ').join(sql.SQL(t) for t in types))
+        fields = {key: sql.Identifier(value) for key, value in identifiers.items()}
+        prepare += sql.SQL(' AS ') + sql.SQL(query).format(**fields)
+        curs.execute(prepare)
+        names.add(prepared_name.string)
+
+    if params:
+        placeholders = sql.SQL(', ').join(sql.Placeholder() * len(params))
+        curs.execute(sql.SQL('EXECUTE {} ({})').format(prepared_name, placeholders), params)
+    else:
+        curs.execute(sql.SQL('EXECUTE {}').format(prepared_name))
+
+
+def deallocate(conn):
+    """Forgets the statements prepared on a connection and deallocates them on the server, e.g. before handing a
+    connection to code that runs DISCARD ALL."""
+
+    with conn.cursor() as curs:
+        curs.execute('DEALLOCATE ALL')
+    _prepared.pop(conn, None)
+
+
+# Lookups
+register('domain_key', 'SELECT key FROM domain WHERE name=$1', ('text',))
+register('domain_resolution', 'SELECT resolution, units FROM domain WHERE key=$1', ('int',))
+register('domain_name', 'SELECT name FROM domain WHERE key=$1', ('int',))
+register('table_exists', 'SELECT to_regclass($1) IS NOT NULL', ('text',))
+register('find_geomkey', 'SELECT key FROM horizgeom WHERE geom4326 ~= st_setsrid(st_makepoint($1, $2), 4326) LIMIT 1',
+         ('float8', 'float8'))
+register('find_geomkey_in_domain', 'SELECT key FROM horizgeom '
+                                   'WHERE geom4326 ~= st_setsrid(st_makepoint($1, $2), 4326) AND domainkey=$3 LIMIT 1',
+         ('float8', 'float8', 'int'))
+
+# Observation inserts
+register('domain_geom_count', 'SELECT count(geom) FROM horizgeom WHERE domainkey=$1', ('int',))
+register('domain_origin_geomkey', 'SELECT key FROM horizgeom WHERE domainkey=$1 AND x=0 AND y=0', ('int',))
+register('geomkey_distance', 'SELECT st_distancesphere(geom4326, st_setsrid(st_makepoint($2, $3), 4326)) '
+                             'FROM horizgeom WHERE key=$1', ('int', 'float8', 'float8'))
+register('insert_horizgeom_point', 'INSERT INTO horizgeom(domainkey, x, y, geom) '
+                                   'VALUES ($1, $2, $3, st_setsrid(st_makepoint($4, $5), 4326)) RETURNING key',
+         ('int', 'int', 'int', 'float8', 'float8'))
+register('delete_geomkey_times', 'DELETE FROM {table} WHERE geomkey=$1 AND t>=$2 AND t<=$3',
+         ('int', 'timestamptz', 'timestamptz'))
+register('delete_geom_times', 'DELETE FROM {table} '
+                              'WHERE ST_Equals(geom, st_setsrid(st_makepoint($1, $2), 4326)) AND t>=$3 AND t<=$4',
+         ('float8', 'float8', 'timestamptz', 'timestamptz'))
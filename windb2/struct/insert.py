@@ -1,10 +1,17 @@
 import sys
-from windb2 import windb2
+from psycopg2 import sql as pgsql
+from windb2 import statements, windb2
+from windb2.insert import Insert
+from windb2.windb2 import find_geomkey
 from windb2.struct.winddata import WindData
 from windb2.struct.winddata3d import WindData3D
 import psycopg2
+import psycopg2.extras
 
-def insertWindData(windb2, dataName, dataCreator, windData, longitude=0, latitude=0):
+# Number of rows sent to the database in each multi-row INSERT
+INSERT_PAGE_SIZE = 1000
+
+def insertWindData(windb2, dataName, dataCreator, windData, longitude=0, latitude=0, page_size=INSERT_PAGE_SIZE):
     """Inserts a WindData (2D) or WindData3D list into the given database.
 
     windb2, WinDB2 instantiation
@@ -12,7 +19,8 @@ def insertWindData(windb2, dataName, dataCreator, windData, longitude=0, latitud
     dataCreator, string like 'NCAR'
     windData, list of WindData or WindData3D objects
     longitude, longitude of point, 0 by default
-    latitude, latitude of a point, 0 by default"""
+    latitude, latitude of a point, 0 by default
+    page_size, number of rows sent in each INSERT"""
 
     # Check to see if the data is 3D
     data3D = False
@@ -35,9 +43,9 @@ def insertWindData(windb2, dataName, dataCreator, windData, longitude=0, latitud
     if domainKey == None:
 
         # Insert the name into the domain table which returns the new key
-        sql = "INSERT INTO domain(name, resolution, units, datasource) VALUES ('" + dataName + "', 0, 'm', '" + dataCreator + "') RETURNING key"
+        sql = "INSERT INTO domain(name, resolution, units, datasource) VALUES (%s, 0, 'm', %s) RETURNING key"
         try:
-            windb2.curs.execute(sql)
+            windb2.curs.execute(sql, (dataName, dataCreator))
         except psycopg2.ProgrammingError as detail:
             print
             "Inserting a new domain domain failed. Exiting..."
@@ -79,25 +87,17 @@ def insertWindData(windb2, dataName, dataCreator, windData, longitude=0, latitud
             windb2.curs.execute(sql)
 
         # Add a 2D point for the made up location of the
-        sql = "INSERT INTO horizgeom(domainkey, x, y, geom) \
-               VALUES (" + str(domainKey) + ",0,0, st_geomfromtext('POINT(" + str(longitude) + ' ' + str(
-            latitude) + ")',4326)) RETURNING key"
-        print(sql)
-        windb2.curs.execute(sql)
-        geomKey = windb2.curs.fetchone()
+        statements.execute(windb2.curs, 'insert_horizgeom_point', (domainKey, 0, 0, float(longitude), float(latitude)))
+        geomKey = windb2.curs.fetchone()[0]
 
         # Commit all of these addtions
         windb2.conn.commit()
 
     # Otherwise, check to see if there already exists a geomkey with the same coordinates
-    elif longitude != 0 and latitude != 0 and moving is False:
+    elif longitude != 0 and latitude != 0:
 
         # Get the geomkey for the location
-        sql = "SELECT key FROM horizgeom \
-               WHERE st_distance_sphere(st_transform(geom, 4326), st_geomfromtext('POINT(" + str(longitude) + ' ' + str(latitude) + ")',4326)) = 0 AND \
-                     domainkey = " + str(domainKey) + " LIMIT 1"
-        windb2.curs.execute(sql)
-        geomKey = windb2.curs.fetchone()[0]
+        geomKey = find_geomkey(windb2.curs, longitude, latitude, domainKey)
 
     # Otherwise, this is an ideal domain and there is not geom
     else:
@@ -109,8 +109,8 @@ def insertWindData(windb2, dataName, dataCreator, windData, longitude=0, latitud
     if data3D:
         sql3D = [",w", ", %(w)s"]
     sql = "INSERT INTO wind_" + str(domainKey) + """(domainkey, geomkey, t, speed, direction, height""" + sql3D[
-        0] + """)
-           VALUES (%(domainkey)s, %(geomkey)s, %(t)s, %(speed)s, %(direction)s, %(height)s""" + sql3D[1] + ")"
+        0] + ") VALUES %s"
+    template = "(%(domainkey)s, %(geomkey)s, %(t)s, %(speed)s, %(direction)s, %(height)s" + sql3D[1] + ")"
     for data in windData:
 
         # Data to append
@@ -120,8 +120,12 @@ def insertWindData(windb2, dataName, dataCreator, windData, longitude=0, latitud
             dataToAppend['w'] = data.wSpeed
         execList.append(dataToAppend)
 
+    # Make sure there are partitions for the times if the table is partitioned
+    Insert(windb2).create_partitions('wind_{}'.format(domainKey), min(data.time for data in windData),
+                                     max(data.time for data in windData))
+
     try:
-        windb2.curs.executemany(sql, execList)
+        psycopg2.extras.execute_values(windb2.curs, sql, execList, template=template, page_size=page_size)
     except psycopg2.DataError as detail:
         print("DataError while inserting the large list wind speed: ", detail)
         "Exiting..."
@@ -130,7 +134,7 @@ def insertWindData(windb2, dataName, dataCreator, windData, longitude=0, latitud
     # Commit these changes
     windb2.conn.commit()
 
-def insertGeoVariable(windb2, dataName, dataCreator, dataToInsert, table_name_override=None, x=0, y=0, longitude=0, latitude=0, resolution=0, reinsert=False, moving=False):
+def insertGeoVariable(windb2, dataName, dataCreator, dataToInsert, table_name_override=None, x=0, y=0, longitude=0, latitude=0, resolution=0, reinsert=False, moving=False, page_size=INSERT_PAGE_SIZE):
     """Inserts a list of Variables into the given database.
 
     windb2, WinDB2 instantiation
@@ -139,7 +143,9 @@ def insertGeoVariable(windb2, dataName, dataCreator, dataToInsert, table_name_ov
     dataToInsert, list of struct.Variable objects
     table_name_override, name of table that overrides the default naming (useful for combined variables like wind = [speed, dir])
     longitude, longitude of point, 0 by default
-    latitude, latitude of a point, 0 by default"""
+    latitude, latitude of a point, 0 by default
+    reinsert, deletes the data between the first and last times at the point before inserting
+    page_size, number of rows sent in each INSERT"""
 
     # See if this domain data name already exists
     domainKey = windb2.findDomainForDataName(dataName)
@@ -153,10 +159,9 @@ def insertGeoVariable(windb2, dataName, dataCreator, dataToInsert, table_name_ov
     if domainKey is None:
 
         # Insert the name into the domain table which returns the new key
-        sql = "INSERT INTO domain(name, resolution, units, datasource) VALUES ('{}', '{}', '{}', '{}') RETURNING key"\
-            .format(dataName, resolution, dataToInsert[0].units, dataCreator)
+        sql = "INSERT INTO domain(name, resolution, units, datasource) VALUES (%s, %s, %s, %s) RETURNING key"
         try:
-            windb2.curs.execute(sql)
+            windb2.curs.execute(sql, (dataName, resolution, dataToInsert[0].units, dataCreator))
         except psycopg2.ProgrammingError as detail:
             print("Inserting a new domain domain failed. Exiting...")
             print(detail)
@@ -172,98 +177,40 @@ def insertGeoVariable(windb2, dataName, dataCreator, dataToInsert, table_name_ov
     elif longitude != 0 and latitude != 0 and moving is False:
 
         # Get the geomkey for the location
-        sql = "SELECT key FROM horizgeom \
-               WHERE st_distance_sphere(st_transform(geom, 4326), st_geomfromtext('POINT({} {})',4326))=0 AND \
-                     domainkey={} LIMIT 1".format(longitude, latitude, domainKey)
-        windb2.curs.execute(sql)
-        geomKey = windb2.curs.fetchone()
+        geomKey = find_geomkey(windb2.curs, longitude, latitude, domainKey)
 
     # Otherwise, this is an ideal domain and there is not geom
     else:
         geomKey = 0
 
-    # Set the table name, overriding it if necessary
+    # Set the table name, overriding it if necessary. It's folded to lower case like the unquoted names in the schema.
     if table_name_override is not None:
-        table_name = '{}_{}'.format(table_name_override, domainKey)
+        table_name = '{}_{}'.format(table_name_override, domainKey).lower()
     else:
-        table_name = '{}_{}'.format(dataToInsert[0].name, domainKey)
+        table_name = '{}_{}'.format(dataToInsert[0].name, domainKey).lower()
+    table = pgsql.Identifier(table_name)
 
     # Create a new geovariable table if it doesn't exist
-    sql = "SELECT to_regclass('public.{}');".format(table_name)
-    windb2.curs.execute(sql)
-    if not windb2.curs.fetchone()[0]:
-        sql = "CREATE TABLE {} () INHERITS(geovariable)".format(table_name)
-        try:
-            windb2.curs.execute(sql)
-        except Exception as detail:
-            print(detail)
-            sys.exit(-1)
-
-        # Add a geometry column to the geovariable table if a moving station and make the geomkey a serial column
-        if moving is True:
-            try:
-                seq_name = '{}_geomkey_seq'.format(table_name)
-                windb2.curs.execute("SELECT AddGeometryColumn('{}', 'geom', 4326, 'POINT', 2)".format(table_name))
-                windb2.curs.execute('CREATE SEQUENCE {}'.format(seq_name))
-                windb2.curs.execute("ALTER TABLE {} ALTER COLUMN geomkey SET DEFAULT nextval('{}')".format(table_name, seq_name))
-            except Exception as detail:
-                print(detail)
-                raise
-                sys.exit(-1)
-
-        # Add a column for the value
-        sql = "ALTER TABLE {} ADD COLUMN value real".format(table_name)
-        try:
-            windb2.curs.execute(sql)
-        except Exception as detail:
-            print(detail)
-            sys.exit(-1)
-
-        # Add in the unique constraint because this is not inherited from parent
-        if moving is False:
-            sql = "ALTER TABLE {} " \
-                  "ADD UNIQUE (domainkey, geomkey, t, height)"\
-                .format(table_name)
-            try:
-                windb2.curs.execute(sql)
-            except Exception as detail:
-                print(detail)
-        elif moving is True:
-            sql = "ALTER TABLE {} " \
-                  "ADD UNIQUE (domainkey, geom, t, height)"\
-                .format(table_name)
-            try:
-                windb2.curs.execute(sql)
-            except Exception as detail:
-                print(detail)
+    create_geovariable_table(windb2, table_name, moving)
 
     # Add a 2D point if necessary
     if moving is False:
-        sql = "SELECT key FROM horizgeom WHERE domainkey={} AND st_transform(geom,4326)=st_geomfromtext('POINT({} {})',4326)"\
-            .format(domainKey, longitude, latitude)
-        windb2.curs.execute(sql)
-        geomKey = windb2.curs.fetchone()
+        geomKey = find_geomkey(windb2.curs, longitude, latitude, domainKey)
         if geomKey is None:
-            sql = "INSERT INTO horizgeom(domainkey, x, y, geom) \
-                   VALUES ({},{},{}, st_geomfromtext('POINT({} {})',4326)) RETURNING key"\
-                .format(domainKey, x, y, longitude, latitude)
-            windb2.curs.execute(sql)
+            statements.execute(windb2.curs, 'insert_horizgeom_point',
+                               (domainKey, int(x), int(y), float(longitude), float(latitude)))
             geomKey = windb2.curs.fetchone()[0]
-        else:
-            geomKey = geomKey[0]
 
     # Insert all of the data
     execList = []
     t_min = None
     t_max = None
     if moving is False:
-        sql = """INSERT INTO {} (domainkey, geomkey, t, height, value)
-               VALUES (%(domainkey)s, %(geomkey)s, %(t)s, %(height)s, %(value)s)""" \
-            .format(table_name)
+        sql = pgsql.SQL("INSERT INTO {} (domainkey, geomkey, t, height, value) VALUES %s").format(table)
+        template = "(%(domainkey)s, %(geomkey)s, %(t)s, %(height)s, %(value)s)"
     elif moving is True:
-        sql = """INSERT INTO {} (domainkey, geom, t, height, value)
-               VALUES (%(domainkey)s, ST_GeomFromText(%(geom)s, 4326), %(t)s, %(height)s, %(value)s)""" \
-            .format(table_name)
+        sql = pgsql.SQL("INSERT INTO {} (domainkey, geom, t, height, value) VALUES %s").format(table)
+        template = "(%(domainkey)s, ST_GeomFromText(%(geom)s, 4326), %(t)s, %(height)s, %(value)s)"
     for data in dataToInsert:
 
         # Store the min and max dates for the reinsert functionality
@@ -285,6 +232,10 @@ def insertGeoVariable(windb2, dataName, dataCreator, dataToInsert, table_name_ov
             dataToAppend = {'domainkey': domainKey, 'geom': "POINT({} {})".format(longitude, latitude), 't': data.time, 'height': data.height, 'value': data.val}
         execList.append(dataToAppend)
 
+    # Make sure there are partitions for the times if the table is partitioned
+    Insert(windb2).create_partitions(table_name, min(data.time for data in dataToInsert),
+                                     max(data.time for data in dataToInsert))
+
     try:
 
         # Clean out the table before insert if reinsert is true
@@ -292,18 +243,14 @@ def insertGeoVariable(windb2, dataName, dataCreator, dataToInsert, table_name_ov
             print('DELETING all data between {} and {} from: {}_{}'
                   .format(t_min, t_max, table_name, geomKey))
             if moving is False:
-                sql = "DELETE FROM {} " \
-                      "WHERE geomkey={} AND t>=timestamp with time zone'{}' AND t<=timestamp with time zone'{}'"\
-                    .format(table_name, geomKey, t_min, t_max)
+                statements.execute(windb2.curs, 'delete_geomkey_times', (geomKey, t_min, t_max), table=table_name)
             elif moving is True:
-                sql = "DELETE FROM {} " \
-                      "WHERE ST_Equals(geom, ST_GeomFromText('POINT({} {})')) AND t>=timestamp with time zone'{}' AND t<=timestamp with time zone'{}'" \
-                    .format(table_name, longitude, latitude, geomKey, t_min, t_max)
-            print('Reinsert delete: {}'.format(sql))
-            windb2.curs.execute(sql)
+                statements.execute(windb2.curs, 'delete_geom_times', (float(longitude), float(latitude), t_min, t_max),
+                                   table=table_name)
+            print('Reinsert deleted {} rows'.format(windb2.curs.rowcount))
 
-        # Insert the list of geovariables
-        windb2.curs.executemany(sql, execList)
+        # Insert the list of geovariables page_size rows at a time
+        psycopg2.extras.execute_values(windb2.curs, sql, execList, template=template, page_size=page_size)
     except psycopg2.DataError as detail:
         print("DataError while inserting the large list wind speed: ", detail)
         "Exiting..."
@@ -312,3 +259,55 @@ def insertGeoVariable(windb2, dataName, dataCreator, dataToInsert, table_name_ov
     # Commit these changes
     windb2.conn.commit()
 
+
+def create_geovariable_table(windb2, table_name, moving=False):
+    """Creates a <var>_<domainkey> table with a value column that inherits from GeoVariable if it doesn't exist.
+
+    windb2, WinDB2 instantiation
+    table_name, lower case name of the table e.g. u50m_3
+    moving, the table is for a moving station, so each row has its own geom instead of a geomkey"""
+
+    table = pgsql.Identifier(table_name)
+    statements.execute(windb2.curs, 'table_exists', ('public.' + table_name,))
+    if not windb2.curs.fetchone()[0]:
+        sql = pgsql.SQL("CREATE TABLE {} () INHERITS(geovariable)").format(table)
+        try:
+            windb2.curs.execute(sql)
+        except Exception as detail:
+            print(detail)
+            sys.exit(-1)
+
+        # Add a geometry column to the geovariable table if a moving station and make the geomkey a serial column
+        if moving is True:
+            try:
+                seq_name = '{}_geomkey_seq'.format(table_name)
+                windb2.curs.execute("SELECT AddGeometryColumn(%s, 'geom', 4326, 'POINT', 2)", (table_name,))
+                windb2.curs.execute(pgsql.SQL('CREATE SEQUENCE {}').format(pgsql.Identifier(seq_name)))
+                windb2.curs.execute(pgsql.SQL("ALTER TABLE {} ALTER COLUMN geomkey SET DEFAULT nextval(%s)")
+                                    .format(table), (seq_name,))
+            except Exception as detail:
+                print(detail)
+                raise
+                sys.exit(-1)
+
+        # Add a column for the value
+        sql = pgsql.SQL("ALTER TABLE {} ADD COLUMN value real").format(table)
+        try:
+            windb2.curs.execute(sql)
+        except Exception as detail:
+            print(detail)
+            sys.exit(-1)
+
+        # Add in the unique constraint because this is not inherited from parent
+        if moving is False:
+            sql = pgsql.SQL("ALTER TABLE {} ADD UNIQUE (domainkey, geomkey, t, height)").format(table)
+            try:
+                windb2.curs.execute(sql)
+            except Exception as detail:
+                print(detail)
+        elif moving is True:
+            sql = pgsql.SQL("ALTER TABLE {} ADD UNIQUE (domainkey, geom, t, height)").format(table)
+            try:
+                windb2.curs.execute(sql)
+            except Exception as detail:
+                print(detail)
@@ -0,0 +1,58 @@
+import unittest
+from datetime import datetime, timedelta
+import pytz
+from windb2 import windb2
+from windb2.insert import Insert
+from windb2.struct import insert
+from windb2.struct.geovariable import GeoVariable
+
+
+class TestInsertGeoVariable(unittest.TestCase):
+
+    def setUp(self):
+        self.db = windb2.WinDB2('localhost', 'windb2-test-1', dbUser='postgres')
+        self.db.connect()
+
+    def tearDown(self):
+        self.db.conn.rollback()
+        self.db.curs.execute("SELECT key FROM domain WHERE name='struct-insert-test'")
+        for key, in self.db.curs.fetchall():
+            self.db.curs.execute('DROP TABLE IF EXISTS testvar_{}'.format(key))
+            self.db.curs.execute("DELETE FROM GeoVariablePartition WHERE tablename='testvar_{}'".format(key))
+            self.db.curs.execute('DELETE FROM horizgeom WHERE domainkey=%s', (key,))
+            self.db.curs.execute('DELETE FROM domain WHERE key=%s', (key,))
+        self.db.conn.commit()
+        self.db.close()
+
+    def insert(self, value, reinsert=False, t0=datetime(2016, 2, 14, tzinfo=pytz.utc)):
+        data = [GeoVariable('testvar', t0 + timedelta(hours=h), 10, value, 'm/s') for h in range(25)]
+        insert.insertGeoVariable(self.db, 'struct-insert-test', 'test', data, longitude=-122.5, latitude=37.5,
+                                 reinsert=reinsert, page_size=10)
+
+    def test_pages_and_reinsert(self):
+        # Rows are sent over more than one page
+        self.insert(1)
+        domain = self.db.findDomainForDataName('struct-insert-test')
+        self.db.curs.execute('SELECT count(*), min(value), max(value) FROM testvar_{}'.format(domain))
+        self.assertEqual(self.db.curs.fetchone(), (25, 1, 1))
+
+        # Reinserting replaces the rows in the time range
+        self.insert(2, reinsert=True)
+        self.db.curs.execute('SELECT count(*), min(value), max(value) FROM testvar_{}'.format(domain))
+        self.assertEqual(self.db.curs.fetchone(), (25, 2, 2))
+
+    def test_partitioned(self):
+        # Partitions are made for times past the ones converted
+        self.insert(1)
+        domain = self.db.findDomainForDataName('struct-insert-test')
+        Insert(self.db).partition_table('testvar_{}'.format(domain), 'month')
+        self.insert(2, t0=datetime(2016, 5, 31, 12, tzinfo=pytz.utc))
+        self.db.curs.execute('SELECT tableoid::regclass::text, count(*) FROM testvar_{} GROUP BY 1 ORDER BY 1'
+                             .format(domain))
+        self.assertEqual(self.db.curs.fetchall(), [('testvar_{}_2016_02'.format(domain), 25),
+                                                   ('testvar_{}_2016_05'.format(domain), 12),
+                                                   ('testvar_{}_2016_06'.format(domain), 13)])
+
+
+if __name__ == '__main__':
+    unittest.main()
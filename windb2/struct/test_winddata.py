@@ -0,0 +1,36 @@
+import unittest
+import numpy
+from windb2.struct.winddata import calcDirDeg
+
+
+class TestWindData(unittest.TestCase):
+
+    def testCalcDirDeg(self):
+
+        # Wind coming from each quadrant and along each axis
+        self.assertEqual(calcDirDeg(-3, -3), 45)
+        self.assertEqual(calcDirDeg(-3, 3), 135)
+        self.assertEqual(calcDirDeg(3, 3), 225)
+        self.assertEqual(calcDirDeg(3, -3), 315)
+        self.assertEqual(calcDirDeg(0, -3), 0)
+        self.assertEqual(calcDirDeg(0, 0), 180)
+
+        # Arrays match the scalar version exactly, including the rounding of halves and the axes
+        rng = numpy.random.RandomState(0)
+        u = numpy.concatenate((rng.standard_normal(1000) * 8, [0, 0, 0, 3, -3, -0., 1, -1]))
+        v = numpy.concatenate((rng.standard_normal(1000) * 8, [0, 3, -3, 0, 0, 0, numpy.tan(numpy.radians(0.5)),
+                                                              -numpy.tan(numpy.radians(1.5))]))
+        expected = [calcDirDeg(ui, vi) for ui, vi in zip(u.tolist(), v.tolist())]
+        numpy.testing.assert_array_equal(calcDirDeg(u, v), expected)
+
+        # Any shape and an output buffer
+        out = numpy.empty((2, 2), numpy.int16)
+        self.assertIs(calcDirDeg([[-3, 3], [0, 0]], [[-3, 3], [-3, 3]], out=out), out)
+        numpy.testing.assert_array_equal(out, [[45, 225], [0, 180]])
+
+        with self.assertRaises(ValueError):
+            calcDirDeg(numpy.array([1., numpy.nan]), numpy.array([1., 1.]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,7 @@
 from windb2.struct.flowdata import FlowData
 import math
+import numpy
+from windb2.util import ARRAY_TYPES
 
 
 class WindData(FlowData):
@@ -47,14 +49,18 @@ class WindData(FlowData):
         return FlowData(self.time, 0, math.sqrt(math.pow(uDiff, 2) + math.pow(vDiff, 2)), calcDirDeg(uDiff, vDiff))
 
 
-def calcDirDeg(uWind, vWind):
+def calcDirDeg(uWind, vWind, out=None):
     """Calculates the direction THAT THE WIND IS BLOWING FROM (not the vector direction).
      *
-     * uWind U wind scalar velocity.
-     * vWind V wind scalar velocity.
-     * Returns he direction that the wind is blowing from.
+     * uWind U wind scalar velocity or numpy.array of velocities.
+     * vWind V wind scalar velocity or numpy.array of velocities, which is broadcast against uWind.
+     * out Optional numpy.array of the broadcast shape to write the directions into.
+     * Returns he direction that the wind is blowing from. An int for scalars, otherwise an int64 numpy.array (or out).
     """
 
+    if out is not None or isinstance(uWind, ARRAY_TYPES) or isinstance(vWind, ARRAY_TYPES):
+        return _calcDirDegArray(uWind, vWind, out)
+
     # Calculate the direction and round it into a integer
     try:
         directionDouble = math.degrees(math.atan(math.fabs(vWind / uWind)))
@@ -101,3 +107,29 @@ def calcDirDeg(uWind, vWind):
         raise ValueError("You cannot have a wind direction >= 360 here: " + directionInt + " degrees is invalid.")
 
     return directionInt
+
+
+def _calcDirDegArray(uWind, vWind, out=None):
+    """calcDirDeg for numpy.arrays, with the same rounding and quadrants as the scalar version."""
+
+    uWind = numpy.asarray(uWind)
+    vWind = numpy.asarray(vWind)
+    if numpy.isnan(uWind).any() or numpy.isnan(vWind).any():
+        raise ValueError("You cannot calculate a wind direction from NaN wind components.")
+
+    # Angle from the x-axis rounded half to even like round(), the zero division cases are replaced below
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        directionInt = numpy.round(numpy.degrees(numpy.arctan(numpy.fabs(vWind / uWind), dtype=numpy.float64)))
+
+    # NE and SE quadrants, then SW and NW quadrants, then the division by zero case
+    direction = numpy.where(vWind >= 0, 90 - directionInt, 90 + directionInt)
+    direction = numpy.where(uWind < 0, numpy.where(vWind <= 0, 270 - directionInt, 270 + directionInt), direction)
+    direction = numpy.where(uWind == 0.0, numpy.where(vWind >= 0, 0, 180), direction)
+
+    # SWITCH FOR METEOROLOGICAL WIND DIRECTION INSTEAD OF THE VECTOR DIRECTION
+    direction = (direction.astype(numpy.int64) + 180) % 360
+
+    if out is None:
+        return direction
+    out[...] = direction
+    return out
@@ -0,0 +1,72 @@
+import gzip
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+import pytz
+from windb2 import export
+
+
+class FakeCopyCursor(object):
+    """Stands in for a psycopg2 cursor, writing the COPY statement out as the data."""
+
+    def __init__(self):
+        self.connection = self
+        self.encoding = 'UTF8'
+        self.copies = []
+
+    def mogrify(self, sql, params):
+        return (sql % tuple(repr(param) for param in params)).encode()
+
+    def copy_expert(self, sql, fileobj, size=None):
+        self.copies.append(sql)
+        fileobj.write(sql.encode())
+
+
+class TestExport(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.curs = FakeCopyCursor()
+        self.t0 = datetime(2016, 1, 1, tzinfo=pytz.utc)
+        self.t1 = datetime(2017, 1, 1, tzinfo=pytz.utc)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testCopyTo(self):
+        out = io.BytesIO()
+        export.copy_to(self.curs, 'SELECT 1', out)
+        self.assertEqual(out.getvalue(), b'COPY (SELECT 1) TO STDOUT WITH (FORMAT csv, HEADER)')
+
+        # Compressed binary to a file
+        filename = os.path.join(self.dir, 'out.bin.gz')
+        export.copy_to(self.curs, 'SELECT 1', filename, export_format='binary', compress=True)
+        with gzip.open(filename) as f:
+            self.assertEqual(f.read(), b'COPY (SELECT 1) TO STDOUT WITH (FORMAT binary)')
+
+        with self.assertRaises(TypeError):
+            export.copy_to(self.curs, 'SELECT 1', out, export_format='xlsx')
+
+    def testExportTimeseries(self):
+        # Every location and height in one COPY
+        out = io.BytesIO()
+        self.assertEqual(export.export_timeseries(self.curs, 2, [10, 11], [10, 80], self.t0, self.t1, out), [out])
+        self.assertEqual(len(self.curs.copies), 1)
+        self.assertIn('SELECT geomkey, height, t, speed, direction FROM wind_2 WHERE geomkey=ANY([10, 11]) AND '
+                      'height=ANY([10, 80])', self.curs.copies[0])
+        self.assertIn('ORDER BY geomkey, height, t', self.curs.copies[0])
+
+        # A file for each location and height
+        template = os.path.join(self.dir, 'wind-{geomkey}-{height}m.csv')
+        filenames = export.export_timeseries(self.curs, 2, [10, 11], [10, 80], self.t0, self.t1, template,
+                                             columns=('t', 'speed'))
+        self.assertEqual(filenames, [template.format(geomkey=g, height=h) for g in (10, 11) for h in (10, 80)])
+        with open(filenames[-1]) as f:
+            self.assertIn('geomkey=ANY([11]) AND height=ANY([80])', f.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,423 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+from datetime import datetime
+import numpy
+import psycopg2
+import psycopg2.errorcodes
+import pytz
+from windb2 import insert, windb2 as windb2_module
+
+
+class TestCopyStream(unittest.TestCase):
+
+    def testRead(self):
+        rows = ('{}, {}\n'.format(i, i * 2) for i in range(1000))
+        stream = insert.CopyStream(rows, chunk_size=100)
+        chunks = []
+        chunk = stream.read()
+        while chunk:
+            self.assertLessEqual(len(chunk), 100)
+            chunks.append(chunk)
+            chunk = stream.read()
+        self.assertEqual(''.join(chunks), ''.join('{}, {}\n'.format(i, i * 2) for i in range(1000)))
+        self.assertEqual(stream.count, 1000)
+
+    def testBuffersAndReadline(self):
+        stream = insert.CopyStream('1, 2\n3, 4\n')
+        self.assertEqual(stream.readline(), '1, 2\n')
+        self.assertEqual(stream.read(3), '3, ')
+        self.assertEqual(stream.readline(), '4\n')
+        self.assertEqual(stream.read(), '')
+
+        stream = insert.CopyStream((b'1, 2\n', b'3, 4\n'))
+        self.assertEqual(stream.readline(), b'1, 2\n')
+        self.assertEqual(stream.read(), b'3, 4\n')
+        self.assertEqual(stream.read(), b'')
+
+
+class TestPgcopyBinary(unittest.TestCase):
+
+    def testEncode(self):
+        t = datetime(2000, 1, 2, tzinfo=pytz.utc)
+        data = insert.pgcopy_binary((3, numpy.array([7, 8]), t, numpy.array([1.5, numpy.nan]),
+                                     numpy.array([359, 0]), numpy.float32(10)),
+                                    ('int', 'int', 'timestamptz', 'real', 'smallint', 'real'))
+
+        # Header and trailer
+        self.assertTrue(data.startswith(b'PGCOPY\n\xff\r\n\x00' + b'\x00' * 8))
+        self.assertTrue(data.endswith(b'\xff\xff'))
+
+        # Each tuple is the field count followed by the length and value of each field
+        row = struct.Struct('>h iiii iq if ih if')
+        body = data[len(insert.PGCOPY_HEADER):-2]
+        self.assertEqual(len(body), 2 * row.size)
+        first = row.unpack(body[:row.size])
+        self.assertEqual(first, (6, 4, 3, 4, 7, 8, 86400 * 10**6, 4, 1.5, 2, 359, 4, 10.0))
+        self.assertTrue(numpy.isnan(row.unpack(body[row.size:])[8]))
+
+    def testTimestampsAndBlocks(self):
+        times = numpy.array(['1999-12-31T23:59:59', '2000-01-01T00:00:01'], dtype='datetime64[s]')
+        data = insert.pgcopy_binary((times,), ('timestamptz',), header=False, trailer=False)
+        self.assertEqual(struct.unpack('>hiqhiq', data), (1, 8, -10**6, 1, 8, 10**6))
+
+        # Naive datetimes are UTC
+        self.assertEqual(insert.pgcopy_binary((datetime(2000, 1, 1),), ('timestamptz',), header=False, trailer=False),
+                         struct.pack('>hiq', 1, 8, 0))
+
+        with self.assertRaises(TypeError):
+            insert.pgcopy_binary((1,), ('text',))
+        with self.assertRaises(ValueError):
+            insert.pgcopy_binary((1, 2), ('int',))
+
+
+class FakeHorizGeom(object):
+    """Stands in for a WinDB2 connection with a horizgeom table, counting the queries made."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+        self.conn = self
+        self.curs = self
+        self.dsn = 'dbname=fake-{}'.format(id(self))
+
+    def execute(self, sql):
+        self.queries.append(sql)
+
+    def fetchone(self):
+        return len(self.rows), 'checksum{}'.format(len(self.rows))
+
+    def fetchall(self):
+        return self.rows
+
+
+class TestGeomKeyCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        insert.clear_geomkey_cache()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        insert.clear_geomkey_cache()
+
+    def testMemoryCache(self):
+        windb2 = FakeHorizGeom([(0, 0, 11), (2, 1, 13), (1, 2, 12)])
+        keys = insert.Insert(windb2).calculateHorizWindGeomKeys(1, 3, 3)
+        numpy.testing.assert_array_equal(keys, [[11, 0, 0], [0, 0, 12], [0, 13, 0]])
+        self.assertFalse(keys.flags.writeable)
+
+        # A second inserter on the same database doesn't query again
+        self.assertIs(insert.Insert(windb2).calculateHorizWindGeomKeys(1, 3, 3), keys)
+        self.assertEqual(len(windb2.queries), 1)
+
+        # Only the most recently used domains are kept
+        for domain_key in range(2, insert.GEOMKEY_CACHE_SIZE + 2):
+            insert.Insert(windb2).calculateHorizWindGeomKeys(domain_key, 3, 3)
+        insert.Insert(windb2).calculateHorizWindGeomKeys(1, 3, 3)
+        self.assertEqual(len(windb2.queries), insert.GEOMKEY_CACHE_SIZE + 2)
+
+    def testDiskCache(self):
+        windb2 = FakeHorizGeom([(0, 0, 11), (1, 1, 12)])
+        inserter = insert.Insert(windb2)
+        inserter.geomkey_cache_dir = os.path.join(self.dir, 'geomkeys')
+        keys = inserter.calculateHorizWindGeomKeys(1, 2, 2)
+        self.assertEqual(os.listdir(inserter.geomkey_cache_dir), ['geomkeys_1_2x2_2_checksum2.npy'])
+
+        # The next run only checks the checksum
+        insert.clear_geomkey_cache()
+        windb2.queries = []
+        numpy.testing.assert_array_equal(inserter.calculateHorizWindGeomKeys(1, 2, 2), keys)
+        self.assertEqual(len(windb2.queries), 1)
+
+        # A changed horizgeom is queried again
+        insert.clear_geomkey_cache()
+        windb2.rows.append((1, 0, 13))
+        self.assertEqual(inserter.calculateHorizWindGeomKeys(1, 2, 2)[1, 0], 13)
+        self.assertEqual(len(windb2.queries), 3)
+
+
+class FakeIndexedTable(object):
+    """Stands in for a WinDB2 connection with one indexed table, recording the SQL run and the autocommit setting."""
+
+    def __init__(self, indexes):
+        self.indexes = indexes
+        self.queries = []
+        self.autocommit = False
+        self.rowcount = 3
+        self.conn = self
+        self.curs = self
+
+    def execute(self, sql, params=None):
+        self.queries.append((sql, self.autocommit))
+
+    def fetchall(self):
+        return self.indexes
+
+    def fetchone(self):
+        # Not a partitioned table
+        return False,
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class TestBulkLoad(unittest.TestCase):
+
+    def testDropAndRebuild(self):
+        windb2 = FakeIndexedTable([
+            ('wind_1_domainkey_geomkey_t_height_init_key',
+             'CREATE UNIQUE INDEX wind_1_domainkey_geomkey_t_height_init_key ON public.wind_1 USING btree '
+             '(domainkey, geomkey, t, height, init)', True, ['domainkey', 'geomkey', 't', 'height', 'init']),
+            ('wind_geomkey_1', 'CREATE INDEX wind_geomkey_1 ON public.wind_1 USING btree (geomkey)', False,
+             ['geomkey'])])
+        inserter = insert.Insert(windb2)
+
+        with inserter.bulk_load(['wind_1']) as dropped:
+            self.assertEqual(dropped['wind_1'][1].name, 'wind_geomkey_1')
+            self.assertEqual([sql for sql, _ in windb2.queries[1:]],
+                             ['ALTER TABLE wind_1 DROP CONSTRAINT wind_1_domainkey_geomkey_t_height_init_key',
+                              'DROP INDEX wind_geomkey_1'])
+            windb2.queries = []
+
+        # Duplicates over the unique columns are removed in a transaction before the indexes are rebuilt concurrently
+        self.assertIn('to_regclass', windb2.queries.pop(0)[0])
+        self.assertIn('PARTITION BY domainkey, geomkey, t, height, init', windb2.queries[0][0])
+        self.assertFalse(windb2.queries[0][1])
+        self.assertEqual(windb2.queries[1:], [
+            ('CREATE UNIQUE INDEX CONCURRENTLY wind_1_domainkey_geomkey_t_height_init_key ON public.wind_1 USING btree '
+             '(domainkey, geomkey, t, height, init)', True),
+            ('ALTER TABLE wind_1 ADD CONSTRAINT wind_1_domainkey_geomkey_t_height_init_key UNIQUE USING INDEX '
+             'wind_1_domainkey_geomkey_t_height_init_key', True),
+            ('CREATE INDEX CONCURRENTLY wind_geomkey_1 ON public.wind_1 USING btree (geomkey)', True),
+            ('ANALYZE wind_1', True)])
+        self.assertFalse(windb2.autocommit)
+
+    def testRebuildAfterFailure(self):
+        windb2 = FakeIndexedTable([('wind_geomkey_1', 'CREATE INDEX wind_geomkey_1 ON public.wind_1 (geomkey)', False,
+                                    ['geomkey'])])
+        with self.assertRaises(IOError):
+            with insert.Insert(windb2).bulk_load(['wind_1'], concurrently=False):
+                raise IOError
+        self.assertIn(('CREATE INDEX wind_geomkey_1 ON public.wind_1 (geomkey)', False), windb2.queries)
+
+    def testCommitAndRebuildFailure(self):
+        # The work in the block is committed rather than rolled back when it finishes
+        windb2 = FakeIndexedTable([])
+        windb2.events = []
+        windb2.commit = lambda: windb2.events.append('commit')
+        windb2.rollback = lambda: windb2.events.append('rollback')
+        with insert.Insert(windb2).bulk_load(['wind_1']):
+            windb2.events = []
+        self.assertEqual(windb2.events, ['commit', 'commit'])
+
+        # A failed rebuild doesn't hide why the load failed
+        windb2 = FakeIndexedTable([('wind_geomkey_1', 'CREATE INDEX wind_geomkey_1 ON public.wind_1 (geomkey)', False,
+                                    ['geomkey'])])
+        inserter = insert.Insert(windb2)
+        inserter.rebuild_indexes = lambda *args: 1 / 0
+        with self.assertLogs('windb2', 'ERROR'):
+            with self.assertRaises(IOError):
+                with inserter.bulk_load(['wind_1']):
+                    raise IOError
+
+
+class FakePgError(psycopg2.ProgrammingError):
+    """A psycopg2 error with an SQLSTATE, which psycopg2 otherwise only sets on errors from the server."""
+
+    def __init__(self, pgcode):
+        super(FakePgError, self).__init__(pgcode)
+        self._pgcode = pgcode
+
+    @property
+    def pgcode(self):
+        return self._pgcode
+
+
+class FakeMonthlyTable(object):
+    """Stands in for a WinDB2 connection with a table partitioned by month that's missing a partition, which can be
+    created by another connection while this one tries to create it."""
+
+    def __init__(self, race, fail=True, mask=None):
+        self.race = race
+        self.fail = fail
+        self.mask = mask
+        self.created = False
+        self.queries = []
+        self.conn = self
+        self.curs = self
+        self.connection = self
+
+    def execute(self, sql, params=None):
+        # Only tell the prepared statements apart
+        if not isinstance(sql, str):
+            sql = 'EXECUTE' if 'EXECUTE' in repr(sql) else 'PREPARE'
+        self.queries.append(sql)
+        if sql.startswith('CREATE TABLE') and self.fail:
+            self.created = self.race
+            raise FakePgError(psycopg2.errorcodes.DUPLICATE_TABLE)
+
+    def fetchone(self):
+        if self.queries[-1].startswith('SELECT period'):
+            return 'month',
+        if self.queries[-1].startswith('SELECT mask'):
+            return self.mask,
+        if self.queries[-1] == 'EXECUTE':
+            return self.created,
+        return True,
+
+    def commit(self):
+        pass
+
+
+class TestPartitions(unittest.TestCase):
+
+    def testBounds(self):
+        utc = pytz.utc
+        bounds = insert.partition_bounds('month', datetime(2015, 11, 30, 23, tzinfo=utc), datetime(2016, 1, 1))
+        self.assertEqual(bounds, [(datetime(2015, 11, 1, tzinfo=utc), datetime(2015, 12, 1, tzinfo=utc)),
+                                  (datetime(2015, 12, 1, tzinfo=utc), datetime(2016, 1, 1, tzinfo=utc)),
+                                  (datetime(2016, 1, 1, tzinfo=utc), datetime(2016, 2, 1, tzinfo=utc))])
+        self.assertEqual(insert.partition_name('wind_1', 'month', bounds[0][0]), 'wind_1_2015_11')
+
+        # Times in other zones are partitioned in UTC
+        pacific = pytz.timezone('America/Los_Angeles')
+        t = pacific.localize(datetime(2016, 12, 31, 20))
+        self.assertEqual(insert.partition_bounds('year', t, t),
+                         [(datetime(2017, 1, 1, tzinfo=utc), datetime(2018, 1, 1, tzinfo=utc))])
+        self.assertEqual(insert.partition_name('wind_1', 'year', datetime(2017, 1, 1)), 'wind_1_2017')
+
+        with self.assertRaises(TypeError):
+            insert.partition_bounds('week', t, t)
+
+    def testCreateRace(self):
+        # Another worker creates the partition between the check and the CREATE
+        windb2 = FakeMonthlyTable(race=True)
+        self.assertEqual(insert.Insert(windb2).create_partitions('wind_1', datetime(2016, 2, 14, tzinfo=pytz.utc)), [])
+        self.assertEqual(windb2.queries[-2:], ['ROLLBACK TO SAVEPOINT create_partition', 'EXECUTE'])
+
+        # A CREATE that fails for any other reason still raises
+        windb2 = FakeMonthlyTable(race=False)
+        with self.assertRaises(FakePgError):
+            insert.Insert(windb2).create_partitions('wind_1', datetime(2016, 2, 14, tzinfo=pytz.utc))
+
+    def testMaskTrigger(self):
+        # PostgreSQL 11 can't put the mask trigger on the partitioned table, only on its partitions
+        windb2 = FakeMonthlyTable(race=False, fail=False, mask='coast')
+        insert.Insert(windb2).create_new_table(1, 'wind', ['speed'], ['real'], partition='month')
+        self.assertFalse([sql for sql in windb2.queries if sql.startswith('CREATE TRIGGER')])
+
+        windb2.queries = []
+        self.assertEqual(insert.Insert(windb2).create_partitions('wind_1', datetime(2016, 2, 14, tzinfo=pytz.utc)),
+                         ['wind_1_2016_02'])
+        self.assertEqual([sql for sql in windb2.queries if sql.startswith('CREATE TRIGGER')],
+                         ['CREATE TRIGGER wind_geomkey_mask_domain_1 BEFORE INSERT ON wind_1_2016_02 FOR EACH ROW '
+                          'EXECUTE PROCEDURE geomkey_in_coast_domain_1()'])
+
+    def testEmptyWindData(self):
+        windb2 = FakeMonthlyTable(race=False)
+        windb2.findDomainForDataName = lambda data_name: 1
+        insert.Insert(windb2).insert_wind_data('buoy', 'NDBC', [])
+        self.assertEqual(windb2.queries, [])
+
+
+class TestPartitionedDuplicates(unittest.TestCase):
+
+    def setUp(self):
+        self.db = windb2_module.WinDB2('localhost', 'windb2-test-1', dbUser='postgres')
+        self.db.connect()
+
+    def tearDown(self):
+        self.db.conn.rollback()
+        self.db.close()
+
+    def testRemoveDuplicates(self):
+        # The first row of each partition has the same ctid
+        curs = self.db.curs
+        curs.execute('CREATE TEMP TABLE dup_test (geomkey int, t timestamptz, value real) PARTITION BY RANGE (t)')
+        curs.execute("CREATE TEMP TABLE dup_test_2016_01 PARTITION OF dup_test "
+                     "FOR VALUES FROM ('2016-01-01Z') TO ('2016-02-01Z')")
+        curs.execute("CREATE TEMP TABLE dup_test_2016_02 PARTITION OF dup_test "
+                     "FOR VALUES FROM ('2016-02-01Z') TO ('2016-03-01Z')")
+        curs.execute("INSERT INTO dup_test VALUES (1, '2016-02-14Z', 1)")
+        curs.execute("INSERT INTO dup_test VALUES (1, '2016-01-14Z', 1), (2, '2016-01-14Z', 1)")
+        curs.execute("INSERT INTO dup_test VALUES (1, '2016-01-14Z', 2)")
+
+        removed = insert.Insert(self.db).remove_duplicates('dup_test', ('geomkey', 't'))
+        self.assertEqual(removed, 1)
+        curs.execute('SELECT geomkey, t, value FROM dup_test ORDER BY t, geomkey')
+        self.assertEqual([(row[0], row[1].month, row[2]) for row in curs.fetchall()],
+                         [(1, 1, 2), (2, 1, 1), (1, 2, 1)])
+
+
+class FakeForecastTable(object):
+    """Stands in for a WinDB2 connection with one forecast table, recording the SQL run."""
+
+    def __init__(self, times, superseded):
+        self.times = times
+        self.superseded = superseded
+        self.queries = []
+        self.commits = 0
+        self.rowcount = 0
+        self.conn = self
+        self.curs = self
+
+    def execute(self, sql, params=None):
+        self.queries.append((sql, params))
+        self.rowcount = 10 if sql.startswith('DELETE') else 0
+
+    def fetchall(self):
+        return self.times if self.queries[-1][0].startswith('SELECT DISTINCT t ') else self.superseded
+
+    def fetchone(self):
+        # Not a partitioned table
+        return False,
+
+    def commit(self):
+        self.commits += 1
+
+
+class TestForecastRetention(unittest.TestCase):
+
+    def testPrune(self):
+        utc = pytz.utc
+        times = [(datetime(2020, 6, 1, h, tzinfo=utc),) for h in range(3)]
+        superseded = [(datetime(2020, 6, 2, h, tzinfo=utc), datetime(2020, 6, 1, tzinfo=utc)) for h in range(5)]
+        windb2 = FakeForecastTable(times, superseded)
+        deleted = insert.Insert(windb2).prune_forecasts('eastward_wind_1', keep=2, before=datetime(2020, 6, 2),
+                                                        batch_size=2)
+
+        # Old valid times then superseded forecasts, a batch per transaction
+        queries = [(sql, params) for sql, params in windb2.queries if 'to_regclass' not in sql]
+        self.assertEqual(queries[0][1], (datetime(2020, 6, 2, tzinfo=utc),))
+        self.assertEqual([params for sql, params in queries[1:3]], [([times[0][0], times[1][0]],), ([times[2][0]],)])
+        self.assertIn('PARTITION BY t ORDER BY init DESC', queries[3][0])
+        self.assertEqual(queries[3][1], (2,))
+        self.assertEqual([len(params[0]) for sql, params in queries[4:]], [2, 2, 1])
+        self.assertEqual(queries[4][1], ([superseded[0][0], superseded[1][0]], [superseded[0][1], superseded[1][1]]))
+        self.assertEqual(deleted, 50)
+        self.assertEqual(windb2.commits, 5)
+
+        with self.assertRaises(ValueError):
+            insert.Insert(windb2).prune_forecasts('eastward_wind_1', keep=0)
+
+    def testLatestView(self):
+        windb2 = FakeForecastTable([], [])
+        inserter = insert.Insert(windb2)
+        self.assertEqual(inserter.create_latest_forecast_view('Eastward_Wind_1'), 'eastward_wind_1_latest')
+        inserter.refresh_latest_forecast_view('eastward_wind_1')
+        self.assertEqual([sql for sql, _ in windb2.queries], [
+            'CREATE MATERIALIZED VIEW IF NOT EXISTS eastward_wind_1_latest AS SELECT DISTINCT ON (domainkey, geomkey, '
+            't, height) * FROM Eastward_Wind_1 ORDER BY domainkey, geomkey, t, height, init DESC NULLS LAST',
+            'CREATE UNIQUE INDEX IF NOT EXISTS eastward_wind_1_latest_key ON eastward_wind_1_latest (domainkey, '
+            'geomkey, t, height)',
+            'REFRESH MATERIALIZED VIEW CONCURRENTLY eastward_wind_1_latest'])
+
+
+if __name__ == '__main__':
+    unittest.main()
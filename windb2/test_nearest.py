@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+from windb2 import nearest
+
+
+def haversine(longitude0, latitude0, longitude1, latitude1):
+    longitude0, latitude0, longitude1, latitude1 = map(numpy.radians, (longitude0, latitude0, longitude1, latitude1))
+    a = numpy.sin((latitude1 - latitude0) / 2) ** 2 + \
+        numpy.cos(latitude0) * numpy.cos(latitude1) * numpy.sin((longitude1 - longitude0) / 2) ** 2
+    return 2 * nearest.EARTH_RADIUS_M * numpy.arcsin(numpy.sqrt(a))
+
+
+class TestGeomKeyTree(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+        # Irregular grid across the antimeridian like a Lambert conformal WRF domain
+        rng = numpy.random.RandomState(0)
+        longitudes, latitudes = numpy.meshgrid(numpy.arange(170., 190., 0.5), numpy.arange(30., 50., 0.5))
+        self.longitudes = ((longitudes + rng.uniform(-0.1, 0.1, longitudes.shape) + 180) % 360 - 180).ravel()
+        self.latitudes = (latitudes + rng.uniform(-0.1, 0.1, latitudes.shape)).ravel()
+        self.geomkeys = numpy.arange(1000, 1000 + self.longitudes.size)
+        self.tree = nearest.GeomKeyTree(self.geomkeys, self.longitudes, self.latitudes)
+
+        self.query_longitudes = rng.uniform(-180, 180, 200)
+        self.query_latitudes = rng.uniform(25, 55, 200)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testMatchesBruteForce(self):
+        geomkeys, distances = self.tree.query(self.query_longitudes, self.query_latitudes)
+        all_distances = haversine(self.query_longitudes[:, None], self.query_latitudes[:, None],
+                                  self.longitudes[None, :], self.latitudes[None, :])
+        numpy.testing.assert_array_equal(geomkeys, self.geomkeys[all_distances.argmin(axis=1)])
+        numpy.testing.assert_allclose(distances, all_distances.min(axis=1), rtol=1e-9)
+
+    def testMaxDistance(self):
+        geomkeys, distances = self.tree.query(self.query_longitudes, self.query_latitudes, max_distance=50000)
+        too_far = haversine(self.query_longitudes[:, None], self.query_latitudes[:, None], self.longitudes[None, :],
+                            self.latitudes[None, :]).min(axis=1) > 50000
+        self.assertTrue(too_far.any() and not too_far.all())
+        numpy.testing.assert_array_equal(geomkeys == 0, too_far)
+        numpy.testing.assert_array_equal(numpy.isnan(distances), too_far)
+
+    def testSaveLoad(self):
+        filename = os.path.join(self.dir, 'geomkeys.npz')
+        self.tree.save(filename)
+        tree = nearest.GeomKeyTree.load(filename)
+        for expected, actual in zip(self.tree.query(self.query_longitudes, self.query_latitudes),
+                                    tree.query(self.query_longitudes, self.query_latitudes)):
+            numpy.testing.assert_array_equal(actual, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+from psycopg2 import sql
+from windb2 import statements, windb2
+
+
+def flatten(query):
+    """Returns the text of a psycopg2.sql query without needing a connection to quote it."""
+
+    if isinstance(query, sql.Composed):
+        return ''.join(flatten(q) for q in query.seq)
+    if isinstance(query, sql.Identifier):
+        return '.'.join('"{}"'.format(s) for s in query.strings)
+    if isinstance(query, sql.Placeholder):
+        return '%s'
+    return query.string
+
+
+class FakeCursor(object):
+    """Stands in for a psycopg2 cursor, recording the SQL run."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.queries = []
+
+    def execute(self, query, params=None):
+        self.queries.append((flatten(query), params))
+
+
+class FakeConnection(object):
+    pass
+
+
+class TestStatements(unittest.TestCase):
+
+    def test_prepare_once(self):
+        conn = FakeConnection()
+        curs = FakeCursor(conn)
+        for i in range(3):
+            statements.execute(curs, 'find_geomkey_in_domain', (-122.5, 37.5, i))
+        self.assertEqual(curs.queries[0],
+                         ('PREPARE "windb2_find_geomkey_in_domain" (float8, float8, int) AS SELECT key FROM horizgeom '
+                          'WHERE geom4326 ~= st_setsrid(st_makepoint($1, $2), 4326) AND domainkey=$3 LIMIT 1', None))
+        self.assertEqual(curs.queries[1:], [('EXECUTE "windb2_find_geomkey_in_domain" (%s, %s, %s)', (-122.5, 37.5, i))
+                                            for i in range(3)])
+
+        # Each connection prepares its own
+        other = FakeCursor(FakeConnection())
+        statements.execute(other, 'find_geomkey_in_domain', (-122.5, 37.5, 1))
+        self.assertEqual(len(other.queries), 2)
+        self.assertEqual(statements.prepared(conn), {'windb2_find_geomkey_in_domain'})
+
+    def test_identifiers(self):
+        curs = FakeCursor(FakeConnection())
+        statements.execute(curs, 'delete_geomkey_times', (1, 't0', 't1'), table='u50m_3')
+        statements.execute(curs, 'delete_geomkey_times', (1, 't0', 't1'), table='v50m_3')
+        self.assertEqual(curs.queries[0][0], 'PREPARE "windb2_delete_geomkey_times_u50m_3" (int, timestamptz, '
+                                             'timestamptz) AS DELETE FROM "u50m_3" '
+                                             'WHERE geomkey=$1 AND t>=$2 AND t<=$3')
+        self.assertTrue(curs.queries[2][0].startswith('PREPARE "windb2_delete_geomkey_times_v50m_3"'))
+
+        # Names longer than PostgreSQL keeps are hashed
+        name = statements.statement_name('delete_geomkey_times', table='x' * 60)
+        self.assertEqual(len(name), len('windb2_') + 32)
+        self.assertNotEqual(name, statements.statement_name('delete_geomkey_times', table='x' * 61))
+
+    def test_parameter_count(self):
+        curs = FakeCursor(FakeConnection())
+        with self.assertRaises(ValueError):
+            statements.execute(curs, 'domain_key', ())
+        self.assertEqual(curs.queries, [])
+
+
+class TestPreparedLookups(unittest.TestCase):
+
+    def setUp(self):
+        self.db = windb2.WinDB2('localhost', 'windb2-test-1', dbUser='postgres')
+        self.db.connect()
+
+    def tearDown(self):
+        statements.deallocate(self.db.conn)
+        self.db.close()
+
+    def test_lookups(self):
+        for i in range(3):
+            self.assertIsNone(self.db.findDomainForDataName("no ' such domain"))
+            self.assertFalse(self.db.geomExists(-1, -122.5, 37.5))
+        self.db.curs.execute("SELECT name FROM pg_prepared_statements WHERE name LIKE 'windb2_%' ORDER BY name")
+        self.assertEqual([row[0] for row in self.db.curs.fetchall()],
+                         ['windb2_domain_key', 'windb2_find_geomkey_in_domain'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import json
+import unittest
+from datetime import date, datetime
+import pytz
+from windb2 import timerange, windb2
+
+
+class TestTimeRange(unittest.TestCase):
+
+    def test_month_bounds(self):
+        self.assertEqual(timerange.month_bounds(2016, 2),
+                         (datetime(2016, 2, 1, tzinfo=pytz.utc), datetime(2016, 3, 1, tzinfo=pytz.utc)))
+
+        # December ends at the start of the next year
+        self.assertEqual(timerange.month_bounds('2015', '12'),
+                         (datetime(2015, 12, 1, tzinfo=pytz.utc), datetime(2016, 1, 1, tzinfo=pytz.utc)))
+
+        # Months in other zones
+        pacific = pytz.timezone('America/Los_Angeles')
+        t0, t1 = timerange.month_bounds(2016, 3, pacific)
+        self.assertEqual((t0.utcoffset().total_seconds(), t1.utcoffset().total_seconds()), (-8 * 3600, -7 * 3600))
+
+    def test_day_bounds(self):
+        self.assertEqual(timerange.day_bounds(date(2016, 2, 29)),
+                         (datetime(2016, 2, 29, tzinfo=pytz.utc), datetime(2016, 3, 1, tzinfo=pytz.utc)))
+
+    def test_time_range(self):
+        t0, t1 = timerange.month_bounds(2016, 2)
+        sql, params = timerange.time_range('m.t', t0, t1)
+        self.assertEqual(sql, 'm.t>=%(t0)s AND m.t<%(t1)s')
+        self.assertEqual(params, {'t0': t0, 't1': t1})
+
+        sql, params = timerange.time_range('t', t0, t1, name='init')
+        self.assertEqual(sql, 't>=%(init0)s AND t<%(init1)s')
+        self.assertEqual(sorted(params), ['init0', 'init1'])
+
+
+class TestTimeRangeIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.db = windb2.WinDB2('localhost', 'windb2-test-1', dbUser='postgres')
+        self.db.connect()
+        self.db.curs.execute("CREATE TEMP TABLE wind_timerange (LIKE geovariable INCLUDING DEFAULTS, speed real)")
+        self.db.curs.execute("CREATE UNIQUE INDEX ON wind_timerange (domainkey, geomkey, t, height)")
+        self.db.curs.execute("INSERT INTO wind_timerange (domainkey, geomkey, t, height, speed) "
+                             "SELECT 1, g, t, 10, 5 FROM generate_series(1, 10) AS g, "
+                             "generate_series(timestamptz '2016-01-01 00:00+00', '2016-04-01 00:00+00', '1 hour') AS t")
+        self.db.curs.execute("ANALYZE wind_timerange")
+        self.db.curs.execute("SET enable_seqscan=off")
+
+    def tearDown(self):
+        self.db.conn.rollback()
+
+    def explain(self, sql, params):
+        self.db.curs.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = self.db.curs.fetchone()[0]
+        return plan if isinstance(plan, list) else json.loads(plan)
+
+    def test_index_cond(self):
+        where, params = timerange.time_range('t', *timerange.month_bounds(2016, 2))
+        plan = self.explain('SELECT speed FROM wind_timerange WHERE domainkey=1 AND geomkey=3 AND ' + where, params)
+
+        # The time range is part of the index condition rather than a filter on every row
+        node = plan[0]['Plan']
+        self.assertIn(node['Node Type'], ('Index Scan', 'Bitmap Heap Scan'))
+        if node['Node Type'] == 'Bitmap Heap Scan':
+            node = node['Plans'][0]
+        self.assertIn('t >=', node['Index Cond'])
+        self.assertIn('t <', node['Index Cond'])
+
+        # Only the rows in February
+        self.db.curs.execute('SELECT count(*) FROM wind_timerange WHERE domainkey=1 AND geomkey=3 AND ' + where, params)
+        self.assertEqual(self.db.curs.fetchone()[0], 29 * 24)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -43,6 +43,19 @@ class TestUtil(unittest.TestCase):
         # Fourth quadrant
         self.assertEqual(util.calc_dir_deg(-3, 3), 315)
 
+        # Arrays match the scalar version to the last bit or so, including the axes and float32 components
+        rng = numpy.random.RandomState(0)
+        u = numpy.concatenate((rng.standard_normal(1000) * 8, [0, 0, 0, 3, -3, -0.]))
+        v = numpy.concatenate((rng.standard_normal(1000) * 8, [0, 3, -3, 0, 0, 0]))
+        for dtype in (numpy.float64, numpy.float32):
+            expected = [util.calc_dir_deg(ui, vi) for ui, vi in zip(u.astype(dtype), v.astype(dtype))]
+            numpy.testing.assert_allclose(util.calc_dir_deg(u.astype(dtype), v.astype(dtype)), expected, rtol=1e-14)
+
+        # Any shape, broadcasting and an output buffer
+        out = numpy.empty((2, 3))
+        self.assertIs(util.calc_dir_deg([[3], [-3]], [3, -3, 0], out=out), out)
+        numpy.testing.assert_array_equal(out, [[45, 135, 90], [315, 225, 270]])
+
     def testGetDegFromCardinal(self):
 
         # Valid case
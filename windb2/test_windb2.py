@@ -1,4 +1,8 @@
 import unittest
+from contextlib import contextmanager
+from datetime import datetime
+import numpy
+import pytz
 from windb2 import windb2
 
 class TestHeightInterpMethods(unittest.TestCase):
@@ -11,5 +15,124 @@ class TestHeightInterpMethods(unittest.TestCase):
         self.assertFalse(self.db.table_exists('non_existent_table'))
         self.assertTrue(self.db.table_exists('domain'))
 
+    def test_filter_times(self):
+        times = ['2016-02-14_0{}:00:00'.format(h) for h in range(6)]
+
+        # Filtering twice on the same connection works and keeps the order of the times
+        for i in range(2):
+            filtered = self.db.filterTimes(times, '%Y-%m-%d_%H:%M:%S', sqlWhere="extract(hour from t) % 2 = 1")
+            self.assertEqual(filtered, [datetime(2016, 2, 14, h, tzinfo=pytz.utc) for h in (1, 3, 5)])
+
+    def test_fetch_array(self):
+        sql = "SELECT " + windb2.EPOCH_US_SQL.format('t') + ", extract(hour from t), NULL " \
+              "FROM generate_series(timestamptz '2016-02-14 00:00+00', '2016-02-15 23:00+00', '1 hour') AS t"
+        data = windb2.fetch_array(self.db.conn, sql, [('t', 'datetime64[us]'), ('hour', 'i8'), ('empty', 'f8')],
+                                  itersize=10)
+        self.assertEqual(data['t'][1], numpy.datetime64('2016-02-14T01:00'))
+        numpy.testing.assert_array_equal(data['hour'], numpy.tile(numpy.arange(24), 2))
+        self.assertTrue(numpy.isnan(data['empty']).all())
+
+    def test_find_geomkey(self):
+        windb2.migrate_horizgeom(self.db.conn)
+
+        # Points in any projection get a geom4326 that can be looked up by long,lat
+        self.db.curs.execute("INSERT INTO horizgeom(domainkey, x, y, geom) "
+                             "VALUES (-1, 0, 0, st_transform(st_geomfromtext('POINT(-122.5 37.5)', 4326), 3857)) "
+                             "RETURNING key, st_x(geom4326), st_y(geom4326)")
+        key, longitude, latitude = self.db.curs.fetchone()
+        self.assertEqual(windb2.find_geomkey(self.db.curs, longitude, latitude, -1), key)
+        self.assertIsNone(windb2.find_geomkey(self.db.curs, longitude, latitude, -2))
+        self.db.conn.rollback()
+
     if __name__ == '__main__':
         unittest.main()
+
+
+class FakeNamedCursorConnection(object):
+    """Stands in for a psycopg2 connection with server-side cursors that return the rows given."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.fetches = []
+
+    @contextmanager
+    def cursor(self, name):
+        self.name = name
+        yield self
+
+    def execute(self, sql, params=None):
+        self.position = 0
+
+    def fetchmany(self, size):
+        self.fetches.append(size)
+        rows = self.rows[self.position:self.position + size]
+        self.position += size
+        return rows
+
+
+class TestFetchArray(unittest.TestCase):
+
+    def test_chunks(self):
+        rows = [(i * 3600 * 10**6, float(i) if i % 3 else None) for i in range(25)]
+        conn = FakeNamedCursorConnection(rows)
+        data = windb2.fetch_array(conn, 'SELECT', [('t', 'datetime64[us]'), ('speed', 'f8')], itersize=10)
+
+        # Fetched from a named cursor in chunks
+        self.assertTrue(conn.name.startswith('windb2_fetch_'))
+        self.assertEqual(conn.fetches, [10, 10, 10, 10])
+        self.assertEqual(data['t'][2], numpy.datetime64('1970-01-01T02:00'))
+        numpy.testing.assert_array_equal(data['speed'][:4], [numpy.nan, 1, 2, numpy.nan])
+
+        # No rows
+        self.assertEqual(windb2.fetch_array(FakeNamedCursorConnection([]), 'SELECT', [('t', 'f8')]).shape, (0,))
+
+
+class TestWinDB2Pool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = windb2.WinDB2Pool('localhost', 'windb2-test-1', dbUser='postgres', minconn=1, maxconn=2)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_session(self):
+        # Each session reuses a pooled connection that is already in UTC
+        for i in range(3):
+            with self.pool.session() as db:
+                self.assertTrue(db.table_exists('domain'))
+                with db.cursor() as curs:
+                    curs.execute('SHOW TIMEZONE')
+                    self.assertEqual(curs.fetchone()[0], 'UTC')
+
+    def test_rollback(self):
+        with self.assertRaises(ZeroDivisionError):
+            with self.pool.cursor() as curs:
+                curs.execute('CREATE TEMP TABLE pool_rollback (i int)')
+                1 / 0
+        with self.pool.cursor() as curs:
+            curs.execute("SELECT to_regclass('pool_rollback')")
+            self.assertIsNone(curs.fetchone()[0])
+
+
+class TestFilterTimes(unittest.TestCase):
+
+    def test_parse_times(self):
+        expected = [datetime(2016, 2, 14, h, 30, tzinfo=pytz.utc) for h in range(3)]
+
+        # Characters like the WRF Times variable, strings and bytes
+        wrf_times = numpy.array([list('2016-02-14_0{}:30:00'.format(h)) for h in range(3)], 'S1')
+        self.assertEqual(windb2.parse_times(wrf_times, '%Y-%m-%d_%H:%M:%S'), expected)
+        self.assertEqual(windb2.parse_times(['2016-02-14 0{}:30:00'.format(h) for h in range(3)],
+                                            '%Y-%m-%d %H:%M:%S'), expected)
+        self.assertEqual(windb2.parse_times(['30 0{} 14/02/16'.format(h).encode() for h in range(3)],
+                                            '%M %H %d/%m/%y'), expected)
+        self.assertEqual(windb2.parse_times([], '%Y'), [])
+
+        with self.assertRaises(ValueError):
+            windb2.parse_times(['2016-02-14 25:00:00'], '%Y-%m-%d %H:%M:%S')
+
+    def test_filter_times_without_where(self):
+        # Doesn't need a connection to the database
+        db = windb2.WinDB2('localhost', 'windb2-test-1')
+        self.assertEqual(db.filterTimes(['2016-02-14_00:00:00'], '%Y-%m-%d_%H:%M:%S'),
+                         [datetime(2016, 2, 14, tzinfo=pytz.utc)])
@@ -0,0 +1,52 @@
+"""Builds sargable time filters for WinDB2 queries. Filtering with date_part('month', t), t::date or
+t at time zone 'UTC' hides t inside an expression, so PostgreSQL can't use the (domainkey, geomkey, t, height) index or
+prune time partitions. These helpers turn calendar periods into half-open t>=t0 AND t<t1 ranges on the bare column,
+with the times passed as bound parameters."""
+
+from datetime import datetime, timedelta
+
+import pytz
+
+
+def month_bounds(year, month, tz=pytz.utc):
+    """Returns the start inclusive and end exclusive datetimes of a month.
+
+    year, month - Month to get the bounds of
+    tz - Time zone the month is in
+    """
+
+    t0 = tz.localize(datetime(int(year), int(month), 1))
+    t1 = tz.localize(datetime(int(year) + int(month) // 12, int(month) % 12 + 1, 1))
+    return t0, t1
+
+
+def day_bounds(day, tz=pytz.utc):
+    """Returns the start inclusive and end exclusive datetimes of a day.
+
+    day - datetime.date of the day
+    tz - Time zone the day is in
+    """
+
+    t0 = tz.localize(datetime(day.year, day.month, day.day))
+    t1 = tz.localize(datetime(day.year, day.month, day.day) + timedelta(days=1))
+    return t0, t1
+
+
+def time_range(column, t0, t1, name='t'):
+    """Returns the SQL and the parameters for a half-open time range on a column, to be combined with other
+    conditions and run with curs.execute(sql, params), e.g.
+
+        where, params = time_range('m.t', *month_bounds(2016, 2))
+        curs.execute('SELECT count(*) FROM wind_1 m WHERE m.geomkey=%(geomkey)s AND ' + where,
+                     dict(params, geomkey=geomkey))
+
+    column - Timestamp column to filter e.g. 't' or 'm.t'
+    t0 - Start time inclusive, a datetime with a time zone
+    t1 - End time exclusive, a datetime with a time zone
+    name - Prefix of the parameter names, so that more than one range can be used in a query
+
+    returns sql, params - The condition with %(<name>0)s and %(<name>1)s placeholders, and a dict of the times
+    """
+
+    sql = '{0}>=%({1}0)s AND {0}<%({1}1)s'.format(column, name)
+    return sql, {name + '0': t0, name + '1': t1}
@@ -4,6 +4,10 @@ from datetime import datetime
 import pytz
 import numpy
 
+# Types that are handled as arrays rather than scalars
+ARRAY_TYPES = (numpy.ndarray, list, tuple)
+
+
 def speed(uWind, vWind):
     """Returns wind speed from orthogonal (u and v) wind components which can be scalars, lists, or numpy.arrays."""
 
@@ -65,23 +69,34 @@ def v_met(speed, direction):
     return -v_flow(speed, direction)
 
 
-def calc_dir_deg(u, v):
+def calc_dir_deg(u, v, out=None):
     """Calculates the direction from the orthogonal wind components.
     *
-    * u U wind scalar velocity.
-    * v V wind scalar velocity.
+    * u U wind scalar velocity or numpy.array of velocities.
+    * v V wind scalar velocity or numpy.array of velocities, which is broadcast against u.
+    * out Optional float numpy.array of the broadcast shape to write the directions into.
 
-    * Returns he direction that a flow is going (i.e. not wind direction which is 180 degrees opposite).
+    * Returns he direction that a flow is going (i.e. not wind direction which is 180 degrees opposite). A float for
+    * scalars, otherwise a float64 numpy.array (or out).
     """
 
     import math
 
-    # Calculate the direction and round it into a integer
-    direction = math.degrees(math.atan2(u, v))
+    if out is None and not isinstance(u, ARRAY_TYPES) and not isinstance(v, ARRAY_TYPES):
+
+        # Calculate the direction and round it into a integer
+        direction = math.degrees(math.atan2(u, v))
+
+        # Convert to a positive direction
+        if direction < 0:
+            direction += 360
+
+        return direction
 
-    # Convert to a positive direction
-    if direction < 0:
-        direction += 360
+    # Same calculation for every element at once, in double precision like math.atan2
+    direction = numpy.arctan2(u, v, out=out, dtype=numpy.float64)
+    numpy.degrees(direction, out=direction)
+    numpy.add(direction, 360, out=direction, where=direction < 0)
 
     return direction
 
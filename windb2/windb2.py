@@ -1,9 +1,154 @@
+import itertools
 import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
 import sys
+from contextlib import contextmanager
 from datetime import datetime
 import pytz
 import numpy
 import logging
+import os
+from windb2 import statements
+
+# Time formats that NumPy can parse itself once the date and time are joined with a 'T'
+ISO_TIME_FORMATS = ('%Y-%m-%d_%H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S')
+
+
+def parse_times(timesArray, timeFormat):
+    """Converts an array of UTC timestamp strings, or of their characters like the WRF Times variable, to datetimes.
+
+    timesArray - Array of strings, bytes, or arrays of characters
+    timeFormat - String of the timestamp format in Python datetime.datetime syntax e.g. '%Y-%m-%d %H:%M:%S'
+
+    Returns a list of datetimes in UTC
+    """
+
+    # Join the characters of each time into one string
+    times = numpy.asarray(timesArray)
+    if times.size == 0:
+        return []
+    if times.ndim == 2:
+        times = numpy.ascontiguousarray(times).view('{}{}'.format(times.dtype.kind, times.shape[1]))[:, 0]
+    if times.dtype.kind == 'S':
+        times = numpy.char.decode(times, 'utf-8')
+
+    # Let NumPy parse all of the common formats at once
+    if timeFormat in ISO_TIME_FORMATS and (numpy.char.str_len(times) == len('YYYY-mm-ddTHH:MM:SS')).all():
+        try:
+            parsed = numpy.char.replace(times, timeFormat[8], 'T').astype('datetime64[us]')
+        except ValueError:
+            pass
+        else:
+            if not numpy.isnat(parsed).any():
+                return [t.replace(tzinfo=pytz.utc) for t in parsed.astype(object)]
+
+    parsed = []
+    for t in times:
+        try:
+            parsed.append(datetime.strptime(t, timeFormat).replace(tzinfo=pytz.utc))
+        except ValueError:
+            logging.getLogger('windb2').error('Unable to convert string: {} to a date time using format {}'
+                                              ''.format(t, timeFormat))
+            raise
+    return parsed
+
+
+# Number of rows fetched from a server-side cursor at a time by fetch_array
+FETCH_ITERSIZE = 10000
+
+# SQL for a timestamp column as microseconds since the Unix epoch, which fetch_array decodes into a datetime64[us] field
+EPOCH_US_SQL = "(extract(epoch from {}) * 1000000)::bigint"
+
+# Unique names for the server-side cursors
+_cursor_ids = itertools.count()
+
+
+def fetch_array(conn, sql, dtype, params=None, itersize=FETCH_ITERSIZE):
+    """Runs a query on a server-side cursor and decodes the rows into a NumPy structured array itersize rows at a
+    time, so that only one chunk of rows is ever held as Python objects.
+
+    conn - psycopg2 connection
+    sql - Query to run
+    dtype - NumPy structured dtype with a field for each column in the query. NULLs become NaN in float fields, and
+            datetime64[us] fields should be selected with EPOCH_US_SQL.
+    params - Parameters for the query
+    itersize - Number of rows to fetch from the database at a time
+
+    Returns a structured numpy.array with a row for each row returned by the query
+    """
+
+    dtype = numpy.dtype(dtype)
+    chunks = []
+    with conn.cursor('windb2_fetch_{}'.format(next(_cursor_ids))) as curs:
+        curs.itersize = itersize
+        curs.execute(sql, params)
+        rows = curs.fetchmany(itersize)
+        while rows:
+            chunks.append(numpy.array(rows, dtype))
+            rows = curs.fetchmany(itersize)
+
+    if not chunks:
+        return numpy.empty(0, dtype)
+    return numpy.concatenate(chunks)
+
+
+# Migration that adds geom4326 and the spatial indexes to the horizgeom table of an existing WinDB2
+HORIZGEOM_MIGRATION = 'schema/migrate/add-horizgeom-geom4326-and-indexes.sql'
+
+
+def migrate_horizgeom(conn):
+    """Adds the geom4326 column, its trigger and the GiST and (domainkey, x, y) indexes to the horizgeom table of a WinDB2
+    created before they were part of the schema. Running it again only rebuilds the (domainkey, x, y) index.
+
+    conn - psycopg2 connection
+    """
+
+    home = os.environ.get('WINDB2_HOME', os.path.join(os.path.dirname(__file__), '..'))
+    with open(os.path.join(home, HORIZGEOM_MIGRATION)) as f:
+        sql = f.read()
+    with conn.cursor() as curs:
+        curs.execute(sql)
+    conn.commit()
+
+
+def find_geomkey(curs, longitude, latitude, domain=None):
+    """Returns the key of the horizgeom point at exactly a long,lat, or None if there isn't one. The lookup is an index
+    scan on geom4326, prepared once per connection.
+
+    curs - psycopg2 cursor
+    longitude, latitude - Location of the point in degrees
+    domain - Only looks for the point in this domain
+    """
+
+    if domain is None:
+        statements.execute(curs, 'find_geomkey', (float(longitude), float(latitude)))
+    else:
+        statements.execute(curs, 'find_geomkey_in_domain', (float(longitude), float(latitude), int(domain)))
+    row = curs.fetchone()
+    return None if row is None else row[0]
+
+
+def make_dsn(dbHost, dbName, dbUser="postgres", port=5432):
+    """Returns the libpq connection string for a WinDB2."""
+
+    DSN = 'dbname={} user={} port={}'.format(dbName, dbUser, port)
+    if dbHost != 'localhost': # psycopg2 will connect to the unix socket if host isn't specified
+        DSN += ' host={}'.format(dbHost)
+    return DSN
+
+
+class UTCConnection(psycopg2.extensions.connection):
+    """psycopg2 connection that sets the session time zone to UTC once, when it is first opened."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # Always use UTC for the time zone
+        with self.cursor() as curs:
+            curs.execute('SET TIME ZONE \'UTC\'')
+        self.commit()
+
 
 class WinDB2:
     """Used to connect to a PostGIS WinDB. Contains all utility functions needed to interact with the WinDB."""
@@ -25,9 +170,7 @@ class WinDB2:
         """
         
         ## Open the database
-        DSN = 'dbname={} user={} port={}'.format(self._dbName, self._dbUser, self._port)
-        if self._dbHost != 'localhost': # psycopg2 will connect to the unix socket if host isn't specified
-            DSN += ' host={}'.format(self._dbHost)
+        DSN = make_dsn(self._dbHost, self._dbName, self._dbUser, self._port)
         print("Opening connection using dns:", DSN)
         self.conn = psycopg2.connect(DSN)
         print("Encoding for this connection is", self.conn.encoding)
@@ -46,6 +189,20 @@ class WinDB2:
         """Closes the connection."""
         
         self.conn.close()
+
+    @contextmanager
+    def cursor(self, name=None):
+        """Context manager for a new cursor on this connection, which is closed on the way out. Use this instead of
+        sharing self.curs when more than one query is in flight.
+
+        name - Name of a server-side cursor, or None for a regular client-side cursor
+        """
+
+        curs = self.conn.cursor(name)
+        try:
+            yield curs
+        finally:
+            curs.close()
     
     
     def createDomainkeyGeomkeyTimeHeightIndex(self, curs, conn, domainKey):
@@ -76,8 +233,7 @@ class WinDB2:
         otherwise."""
         
         # Make sure a 'dataName' table does not already exist, get the key if it does
-        sql = "SELECT key FROM domain WHERE name='" + dataName + "'"
-        self.curs.execute(sql)
+        statements.execute(self.curs, 'domain_key', (dataName,))
 
         # Return the domain, otherwise None if no domain existed
         if self.curs.rowcount:
@@ -107,9 +263,38 @@ class WinDB2:
         else:
             return False
 
+    def fetch_timeseries(self, domain, geomkey, height, t0, t1, columns=('speed', 'direction'), table='wind',
+                         itersize=FETCH_ITERSIZE):
+        """Gets the time series at a point in a domain, decoded straight into a NumPy array (see fetch_array) so that
+        long series can be extracted in bounded memory.
+
+        domain - Domain key
+        geomkey - Geomkey of the point
+        height - Height of the data
+        t0 - Start time inclusive, a datetime with a time zone
+        t1 - End time exclusive, a datetime with a time zone
+        columns - Names of the numeric columns to get, which are converted to float64 with NULLs as NaN
+        table - Name of the variable table without the domain key e.g. 'wind'
+        itersize - Number of rows to fetch from the database at a time
+
+        Returns a structured numpy.array ordered by time, with a datetime64[us] field 't' in UTC and a field for each
+        column
+        """
+
+        sql = "SELECT {}, {} FROM {}_{} WHERE geomkey=%s AND height=%s AND t>=%s AND t<%s ORDER BY t" \
+              "".format(EPOCH_US_SQL.format('t'), ', '.join(columns), table, domain)
+        self.logger.debug(sql)
+        dtype = [('t', 'datetime64[us]')] + [(column, numpy.float64) for column in columns]
+
+        return fetch_array(self.conn, sql, dtype, (geomkey, height, t0, t1), itersize)
+
     def filterTimes(self, timesArray, timeFormat, sqlWhere='true'):
         """Uses the WinDB2 to filter out unwanted tide times. If sqlWhere is left blank, this function
-        simply ends up converting the times into a datatime objects for easier manipulation.
+        simply ends up converting the times into a datatime objects for easier manipulation, without
+        going to the database at all.
+
+        The times are sent to the database as one array and filtered in a single query, so the sqlWhere
+        can refer to each time as t (or time_filter.t).
 
         windb - WinDB2 object that has already been connected with windb2.connect()
         timesArray - Array of strings to timestamps to convert, which MUST BE IN UTC
@@ -117,63 +302,103 @@ class WinDB2:
         sqlWhere - SQL WHERE statement to be used as the filter (presumably referring to times with time zones),
                    returns everything if true
 
-        Returns as array of datetimes
+        Returns as array of datetimes in the same order as the timesArray
         """
 
-        # Debug
-        #print 'timesArray=', ''.join(timesArray[0])
-
-        # Create a temp table to insert the data into
-        sql = "CREATE TEMP TABLE time_filter ( t TIMESTAMP WITH TIME ZONE )"
-        self.curs.execute(sql)
-
-        # Insert the data
-        for t in timesArray:
+        times = parse_times(timesArray, timeFormat)
 
-            # Debug
-            #print 'time to convert=', ''.join(t)
-
-            # Try and parse the datetime
-            try:
-                datetimeObj = datetime.strptime(b''.join(t).decode('utf-8'), timeFormat).replace(tzinfo=pytz.utc)
-
-            except:
-                print >> sys.stderr, "Unable to convert string: " + ''.join(t) + " to a date time using format " + timeFormat
-                raise
-
-            timePgsql = datetimeObj.strftime('%Y-%m-%d %H:%M:%S %Z')
-            sql = "INSERT INTO time_filter (t) VALUES (timestamp with time zone'" + timePgsql + "')"
-            self.curs.execute(sql)
+        # Nothing to filter
+        if sqlWhere.strip().lower() == 'true':
+            return times
 
         # Get only the times we want
-        sql = "SELECT t FROM time_filter WHERE " + sqlWhere
-        print(sql)
-        self.curs.execute(sql)
-
-        timeReturnArray = numpy.array(self.curs.fetchall())
+        sql = "SELECT t FROM unnest(%s::timestamp with time zone[]) WITH ORDINALITY AS time_filter(t, i) " \
+              "WHERE {} ORDER BY i".format(sqlWhere)
+        self.logger.debug(sql)
+        self.curs.execute(sql, (times,))
 
-        if timeReturnArray.shape[0] != 0:
-            return list(timeReturnArray[:,0])
-        else:
-            return []
+        return [row[0] for row in self.curs.fetchall()]
 
     def geomExists(self, domain, longitude, latitude):
         """Checks to see if the point exists. Returns the geomkey if true and false if not."""
 
-        sql = "SELECT key FROM horizgeom WHERE ST_X(geom)=longitude AND ST_Y(geom)=latitude LIMIT 1"
-        self.curs.execute(sql)
-        result = self.curs.fetchone()
+        result = find_geomkey(self.curs, longitude, latitude, domain)
         if result is None:
             return False
         else:
-            return result[0]
+            return result
 
     def get_resolution(self, domain):
         """Returns the resolution of the domain and the units"""
-        sql = "SELECT resolution, units FROM domain WHERE key={}".format(domain)
-        self.curs.execute(sql)
+        statements.execute(self.curs, 'domain_resolution', (int(domain),))
         result = self.curs.fetchone()
         if result is None:
             return False
         else:
             return result[0], result[1]
+
+
+class WinDB2Pool:
+    """Thread-safe pool of connections to a WinDB2, so that threads and tasks can share a bounded number of
+    connections instead of each opening their own. The session is set to UTC once when each connection is opened.
+
+    dbHost, dbName, dbUser, port - WinDB2 to connect to
+    minconn - Number of connections to open up front
+    maxconn - Maximum number of connections open at once. Asking for more raises a psycopg2.pool.PoolError.
+    """
+
+    def __init__(self, dbHost, dbName, dbUser="postgres", port=5432, minconn=1, maxconn=4):
+        self._dbHost = dbHost
+        self._dbName = dbName
+        self._dbUser = dbUser
+        self._port = port
+        self.pool = psycopg2.pool.ThreadedConnectionPool(minconn, maxconn, make_dsn(dbHost, dbName, dbUser, port),
+                                                         connection_factory=UTCConnection)
+
+        # Logging
+        self.logger = logging.getLogger('windb2')
+
+    @contextmanager
+    def connection(self):
+        """Context manager for a connection from the pool. The transaction is committed if the block succeeds and
+        rolled back if it raises, then the connection is returned to the pool."""
+
+        conn = self.pool.getconn()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self.pool.putconn(conn)
+
+    @contextmanager
+    def cursor(self, name=None):
+        """Context manager for a cursor on a connection from the pool, see connection.
+
+        name - Name of a server-side cursor, or None for a regular client-side cursor
+        """
+
+        with self.connection() as conn:
+            with conn.cursor(name) as curs:
+                yield curs
+
+    @contextmanager
+    def session(self):
+        """Context manager for a WinDB2 on a connection from the pool, for code that expects a connected WinDB2 (e.g.
+        the inserters). Don't close the WinDB2, the connection goes back to the pool at the end of the block."""
+
+        with self.connection() as conn:
+            db = WinDB2(self._dbHost, self._dbName, self._dbUser, self._port)
+            db.conn = conn
+            db.curs = conn.cursor()
+            try:
+                yield db
+            finally:
+                db.curs.close()
+
+    def close(self):
+        """Closes all of the connections in the pool."""
+
+        self.pool.closeall()